@@ -1,2324 +1,5047 @@
-import os
-import sys
-import sqlite3
-import csv
-import asyncio
-from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes, ConversationHandler
-# Загружаем .env файл
-from dotenv import load_dotenv
-import os
-
-# Пробуем загрузить из .env, если нет - из bot.env
-dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
-if not os.path.exists(dotenv_path):
-    dotenv_path = os.path.join(os.path.dirname(__file__), 'bot.env')
-    print(f"Использую bot.env: {dotenv_path}")
-
-load_dotenv(dotenv_path)
-print(f"Загружен файл: {dotenv_path}")
-
-# ========== НАСТРОЙКИ ==========
-TOKEN = os.environ.get('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
-ADMIN_ID = 1121098820  # ⬅️ ЗАМЕНИТЕ НА ВАШ TELEGRAM ID!
-
-if TOKEN == 'YOUR_BOT_TOKEN_HERE':
-    raise ValueError("❌ Токен бота не найден! Установите BOT_TOKEN в Railway")
-
-DB_NAME = "volunteer_bot.db"
-CSV_FILE = "volunteers.csv"
-
-# Состояния для ConversationHandler
-EDITING_INFO, ADDING_EVENT, EDITING_EVENT, MANAGE_EVENT, EDIT_EVENT_DETAILS, ADDING_COMMENT = range(6)
-
-print(f"🚀 Бот запускается...")
-print(f"👑 Админ ID: {ADMIN_ID}")
-
-# ========== ИНИЦИАЛИЗАЦИЯ БАЗЫ ДАННЫХ И CSV ==========
-def init_db():
-    """Инициализирует базу данных"""
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    cur.executescript('''
-        CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            date TEXT NOT NULL,
-            time TEXT NOT NULL,
-            location TEXT,
-            max_volunteers INTEGER,
-            is_active BOOLEAN DEFAULT 1,
-            registration_open BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        
-        CREATE TABLE IF NOT EXISTS users (
-            telegram_id INTEGER PRIMARY KEY,
-            full_name TEXT NOT NULL,
-            group_name TEXT,
-            birth_date TEXT,
-            phone_number TEXT,
-            username TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        
-        CREATE TABLE IF NOT EXISTS registrations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            event_id INTEGER NOT NULL,
-            comment TEXT,
-            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (telegram_id),
-            FOREIGN KEY (event_id) REFERENCES events (id),
-            UNIQUE(user_id, event_id)
-        );
-    ''')
-    
-    conn.commit()
-    conn.close()
-    print("✅ База данных инициализирована")
-
-def init_csv():
-    """Создает CSV файл с заголовками"""
-    if not os.path.exists(CSV_FILE):
-        with open(CSV_FILE, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                'ID записи', 'Дата записи', 'Время записи',
-                'Telegram ID', 'ФИО', 'Группа', 'Дата рождения', 'Телефон', 'Username',
-                'ID мероприятия', 'Название мероприятия',
-                'Дата мероприятия', 'Время мероприятия', 'Место',
-                'Комментарий к записи',
-                'Статус записи'
-            ])
-        print(f"✅ Создан CSV файл: {CSV_FILE}")
-
-def save_to_csv(user_data, event_data, comment='', status='Записан'):
-    """Сохраняет запись в CSV файл"""
-    try:
-        row = [
-            user_data.get('registration_id', ''),
-            datetime.now().strftime('%Y-%m-%d'),
-            datetime.now().strftime('%H:%M:%S'),
-            user_data.get('telegram_id', ''),
-            user_data.get('full_name', ''),
-            user_data.get('group', ''),
-            user_data.get('birth_date', ''),
-            user_data.get('phone', ''),
-            user_data.get('username', ''),
-            event_data.get('id', ''),
-            event_data.get('title', ''),
-            event_data.get('date', ''),
-            event_data.get('time', ''),
-            event_data.get('location', ''),
-            comment,
-            status
-        ]
-        
-        with open(CSV_FILE, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(row)
-        
-        print(f"✅ Запись {user_data.get('registration_id')} сохранена в CSV со статусом: {status}")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Ошибка сохранения в CSV: {e}")
-        return False
-
-def update_csv_status(registration_id, new_status):
-    """Обновляет статус записи в CSV файле"""
-    try:
-        # Читаем весь файл
-        rows = []
-        with open(CSV_FILE, 'r', newline='', encoding='utf-8') as infile:
-            reader = csv.reader(infile)
-            header = next(reader)
-            rows.append(header)
-            
-            for row in reader:
-                if len(row) > 0 and row[0] == str(registration_id):
-                    row[-1] = new_status  # Обновляем статус
-                    print(f"✅ Обновлена запись {registration_id} в CSV: {new_status}")
-                rows.append(row)
-        
-        # Записываем обратно
-        with open(CSV_FILE, 'w', newline='', encoding='utf-8') as outfile:
-            writer = csv.writer(outfile)
-            writer.writerows(rows)
-        
-        return True
-        
-    except Exception as e:
-        print(f"❌ Ошибка обновления CSV: {e}")
-        return False
-
-def delete_from_csv(registration_id):
-    """Удаляет запись из CSV файла"""
-    try:
-        # Читаем весь файл
-        rows = []
-        with open(CSV_FILE, 'r', newline='', encoding='utf-8') as infile:
-            reader = csv.reader(infile)
-            header = next(reader)
-            rows.append(header)
-            
-            deleted = False
-            for row in reader:
-                if len(row) > 0 and row[0] == str(registration_id):
-                    deleted = True
-                    print(f"✅ Удалена запись {registration_id} из CSV")
-                else:
-                    rows.append(row)
-        
-        # Записываем обратно
-        with open(CSV_FILE, 'w', newline='', encoding='utf-8') as outfile:
-            writer = csv.writer(outfile)
-            writer.writerows(rows)
-        
-        return deleted
-        
-    except Exception as e:
-        print(f"❌ Ошибка удаления из CSV: {e}")
-        return False
-
-def count_csv_lines():
-    """Считает количество записей в CSV"""
-    if os.path.exists(CSV_FILE):
-        with open(CSV_FILE, 'r', encoding='utf-8') as f:
-            return sum(1 for line in f) - 1
-    return 0
-
-def get_event_csv(event_id):
-    """Создает CSV файл для конкретного мероприятия"""
-    try:
-        # Создаем уникальное имя файла
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        event_file = f"event_{event_id}_{timestamp}.csv"
-        
-        conn = sqlite3.connect(DB_NAME)
-        cur = conn.cursor()
-        
-        # Получаем информацию о мероприятии
-        cur.execute('SELECT title, date, time, location FROM events WHERE id = ?', (event_id,))
-        event = cur.fetchone()
-        
-        if not event:
-            return None
-        
-        event_title, event_date, event_time, event_location = event
-        
-        # Получаем всех записанных на мероприятие
-        cur.execute('''
-            SELECT registrations.id, registrations.registration_date, registrations.comment,
-                   users.telegram_id, users.full_name, users.group_name, 
-                   users.birth_date, users.phone_number, users.username
-            FROM registrations
-            JOIN users ON registrations.user_id = users.telegram_id
-            WHERE registrations.event_id = ?
-            ORDER BY registrations.registration_date
-        ''', (event_id,))
-        
-        registrations = cur.fetchall()
-        conn.close()
-        
-        # Создаем CSV файл
-        with open(event_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            # Записываем заголовок мероприятия
-            writer.writerow([f"Мероприятие: {event_title}"])
-            writer.writerow([f"Дата: {event_date} Время: {event_time}"])
-            writer.writerow([f"Место: {event_location}"])
-            writer.writerow([])
-            
-            # Записываем заголовки таблицы
-            writer.writerow([
-                'ID записи', 'Дата и время записи', 'ФИО', 'Группа', 
-                'Дата рождения', 'Телефон', 'Username', 'Комментарий'
-            ])
-            
-            # Записываем данные
-            for reg in registrations:
-                reg_id, reg_date, comment, user_id, full_name, group_name, birth_date, phone, username = reg
-                writer.writerow([
-                    reg_id, reg_date, full_name, group_name or '',
-                    birth_date or '', phone or '', username or '', comment or ''
-                ])
-        
-        print(f"✅ Создан CSV файл для мероприятия {event_id}: {event_file}")
-        return event_file
-        
-    except Exception as e:
-        print(f"❌ Ошибка создания CSV для мероприятия: {e}")
-        return None
-
-# ========== ФУНКЦИИ ДЛЯ РАБОТЫ С БАЗОЙ ==========
-def get_active_events():
-    """Получает список активных мероприятий (только для пользователей)"""
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT events.id, events.title, events.date, events.time, events.location, 
-               events.max_volunteers, events.description,
-               (events.max_volunteers - COUNT(registrations.id)) as available_spots
-        FROM events
-        LEFT JOIN registrations ON events.id = registrations.event_id
-        WHERE events.is_active = 1 
-          AND events.registration_open = 1
-          AND events.date >= date('now')
-        GROUP BY events.id
-        HAVING available_spots > 0 OR events.max_volunteers IS NULL OR events.max_volunteers = 0
-        ORDER BY events.date, events.time
-    ''')
-    events = cur.fetchall()
-    conn.close()
-    return events
-
-def get_all_events_admin():
-    """Получает ВСЕ мероприятия для админа"""
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT id, title, date, time, location, max_volunteers, description,
-               is_active, registration_open,
-               (SELECT COUNT(*) FROM registrations WHERE event_id = events.id) as registered
-        FROM events
-        ORDER BY date, time
-    ''')
-    events = cur.fetchall()
-    conn.close()
-    return events
-
-def get_user_registrations(user_id):
-    """Получает записи пользователя"""
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT events.id, events.title, events.date, events.time, events.location,
-               registrations.id as registration_id, registrations.registration_date,
-               registrations.comment
-        FROM registrations
-        JOIN events ON registrations.event_id = events.id
-        WHERE registrations.user_id = ? AND events.date >= date('now') AND events.is_active = 1
-        ORDER BY events.date, events.time
-    ''', (user_id,))
-    events = cur.fetchall()
-    conn.close()
-    return events
-
-def toggle_event_registration(event_id):
-    """Открывает/закрывает запись на мероприятие"""
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    cur.execute('SELECT registration_open FROM events WHERE id = ?', (event_id,))
-    current = cur.fetchone()[0]
-    new_value = 0 if current == 1 else 1
-    cur.execute('UPDATE events SET registration_open = ? WHERE id = ?', (new_value, event_id))
-    conn.commit()
-    conn.close()
-    return new_value == 1  # True если запись открыта, False если закрыта
-
-def toggle_event_active_status(event_id):
-    """Активирует/деактивирует мероприятие"""
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    cur.execute('SELECT is_active FROM events WHERE id = ?', (event_id,))
-    current = cur.fetchone()[0]
-    new_value = 0 if current == 1 else 1
-    cur.execute('UPDATE events SET is_active = ? WHERE id = ?', (new_value, event_id))
-    conn.commit()
-    conn.close()
-    return new_value == 1  # True если активно, False если неактивно
-
-def delete_event(event_id):
-    """Удаляет мероприятие"""
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    # Получаем все записи на это мероприятие для удаления из CSV
-    cur.execute('SELECT id FROM registrations WHERE event_id = ?', (event_id,))
-    registration_ids = [row[0] for row in cur.fetchall()]
-    
-    # Сначала удаляем все записи на это мероприятие
-    cur.execute('DELETE FROM registrations WHERE event_id = ?', (event_id,))
-    # Затем удаляем само мероприятие
-    cur.execute('DELETE FROM events WHERE id = ?', (event_id,))
-    deleted = cur.rowcount
-    
-    conn.commit()
-    conn.close()
-    
-    # Удаляем записи из CSV
-    for reg_id in registration_ids:
-        delete_from_csv(reg_id)
-    
-    return deleted > 0
-
-def get_event_details(event_id):
-    """Получает детали мероприятия"""
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT title, description, date, time, location, max_volunteers, 
-               is_active, registration_open
-        FROM events WHERE id = ?
-    ''', (event_id,))
-    event = cur.fetchone()
-    conn.close()
-    return event
-
-def update_event(event_id, field, value):
-    """Обновляет поле мероприятия"""
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    if field == 'title':
-        cur.execute('UPDATE events SET title = ? WHERE id = ?', (value, event_id))
-    elif field == 'description':
-        cur.execute('UPDATE events SET description = ? WHERE id = ?', (value, event_id))
-    elif field == 'date':
-        cur.execute('UPDATE events SET date = ? WHERE id = ?', (value, event_id))
-    elif field == 'time':
-        cur.execute('UPDATE events SET time = ? WHERE id = ?', (value, event_id))
-    elif field == 'location':
-        cur.execute('UPDATE events SET location = ? WHERE id = ?', (value, event_id))
-    elif field == 'max_volunteers':
-        cur.execute('UPDATE events SET max_volunteers = ? WHERE id = ?', (int(value), event_id))
-    
-    conn.commit()
-    conn.close()
-    return True
-
-def get_registration_info(registration_id):
-    """Получает информацию о записи"""
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT registrations.id, registrations.user_id, registrations.event_id, registrations.comment,
-               users.full_name, users.group_name, users.birth_date, users.phone_number, users.username,
-               events.title, events.date, events.time, events.location
-        FROM registrations
-        JOIN users ON registrations.user_id = users.telegram_id
-        JOIN events ON registrations.event_id = events.id
-        WHERE registrations.id = ?
-    ''', (registration_id,))
-    registration = cur.fetchone()
-    conn.close()
-    return registration
-
-def cancel_registration_db(registration_id):
-    """Отменяет запись в базе данных"""
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    # Получаем информацию о записи перед удалением
-    cur.execute('''
-        SELECT user_id, event_id FROM registrations WHERE id = ?
-    ''', (registration_id,))
-    result = cur.fetchone()
-    
-    if not result:
-        conn.close()
-        return None
-    
-    user_id, event_id = result
-    
-    # Удаляем запись
-    cur.execute('DELETE FROM registrations WHERE id = ?', (registration_id,))
-    deleted = cur.rowcount
-    conn.commit()
-    conn.close()
-    
-    if deleted > 0:
-        # Удаляем из CSV
-        delete_from_csv(registration_id)
-        return user_id, event_id
-    return None
-
-# ========== ОСНОВНЫЕ КОМАНДЫ БОТА ==========
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Начало работы с ботом"""
-    user = update.effective_user
-    
-    # Регистрируем пользователя в БД
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-        INSERT OR IGNORE INTO users (telegram_id, full_name, username) 
-        VALUES (?, ?, ?)
-    ''', (user.id, user.full_name, f"@{user.username}" if user.username else ""))
-    conn.commit()
-    conn.close()
-    
-    keyboard = [
-        [InlineKeyboardButton("📝 Записаться на мероприятие", callback_data='list_events')],
-        [InlineKeyboardButton("👤 Мои данные", callback_data='my_info')],
-        [InlineKeyboardButton("📋 Мои записи", callback_data='my_registrations')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
-        f"👋 Привет, {user.first_name}!\n\n"
-        "Я бот для записи на волонтерские мероприятия.\n"
-        "Сначала заполните свои данные, затем выбирайте мероприятия!",
-        reply_markup=reply_markup
-    )
-
-async def list_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает список активных мероприятий ДЛЯ ПОЛЬЗОВАТЕЛЕЙ"""
-    query = update.callback_query
-    await query.answer()
-    
-    events = get_active_events()
-    
-    if not events:
-        keyboard = [
-            [InlineKeyboardButton("👤 Мои данные", callback_data='my_info')],
-            [InlineKeyboardButton("📋 Мои записи", callback_data='my_registrations')],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data='main_menu')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            "📭 *На данный момент нет доступных мероприятий для записи.*\n\n"
-            "Загляните позже или свяжитесь с организаторами!",
-            reply_markup=reply_markup,
-            parse_mode='Markdown'
-        )
-        return
-    
-    # Создаем кнопки для мероприятий
-    keyboard = []
-    for event in events[:10]:
-        event_id, title, date, time, location, max_vol, desc, available = event
-        button_text = f"{title[:25]}..." if len(title) > 25 else title
-        button_text += f" ({date})"
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f'event_{event_id}')])
-    
-    keyboard.append([InlineKeyboardButton("👤 Мои данные", callback_data='my_info')])
-    keyboard.append([InlineKeyboardButton("🏠 В главное меню", callback_data='main_menu')])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # Формируем текст со списком мероприятий
-    events_text = "📅 *Доступные мероприятия для записи:*\n\n"
-    for i, event in enumerate(events[:5], 1):
-        event_id, title, date, time, location, max_vol, desc, available = event
-        events_text += f"{i}. *{title}*\n"
-        events_text += f"   📅 {date} ⏰ {time}\n"
-        if location:
-            events_text += f"   📍 {location}\n"
-        events_text += f"   🎫 Свободно: {available if available else '∞'}/{max_vol if max_vol else '∞'}\n\n"
-    
-    if len(events) > 5:
-        events_text += f"*... и еще {len(events)-5} мероприятий*\n\n"
-    
-    events_text += "Выберите мероприятие для подробной информации:"
-    
-    await query.edit_message_text(
-        events_text,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-
-async def event_detail(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает детали мероприятия"""
-    query = update.callback_query
-    await query.answer()
-    
-    try:
-        event_id = int(query.data.split('_')[1])
-    except:
-        await query.edit_message_text("❌ Ошибка: неверный ID мероприятия")
-        return
-    
-    # Получаем информацию о мероприятии
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('SELECT title, description, date, time, location, max_volunteers, registration_open, is_active FROM events WHERE id = ?', (event_id,))
-    event = cur.fetchone()
-    
-    if not event:
-        await query.edit_message_text("❌ Мероприятие не найдено.")
-        conn.close()
-        return
-    
-    title, desc, date, time, location, max_vol, registration_open, is_active = event
-    
-    # Проверяем, активно ли мероприятие
-    if not is_active:
-        await query.edit_message_text(
-            "❌ *Это мероприятие временно недоступно.*\n\n"
-            "Оно было деактивировано организаторами.\n\n"
-            "Пожалуйста, выберите другое мероприятие.",
-            parse_mode='Markdown'
-        )
-        conn.close()
-        return
-    
-    # Проверяем, записан ли пользователь
-    cur.execute('SELECT id FROM registrations WHERE user_id = ? AND event_id = ?', 
-                (query.from_user.id, event_id))
-    registration = cur.fetchone()
-    is_registered = registration is not None
-    registration_id = registration[0] if registration else None
-    conn.close()
-    
-    # Формируем текст
-    text = f"🎯 *{title}*\n\n"
-    if desc:
-        text += f"📝 *Описание:* {desc}\n\n"
-    text += f"📅 *Дата:* {date}\n"
-    text += f"⏰ *Время:* {time}\n"
-    if location:
-        text += f"📍 *Место:* {location}\n"
-    text += f"👥 *Участников:* {max_vol if max_vol else 'без ограничений'}\n"
-    
-    if not registration_open:
-        text += f"❌ *Запись закрыта*\n\n"
-    else:
-        text += f"✅ *Запись открыта*\n\n"
-    
-    if is_registered:
-        text += "✅ *Вы уже записаны на это мероприятие*\n\n"
-    
-    # Создаем кнопки
-    keyboard = []
-    if registration_open and not is_registered:
-        keyboard.append([InlineKeyboardButton("✅ Записаться", callback_data=f'register_{event_id}')])
-    elif is_registered and registration_id:
-        keyboard.append([InlineKeyboardButton("❌ Отменить запись", callback_data=f'cancel_reg_{registration_id}')])
-    
-    keyboard.append([InlineKeyboardButton("📅 К списку мероприятий", callback_data='list_events')])
-    keyboard.append([InlineKeyboardButton("👤 Мои данные", callback_data='my_info')])
-    
-    await query.edit_message_text(
-        text,
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='Markdown'
-    )
-
-async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает данные пользователя"""
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = query.from_user.id
-    
-    # Получаем данные пользователя
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('SELECT full_name, group_name, birth_date, phone_number, username FROM users WHERE telegram_id = ?', (user_id,))
-    user = cur.fetchone()
-    conn.close()
-    
-    if not user:
-        text = "❌ Ваши данные не найдены. Пожалуйста, нажмите /start"
-    else:
-        full_name, group_name, birth_date, phone, username = user
-        text = "👤 *Ваши данные:*\n\n"
-        text += f"• *ФИО:* {full_name if full_name else '❌ Не заполнено'}\n"
-        text += f"• *Группа:* {group_name if group_name else '❌ Не заполнена'}\n"
-        text += f"• *Дата рождения:* {birth_date if birth_date else '❌ Не заполнена'}\n"
-        text += f"• *Телефон:* {phone if phone else '❌ Не заполнен'}\n"
-        text += f"• *Username:* {username if username else '❌ Не заполнен'}\n\n"
-        
-        # Проверяем, все ли данные заполнены
-        missing = []
-        if not full_name: missing.append("ФИО")
-        if not group_name: missing.append("группа")
-        if not birth_date: missing.append("дата рождения")
-        if not phone: missing.append("телефон")
-        
-        if missing:
-            text += f"⚠️ *Для записи необходимо заполнить:* {', '.join(missing)}\n"
-        else:
-            text += "✅ *Все данные заполнены, можно записываться!*\n"
-    
-    # Создаем кнопки
-    keyboard = [
-        [InlineKeyboardButton("✏️ Заполнить/изменить данные", callback_data='edit_info')],
-        [InlineKeyboardButton("📝 Записаться на мероприятие", callback_data='list_events')],
-        [InlineKeyboardButton("📋 Мои записи", callback_data='my_registrations')],
-        [InlineKeyboardButton("🏠 В главное меню", callback_data='main_menu')]
-    ]
-    
-    await query.edit_message_text(
-        text,
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='Markdown'
-    )
-
-async def edit_info_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Начинает процесс редактирования данных"""
-    query = update.callback_query
-    await query.answer()
-    
-    await query.edit_message_text(
-        "✏️ *Заполните ваши данные*\n\n"
-        "Отправьте сообщение в формате:\n\n"
-        "`ФИО, Группа, Дата рождения (ДД.ММ.ГГГГ), Телефон, @username`\n\n"
-        "*Пример:*\n"
-        "`Иванов Иван Иванович, ИВТ-20-1, 15.05.2000, +79161234567, @ivanov`\n\n"
-        "📌 *Все поля обязательны для записи на мероприятия.*\n"
-        "📌 *Данные сохранятся и не нужно будет вводить их заново.*\n\n"
-        "Для отмены отправьте /cancel",
-        parse_mode='Markdown'
-    )
-    
-    return EDITING_INFO
-
-async def save_user_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Сохраняет данные пользователя"""
-    text = update.message.text.strip()
-    
-    # Проверяем отмену
-    if text.lower() == '/cancel':
-        await update.message.reply_text("✅ Заполнение данных отменено.")
-        return ConversationHandler.END
-    
-    parts = [part.strip() for part in text.split(',')]
-    
-    if len(parts) >= 5:
-        try:
-            full_name = parts[0]
-            group = parts[1]
-            birth_date = parts[2]
-            phone = parts[3]
-            username = parts[4]
-            
-            # Проверяем формат даты рождения
-            try:
-                datetime.strptime(birth_date, '%d.%m.%Y')
-            except ValueError:
-                await update.message.reply_text(
-                    "❌ Неверный формат даты рождения! Используйте ДД.ММ.ГГГГ\n"
-                    "Пример: 15.05.2000\n\n"
-                    "Попробуйте еще раз или отправьте /cancel для отмены"
-                )
-                return EDITING_INFO
-            
-            # Проверяем username
-            if not username.startswith('@'):
-                await update.message.reply_text(
-                    "❌ Username должен начинаться с @\n"
-                    "Пример: @ivanov\n\n"
-                    "Попробуйте еще раз или отправьте /cancel для отмены"
-                )
-                return EDITING_INFO
-            
-            # Сохраняем в БД
-            conn = sqlite3.connect(DB_NAME)
-            cur = conn.cursor()
-            cur.execute('''
-                INSERT OR REPLACE INTO users 
-                (telegram_id, full_name, group_name, birth_date, phone_number, username)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (update.effective_user.id, full_name, group, birth_date, phone, username))
-            conn.commit()
-            conn.close()
-            
-            await update.message.reply_text(
-                "✅ *Данные сохранены!*\n\n"
-                f"• ФИО: {full_name}\n"
-                f"• Группа: {group}\n"
-                f"• Дата рождения: {birth_date}\n"
-                f"• Телефон: {phone}\n"
-                f"• Username: {username}\n\n"
-                "📌 *Данные сохранены. Теперь вы можете записываться на мероприятия!*",
-                parse_mode='Markdown'
-            )
-            
-            # Показываем кнопки
-            keyboard = [
-                [InlineKeyboardButton("📝 Записаться на мероприятие", callback_data='list_events')],
-                [InlineKeyboardButton("👤 Посмотреть мои данные", callback_data='my_info')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text("Выберите действие:", reply_markup=reply_markup)
-            
-        except Exception as e:
-            await update.message.reply_text(
-                f"❌ Ошибка при сохранении: {e}\n\n"
-                "Пожалуйста, проверьте правильность ввода данных."
-            )
-            return EDITING_INFO
-    else:
-        await update.message.reply_text(
-            "❌ *Неверный формат!*\n\n"
-            "Пожалуйста, отправьте данные в формате:\n"
-            "`ФИО, Группа, Дата рождения, Телефон, @username`\n\n"
-            "Пример:\n"
-            "`Иванов Иван Иванович, ИВТ-20-1, 15.05.2000, +79161234567, @ivanov`\n\n"
-            "Попробуйте еще раз или отправьте /cancel для отмены",
-            parse_mode='Markdown'
-        )
-        return EDITING_INFO
-    
-    return ConversationHandler.END
-
-async def register_for_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Начинает процесс записи на мероприятие"""
-    query = update.callback_query
-    await query.answer()
-    
-    try:
-        event_id = int(query.data.split('_')[1])
-    except:
-        await query.answer("❌ Ошибка: неверный ID мероприятия", show_alert=True)
-        return
-    
-    context.user_data['registering_event_id'] = event_id
-    
-    await query.edit_message_text(
-        "📝 *Добавление комментария к записи*\n\n"
-        "За какой семестр выставлять баллы:\n\n"
-        "Примеры комментариев:\n"
-        "• 'Осень 2024/ весна 2025/ другое'\n\n"
-        "Отправьте комментарий или отправьте /skip чтобы пропустить.\n"
-        "Для отмены отправьте /cancel",
-        parse_mode='Markdown'
-    )
-    
-    return ADDING_COMMENT
-
-async def save_registration_with_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Сохраняет запись с комментарием"""
-    text = update.message.text.strip()
-    
-    # Проверяем отмену
-    if text.lower() == '/cancel':
-        await update.message.reply_text("✅ Запись отменена.")
-        if 'registering_event_id' in context.user_data:
-            del context.user_data['registering_event_id']
-        return ConversationHandler.END
-    
-    # Проверяем пропуск комментария
-    if text.lower() == '/skip':
-        comment = ''
-    else:
-        comment = text[:200]  # Ограничиваем длину комментария
-    
-    event_id = context.user_data.get('registering_event_id')
-    user_id = update.effective_user.id
-    
-    # Проверяем, что event_id существует
-    if not event_id:
-        await update.message.reply_text("❌ Ошибка: мероприятие не найдено.")
-        return ConversationHandler.END
-    
-    # 1. Проверяем данные пользователя
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('SELECT full_name, group_name, birth_date, phone_number, username FROM users WHERE telegram_id = ?', (user_id,))
-    user = cur.fetchone()
-    
-    if not user:
-        await update.message.reply_text("❌ Ваши данные не найдены. Пожалуйста, сначала заполните данные.")
-        conn.close()
-        if 'registering_event_id' in context.user_data:
-            del context.user_data['registering_event_id']
-        return ConversationHandler.END
-    
-    full_name, group, birth_date, phone, username = user
-    
-    # Проверяем обязательные поля
-    missing = []
-    if not full_name: missing.append("ФИО")
-    if not group: missing.append("группа")
-    if not birth_date: missing.append("дата рождения")
-    if not phone: missing.append("телефон")
-    
-    if missing:
-        keyboard = [
-            [InlineKeyboardButton("✏️ Заполнить данные", callback_data='edit_info')],
-            [InlineKeyboardButton("📅 К мероприятиям", callback_data='list_events')]
-        ]
-        
-        await update.message.reply_text(
-            f"❌ *Не хватает данных для записи:*\n• {', '.join(missing)}\n\n"
-            f"Пожалуйста, заполните данные перед записью.",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        conn.close()
-        if 'registering_event_id' in context.user_data:
-            del context.user_data['registering_event_id']
-        return ConversationHandler.END
-    
-    # 2. Проверяем мероприятие и открыта ли запись
-    cur.execute('SELECT title, date, time, location, max_volunteers, registration_open, is_active FROM events WHERE id = ?', (event_id,))
-    event = cur.fetchone()
-    
-    if not event:
-        await update.message.reply_text("❌ Мероприятие не найдено.")
-        conn.close()
-        if 'registering_event_id' in context.user_data:
-            del context.user_data['registering_event_id']
-        return ConversationHandler.END
-    
-    title, date, time, location, max_vol, registration_open, is_active = event
-    
-    # Проверяем, активно ли мероприятие
-    if not is_active:
-        await update.message.reply_text("❌ Это мероприятие временно недоступно!")
-        conn.close()
-        if 'registering_event_id' in context.user_data:
-            del context.user_data['registering_event_id']
-        return ConversationHandler.END
-    
-    if not registration_open:
-        await update.message.reply_text("❌ Запись на это мероприятие закрыта!")
-        conn.close()
-        if 'registering_event_id' in context.user_data:
-            del context.user_data['registering_event_id']
-        return ConversationHandler.END
-    
-    # 3. Проверяем, не записан ли уже
-    cur.execute('SELECT id FROM registrations WHERE user_id = ? AND event_id = ?', (user_id, event_id))
-    if cur.fetchone():
-        await update.message.reply_text("Вы уже записаны на это мероприятие!")
-        conn.close()
-        if 'registering_event_id' in context.user_data:
-            del context.user_data['registering_event_id']
-        return ConversationHandler.END
-    
-    # 4. Проверяем свободные места
-    cur.execute('SELECT COUNT(*) FROM registrations WHERE event_id = ?', (event_id,))
-    registered_count = cur.fetchone()[0]
-    
-    if max_vol and registered_count >= max_vol:
-        await update.message.reply_text("❌ К сожалению, все места уже заняты!")
-        conn.close()
-        if 'registering_event_id' in context.user_data:
-            del context.user_data['registering_event_id']
-        return ConversationHandler.END
-    
-    # 5. Сохраняем запись в БД
-    cur.execute('INSERT INTO registrations (user_id, event_id, comment) VALUES (?, ?, ?)', 
-                (user_id, event_id, comment))
-    registration_id = cur.lastrowid
-    conn.commit()
-    conn.close()
-    
-    # 6. Получаем полные данные для CSV
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT registrations.id, users.full_name, users.group_name, users.birth_date, 
-               users.phone_number, users.username, events.title, events.date, events.time, events.location
-        FROM registrations
-        JOIN users ON registrations.user_id = users.telegram_id
-        JOIN events ON registrations.event_id = events.id
-        WHERE registrations.id = ?
-    ''', (registration_id,))
-    registration_data = cur.fetchone()
-    conn.close()
-    
-    if registration_data:
-        reg_id, full_name, group_name, birth_date, phone, username, event_title, event_date, event_time, event_location = registration_data
-        
-        user_data = {
-            'registration_id': reg_id,
-            'telegram_id': user_id,
-            'full_name': full_name,
-            'group': group_name,
-            'birth_date': birth_date,
-            'phone': phone,
-            'username': username
-        }
-        
-        event_data = {
-            'id': event_id,
-            'title': event_title,
-            'date': event_date,
-            'time': event_time,
-            'location': event_location if event_location else 'Не указано'
-        }
-        
-        csv_success = save_to_csv(user_data, event_data, comment, 'Записан')
-    
-    # 7. Отправляем ответ пользователю
-    if csv_success:
-        text = (
-            "✅ *Вы успешно записаны!*\n\n"
-            f"🎯 *Мероприятие:* {title}\n"
-            f"📅 *Дата:* {date}\n"
-            f"⏰ *Время:* {time}\n"
-        )
-        
-        if location:
-            text += f"📍 *Место:* {location}\n"
-        
-        if comment:
-            text += f"💬 *Ваш комментарий:* {comment}\n\n"
-        
-        text += (
-            f"👥 *Место в списке:* {registered_count + 1}/{max_vol if max_vol else '∞'}\n\n"
-            "📊 *Ваши данные сохранены в таблицу волонтеров.*\n"
-            "Организаторы увидят вашу запись.\n\n"
-            "📌 *Не забудьте добавить мероприятие в календарь!*"
-        )
-        
-        # Отправляем уведомление
-        await update.message.reply_text("✅ Запись сохранена в таблицу!")
-    else:
-        text = (
-            "⚠️ *Запись сохранена в боте, но возникла ошибка при сохранении в таблицу.*\n\n"
-            f"🎯 *Мероприятие:* {title}\n"
-            f"📅 *Дата:* {date}\n\n"
-            "Пожалуйста, свяжитесь с организаторами для подтверждения записи."
-        )
-        
-        await update.message.reply_text("⚠️ Ошибка сохранения в таблицу")
-    
-    # Кнопки после записи
-    keyboard = [
-        [InlineKeyboardButton("📝 Записаться еще", callback_data='list_events')],
-        [InlineKeyboardButton("📋 Мои записи", callback_data='my_registrations')],
-        [InlineKeyboardButton("🏠 В главное меню", callback_data='main_menu')]
-    ]
-    
-    await update.message.reply_text(
-        text,
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='Markdown'
-    )
-    
-    # Очищаем контекст
-    if 'registering_event_id' in context.user_data:
-        del context.user_data['registering_event_id']
-    
-    return ConversationHandler.END
-
-async def my_registrations(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает записи пользователя с возможностью отмены"""
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = query.from_user.id
-    registrations = get_user_registrations(user_id)
-    
-    if not registrations:
-        text = (
-            "📭 *У вас пока нет записей на мероприятия.*\n\n"
-            "Выберите мероприятие из списка и запишитесь!"
-        )
-        keyboard = [
-            [InlineKeyboardButton("📝 Записаться на мероприятие", callback_data='list_events')],
-            [InlineKeyboardButton("👤 Мои данные", callback_data='my_info')],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data='main_menu')]
-        ]
-    else:
-        text = "📋 *Ваши записи на мероприятия:*\n\n"
-        keyboard = []
-        
-        for i, reg in enumerate(registrations, 1):
-            event_id, title, date, time, location, registration_id, reg_date, comment = reg
-            text += f"{i}. *{title}*\n"
-            text += f"   📅 {date} ⏰ {time}\n"
-            if location:
-                text += f"   📍 {location}\n"
-            if comment:
-                text += f"   💬 Комментарий: {comment}\n"
-            text += f"   📝 Записан: {reg_date[:10]}\n"
-            text += f"   🆔 ID записи: {registration_id}\n\n"
-            
-            # Добавляем кнопку отмены для каждой записи
-            keyboard.append([
-                InlineKeyboardButton(f"❌ Отменить запись на '{title[:15]}...'", 
-                                   callback_data=f'cancel_reg_{registration_id}')
-            ])
-        
-        keyboard.append([InlineKeyboardButton("📝 Записаться на мероприятие", callback_data='list_events')])
-        keyboard.append([InlineKeyboardButton("👤 Мои данные", callback_data='my_info')])
-        keyboard.append([InlineKeyboardButton("🏠 В главное меню", callback_data='main_menu')])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(
-        text,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-
-async def cancel_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Отменяет запись пользователя"""
-    query = update.callback_query
-    await query.answer()
-    
-    try:
-        # Извлекаем registration_id из callback_data
-        if query.data.startswith('cancel_reg_'):
-            registration_id = int(query.data.split('_')[2])
-        else:
-            await query.answer("❌ Ошибка формата команды", show_alert=True)
-            return
-    except:
-        await query.answer("❌ Ошибка: неверный ID записи", show_alert=True)
-        return
-    
-    user_id = query.from_user.id
-    
-    # Получаем информацию о записи
-    registration_info = get_registration_info(registration_id)
-    
-    if not registration_info:
-        await query.answer("❌ Запись не найдена", show_alert=True)
-        return
-    
-    # Проверяем, что это запись текущего пользователя
-    reg_id, reg_user_id, event_id, comment, full_name, group_name, birth_date, phone, username, title, date, time, location = registration_info
-    
-    if reg_user_id != user_id:
-        await query.answer("❌ Вы не можете отменить чужую запись!", show_alert=True)
-        return
-    
-    # Отменяем запись в БД
-    result = cancel_registration_db(registration_id)
-    
-    if result:
-        await query.answer("✅ Запись успешно отменена!", show_alert=True)
-        
-        # Показываем подтверждение
-        text = (
-            "✅ *Запись отменена успешно!*\n\n"
-            f"🎯 *Мероприятие:* {title}\n"
-            f"📅 *Дата:* {date}\n"
-            f"⏰ *Время:* {time}\n"
-        )
-        
-        if location:
-            text += f"📍 *Место:* {location}\n"
-        
-        if comment:
-            text += f"💬 *Ваш комментарий:* {comment}\n"
-        
-        text += "\n📊 *Запись удалена из таблицы волонтеров.*\n"
-        text += "Место освобождено для других участников."
-        
-        keyboard = [
-            [InlineKeyboardButton("📝 Записаться на другое мероприятие", callback_data='list_events')],
-            [InlineKeyboardButton("📋 Мои записи", callback_data='my_registrations')],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data='main_menu')]
-        ]
-        
-        await query.edit_message_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
-        )
-    else:
-        await query.answer("❌ Ошибка при отмене записи", show_alert=True)
-
-async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Главное меню"""
-    query = update.callback_query
-    await query.answer()
-    
-    keyboard = [
-        [InlineKeyboardButton("📝 Записаться на мероприятие", callback_data='list_events')],
-        [InlineKeyboardButton("👤 Мои данные", callback_data='my_info')],
-        [InlineKeyboardButton("📋 Мои записи", callback_data='my_registrations')]
-    ]
-    
-    await query.edit_message_text(
-        "🏠 *Главное меню*\n\nВыберите действие:",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='Markdown'
-    )
-
-# ========== АДМИН КОМАНДЫ ==========
-async def admin_add_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Начало процесса добавления мероприятия"""
-    if update.effective_user.id != ADMIN_ID:
-        await update.message.reply_text("⛔ У вас нет прав доступа.")
-        return ConversationHandler.END
-    
-    await update.message.reply_text(
-        "📝 *Добавление нового мероприятия*\n\n"
-        "Отправьте данные в формате:\n\n"
-        "`Название, Описание, Дата (ГГГГ-ММ-ДД), Время (ЧЧ:ММ), Место, Макс. участников`\n\n"
-        "*Пример:*\n"
-        "`Уборка парка, Субботник в центральном парке, 2024-04-10, 14:00, Центральный парк, 30`\n\n"
-        "📌 *Примечания:*\n"
-        "- Дата в формате ГГГГ-ММ-ДД\n"
-        "- Время в формате ЧЧ:ММ\n"
-        "- Макс. участников: число или 0 для неограниченного\n"
-        "- Описание не обязательно\n\n"
-        "Для отмены отправьте /cancel",
-        parse_mode='Markdown'
-    )
-    
-    context.user_data['adding_event'] = True
-    return ADDING_EVENT
-
-async def save_new_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Сохраняет новое мероприятие из сообщения"""
-    # Проверяем, что это именно админ и он в режиме добавления
-    if update.effective_user.id != ADMIN_ID:
-        await update.message.reply_text("⛔ У вас нет прав доступа.")
-        return ConversationHandler.END
-    
-    text = update.message.text.strip()
-    
-    if text.lower() == '/cancel':
-        await update.message.reply_text("✅ Добавление мероприятия отменено.")
-        return ConversationHandler.END
-    
-    parts = [part.strip() for part in text.split(',')]
-    
-    if len(parts) >= 5:
-        try:
-            # Определяем части в зависимости от количества
-            if len(parts) == 5:
-                # Формат без описания: Название, Дата, Время, Место, Макс
-                title = parts[0]
-                description = ""
-                date = parts[1]
-                time = parts[2]
-                location = parts[3]
-                max_volunteers = int(parts[4]) if parts[4].isdigit() else 0
-            else:
-                # Формат с описанием: Название, Описание, Дата, Время, Место, Макс
-                title = parts[0]
-                description = parts[1]
-                date = parts[2]
-                time = parts[3]
-                location = parts[4]
-                max_volunteers = int(parts[5]) if parts[5].isdigit() else 0
-            
-            # Проверяем формат даты
-            try:
-                datetime.strptime(date, '%Y-%m-%d')
-            except ValueError:
-                await update.message.reply_text(
-                    "❌ Неверный формат даты! Используйте ГГГГ-ММ-ДД\n"
-                    "Пример: 2024-04-10\n\n"
-                    "Попробуйте еще раз или отправьте /cancel для отмены"
-                )
-                return ADDING_EVENT
-            
-            # Проверяем формат времени
-            try:
-                datetime.strptime(time, '%H:%M')
-            except ValueError:
-                await update.message.reply_text(
-                    "❌ Неверный формат времени! Используйте ЧЧ:ММ\n"
-                    "Пример: 14:00\n\n"
-                    "Попробуйте еще раз или отправьте /cancel для отмены"
-                )
-                return ADDING_EVENT
-            
-            # Сохраняем в БД
-            conn = sqlite3.connect(DB_NAME)
-            cur = conn.cursor()
-            cur.execute('''
-                INSERT INTO events (title, description, date, time, location, max_volunteers, is_active, registration_open)
-                VALUES (?, ?, ?, ?, ?, ?, 1, 1)
-            ''', (title, description, date, time, location, max_volunteers))
-            event_id = cur.lastrowid
-            conn.commit()
-            conn.close()
-            
-            # Формируем ответ
-            response_text = (
-                "✅ *Мероприятие добавлено!*\n\n"
-                f"🎯 *Название:* {title}\n"
-                f"📅 *Дата:* {date}\n"
-                f"⏰ *Время:* {time}\n"
-                f"📍 *Место:* {location}\n"
-                f"👥 *Макс. участников:* {max_volunteers if max_volunteers > 0 else 'не ограничено'}\n"
-            )
-            
-            if description:
-                response_text += f"📝 *Описание:* {description}\n"
-            
-            response_text += f"\n🆔 *ID мероприятия:* {event_id}"
-            
-            await update.message.reply_text(response_text, parse_mode='Markdown')
-            
-            print(f"✅ Добавлено мероприятие: {title} (ID: {event_id})")
-            
-        except Exception as e:
-            print(f"❌ Ошибка при добавлении мероприятия: {e}")
-            await update.message.reply_text(
-                f"❌ Ошибка: {str(e)[:200]}\n\n"
-                "Проверьте правильность ввода данных и попробуйте еще раз.\n"
-                "Для отмены отправьте /cancel"
-            )
-            return ADDING_EVENT
-    else:
-        await update.message.reply_text(
-            "❌ *Неверный формат!* Требуется минимум 5 полей.\n\n"
-            "Отправьте данные в формате:\n"
-            "`Название, Описание, Дата, Время, Место, Макс. участников`\n\n"
-            "*Пример:*\n"
-            "`Уборка парка, Субботник в парке, 2024-04-10, 14:00, Центральный парк, 30`\n\n"
-            "Попробуйте еще раз или отправьте /cancel для отмены",
-            parse_mode='Markdown'
-        )
-        return ADDING_EVENT
-    
-    # Сбрасываем флаг
-    if 'adding_event' in context.user_data:
-        del context.user_data['adding_event']
-    
-    return ConversationHandler.END
-
-async def admin_list_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает список мероприятий админу"""
-    if update.effective_user.id != ADMIN_ID:
-        await update.message.reply_text("⛔ У вас нет прав доступа.")
-        return
-    
-    events = get_all_events_admin()
-    
-    if not events:
-        text = "📭 Нет мероприятий."
-    else:
-        text = "📋 *Все мероприятия:*\n\n"
-        for event in events:
-            event_id, title, date, time, location, max_vol, desc, is_active, registration_open, registered = event
-            status = "✅ Активно" if is_active == 1 else "❌ Неактивно"
-            reg_status = "✅ Открыта" if registration_open == 1 else "❌ Закрыта"
-            max_text = f"{max_vol}" if max_vol > 0 else "∞"
-            
-            text += f"🆔 *{event_id}*\n"
-            text += f"🎯 *{title}*\n"
-            text += f"   📅 {date} ⏰ {time}\n"
-            if location:
-                text += f"   📍 {location}\n"
-            text += f"   👥 {registered}/{max_text} записей\n"
-            text += f"   🏷️ Статус: {status}\n"
-            text += f"   📝 Запись: {reg_status}\n\n"
-    
-    await update.message.reply_text(text, parse_mode='Markdown')
-
-async def admin_manage_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Меню управления мероприятиями для админа"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    events = get_all_events_admin()
-    
-    if not events:
-        keyboard = [[InlineKeyboardButton("◀️ Назад в админ-панель", callback_data='admin_back')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            "📭 Нет мероприятий для управления.",
-            reply_markup=reply_markup
-        )
-        return
-    
-    # Создаем кнопки для каждого мероприятия
-    keyboard = []
-    for event in events:
-        event_id, title, date, time, location, max_vol, desc, is_active, registration_open, registered = event
-        button_text = f"🆔{event_id}: {title[:20]}"
-        if len(title) > 20:
-            button_text += "..."
-        button_text += f" ({date})"
-        
-        # Иконки статуса
-        status_icon = "✅" if is_active == 1 else "❌"
-        reg_icon = "📝" if registration_open == 1 else "🔒"
-        
-        button_text = f"{status_icon}{reg_icon} {button_text}"
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f'manage_{event_id}')])
-    
-    keyboard.append([InlineKeyboardButton("◀️ Назад в админ-панель", callback_data='admin_back')])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(
-        "🔧 *Управление мероприятиями*\n\n"
-        "Выберите мероприятие для управления:\n"
-        "✅❌ - активность мероприятия\n"
-        "📝🔒 - статус записи\n\n"
-        f"Всего мероприятий: {len(events)}",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-
-async def manage_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Управление конкретным мероприятием"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    try:
-        # Извлекаем event_id из callback_data
-        if query.data.startswith('manage_'):
-            event_id = int(query.data.split('_')[1])
-        else:
-            # Если это действие, обновляем страницу
-            await admin_manage_events(update, context)
-            return
-    except:
-        # Если ошибка, просто возвращаемся к списку
-        await admin_manage_events(update, context)
-        return
-    
-    event = get_event_details(event_id)
-    if not event:
-        await query.edit_message_text("❌ Мероприятие не найдено.")
-        return
-    
-    title, desc, date, time, location, max_vol, is_active, registration_open = event
-    
-    # Получаем количество записанных
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('SELECT COUNT(*) FROM registrations WHERE event_id = ?', (event_id,))
-    registered = cur.fetchone()[0]
-    conn.close()
-    
-    # Формируем текст
-    text = f"🔧 *Управление мероприятием*\n\n"
-    text += f"🆔 *ID:* {event_id}\n"
-    text += f"🎯 *Название:* {title}\n"
-    if desc:
-        text += f"📝 *Описание:* {desc}\n"
-    text += f"📅 *Дата:* {date}\n"
-    text += f"⏰ *Время:* {time}\n"
-    if location:
-        text += f"📍 *Место:* {location}\n"
-    text += f"👥 *Участников:* {registered}/{max_vol if max_vol > 0 else '∞'}\n"
-    text += f"🏷️ *Статус:* {'✅ Активно' if is_active == 1 else '❌ Неактивно'}\n"
-    text += f"📝 *Запись:* {'✅ Открыта' if registration_open == 1 else '❌ Закрыта'}\n"
-    
-    # Создаем кнопки управления
-    keyboard = []
-    
-    # Кнопка для активации/деактивации мероприятия
-    if is_active == 1:
-        keyboard.append([InlineKeyboardButton("❌ Деактивировать мероприятие", callback_data=f'toggle_active_{event_id}')])
-    else:
-        keyboard.append([InlineKeyboardButton("✅ Активировать мероприятие", callback_data=f'toggle_active_{event_id}')])
-    
-    # Кнопка для открытия/закрытия записи
-    if registration_open == 1:
-        keyboard.append([InlineKeyboardButton("🔒 Закрыть запись", callback_data=f'toggle_reg_{event_id}')])
-    else:
-        keyboard.append([InlineKeyboardButton("📝 Открыть запись", callback_data=f'toggle_reg_{event_id}')])
-    
-    # Кнопка для скачивания таблицы мероприятия
-    keyboard.append([InlineKeyboardButton("📥 Скачать таблицу мероприятия", callback_data=f'download_event_{event_id}')])
-    
-    # Кнопки для редактирования
-    keyboard.append([InlineKeyboardButton("✏️ Изменить данные", callback_data=f'edit_{event_id}')])
-    
-    # Кнопка удаления
-    keyboard.append([InlineKeyboardButton("🗑️ Удалить мероприятие", callback_data=f'delete_{event_id}')])
-    
-    # Кнопка просмотра записавшихся
-    keyboard.append([InlineKeyboardButton("👥 Просмотреть записавшихся", callback_data=f'view_{event_id}')])
-    
-    keyboard.append([InlineKeyboardButton("◀️ Назад к списку", callback_data='admin_manage')])
-    keyboard.append([InlineKeyboardButton("🏠 В админ-панель", callback_data='admin_back')])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(
-        text,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-
-# ========== ОТДЕЛЬНЫЕ ОБРАБОТЧИКИ ДЛЯ КНОПОК ==========
-async def toggle_registration_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает кнопку открытия/закрытия записи"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    try:
-        event_id = int(query.data.split('_')[2])
-    except:
-        await query.answer("❌ Ошибка: неверный ID мероприятия", show_alert=True)
-        return
-    
-    event = get_event_details(event_id)
-    if not event:
-        await query.answer("❌ Мероприятие не найдено", show_alert=True)
-        return
-    
-    title = event[0]
-    
-    # Переключаем запись
-    is_now_open = toggle_event_registration(event_id)
-    if is_now_open:
-        message = f"📝 Запись на мероприятие '{title}' открыта."
-    else:
-        message = f"🔒 Запись на мероприятие '{title}' закрыта."
-    
-    await query.answer(message, show_alert=True)
-    
-    # Обновляем страницу
-    await asyncio.sleep(0.5)
-    await manage_event(update, context)
-
-async def toggle_active_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает кнопку активации/деактивации мероприятия"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    try:
-        event_id = int(query.data.split('_')[2])
-    except:
-        await query.answer("❌ Ошибка: неверный ID мероприятия", show_alert=True)
-        return
-    
-    event = get_event_details(event_id)
-    if not event:
-        await query.answer("❌ Мероприятие не найдено", show_alert=True)
-        return
-    
-    title = event[0]
-    
-    # Переключаем активность
-    is_now_active = toggle_event_active_status(event_id)
-    if is_now_active:
-        message = f"✅ Мероприятие '{title}' активировано."
-    else:
-        message = f"❌ Мероприятие '{title}' деактивировано."
-    
-    await query.answer(message, show_alert=True)
-    
-    # Обновляем страницу
-    await asyncio.sleep(0.5)
-    await manage_event(update, context)
-
-async def download_event_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает кнопку скачивания таблицы мероприятия"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    try:
-        event_id = int(query.data.split('_')[2])
-    except:
-        await query.answer("❌ Ошибка: неверный ID мероприятия", show_alert=True)
-        return
-    
-    event = get_event_details(event_id)
-    if not event:
-        await query.answer("❌ Мероприятие не найдено", show_alert=True)
-        return
-    
-    title = event[0]
-    
-    # Создаем CSV файл для мероприятия
-    event_file = get_event_csv(event_id)
-    
-    if event_file:
-        try:
-            with open(event_file, 'rb') as f:
-                await context.bot.send_document(
-                    chat_id=query.from_user.id,
-                    document=f,
-                    filename=f'мероприятие_{event_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
-                    caption=f"📊 Таблица участников мероприятия: {title}"
-                )
-            
-            # Удаляем временный файл
-            os.remove(event_file)
-            
-            await query.answer("✅ Таблица отправлена вам в личные сообщения!", show_alert=True)
-            
-        except Exception as e:
-            print(f"❌ Ошибка при отправке CSV: {e}")
-            await query.answer("❌ Ошибка при отправке файла", show_alert=True)
-    else:
-        await query.answer("❌ Ошибка при создании файла", show_alert=True)
-
-async def delete_event_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает кнопку удаления мероприятия"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    try:
-        event_id = int(query.data.split('_')[1])
-    except:
-        await query.answer("❌ Ошибка: неверный ID мероприятия", show_alert=True)
-        return
-    
-    event = get_event_details(event_id)
-    if not event:
-        await query.answer("❌ Мероприятие не найдено", show_alert=True)
-        return
-    
-    title = event[0]
-    
-    # Подтверждение удаления
-    keyboard = [
-        [InlineKeyboardButton("✅ Да, удалить", callback_data=f'confirm_delete_{event_id}')],
-        [InlineKeyboardButton("❌ Нет, отменить", callback_data=f'manage_{event_id}')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(
-        f"⚠️ *Вы уверены, что хотите удалить мероприятие?*\n\n"
-        f"🎯 *Название:* {title}\n\n"
-        f"Это действие удалит:\n"
-        f"• Само мероприятие\n"
-        f"• Все записи на него\n"
-        f"• Все данные из таблицы CSV\n\n"
-        f"*Действие необратимо!*",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-
-async def confirm_delete_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает подтверждение удаления мероприятия"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    try:
-        event_id = int(query.data.split('_')[2])
-    except:
-        await query.answer("❌ Ошибка: неверный ID мероприятия", show_alert=True)
-        return
-    
-    event = get_event_details(event_id)
-    if not event:
-        await query.answer("❌ Мероприятие не найдено", show_alert=True)
-        return
-    
-    title = event[0]
-    
-    # Удаляем мероприятие
-    if delete_event(event_id):
-        message = f"🗑️ Мероприятие '{title}' удалено."
-        # Возвращаемся к списку
-        await admin_manage_events(update, context)
-    else:
-        message = f"❌ Ошибка при удалении мероприятия."
-        await query.answer(message, show_alert=True)
-        await asyncio.sleep(0.5)
-        await admin_manage_events(update, context)
-
-async def view_event_participants(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает участников мероприятия"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    try:
-        event_id = int(query.data.split('_')[1])
-    except:
-        await query.answer("❌ Ошибка: неверный ID мероприятия", show_alert=True)
-        return
-    
-    event = get_event_details(event_id)
-    if not event:
-        await query.edit_message_text("❌ Мероприятие не найдено.")
-        return
-    
-    title = event[0]
-    
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT registrations.id, registrations.comment, 
-               users.full_name, users.group_name, users.phone_number, users.username
-        FROM registrations
-        JOIN users ON registrations.user_id = users.telegram_id
-        WHERE registrations.event_id = ?
-        ORDER BY registrations.registration_date
-    ''', (event_id,))
-    registrations = cur.fetchall()
-    conn.close()
-    
-    if not registrations:
-        text = f"👥 *Записанные на мероприятие:* {title}\n\n"
-        text += "Пока никто не записался."
-    else:
-        text = f"👥 *Записанные на мероприятие:* {title}\n"
-        text += f"Всего записей: {len(registrations)}\n\n"
-        
-        for i, reg in enumerate(registrations, 1):
-            reg_id, comment, full_name, group_name, phone, username = reg
-            text += f"{i}. *{full_name}*\n"
-            text += f"   ID записи: {reg_id}\n"
-            if group_name:
-                text += f"   Группа: {group_name}\n"
-            if phone:
-                text += f"   Телефон: {phone}\n"
-            if username:
-                text += f"   @{username.replace('@', '')}\n"
-            if comment:
-                text += f"   💬 Комментарий: {comment}\n"
-            text += "\n"
-    
-    keyboard = [[InlineKeyboardButton("◀️ Назад к управлению", callback_data=f'manage_{event_id}')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(
-        text,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-
-async def edit_event_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Начинает редактирование мероприятия"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    try:
-        event_id = int(query.data.split('_')[1])
-    except:
-        await query.answer("❌ Ошибка: неверный ID мероприятия", show_alert=True)
-        return
-    
-    context.user_data['editing_event_id'] = event_id
-    context.user_data['editing_field'] = None
-    
-    event = get_event_details(event_id)
-    if not event:
-        await query.edit_message_text("❌ Мероприятие не найдено.")
-        return
-    
-    title = event[0]
-    
-    keyboard = [
-        [InlineKeyboardButton("✏️ Название", callback_data=f'edit_field_title_{event_id}')],
-        [InlineKeyboardButton("📝 Описание", callback_data=f'edit_field_desc_{event_id}')],
-        [InlineKeyboardButton("📅 Дата", callback_data=f'edit_field_date_{event_id}')],
-        [InlineKeyboardButton("⏰ Время", callback_data=f'edit_field_time_{event_id}')],
-        [InlineKeyboardButton("📍 Место", callback_data=f'edit_field_location_{event_id}')],
-        [InlineKeyboardButton("👥 Макс. участников", callback_data=f'edit_field_max_{event_id}')],
-        [InlineKeyboardButton("◀️ Назад", callback_data=f'manage_{event_id}')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(
-        f"✏️ *Редактирование мероприятия:* {title}\n\n"
-        "Выберите поле для редактирования:",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-
-async def edit_event_field_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Начинает редактирование поля мероприятия"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    try:
-        field = query.data.split('_')[2]
-        event_id = int(query.data.split('_')[3])
-    except:
-        await query.edit_message_text("❌ Ошибка")
-        return
-    
-    event = get_event_details(event_id)
-    if not event:
-        await query.edit_message_text("❌ Мероприятие не найдено.")
-        return
-    
-    title, desc, date, time, location, max_vol, is_active, registration_open = event
-    
-    field_names = {
-        'title': 'Название',
-        'desc': 'Описание',
-        'date': 'Дату (ГГГГ-ММ-ДД)',
-        'time': 'Время (ЧЧ:ММ)',
-        'location': 'Место',
-        'max': 'Максимальное количество участников'
-    }
-    
-    field_values = {
-        'title': title,
-        'desc': desc,
-        'date': date,
-        'time': time,
-        'location': location,
-        'max': str(max_vol)
-    }
-    
-    field_name = field_names.get(field, 'поле')
-    current_value = field_values.get(field, '')
-    
-    await query.edit_message_text(
-        f"✏️ *Редактирование {field_name}*\n\n"
-        f"Текущее значение: `{current_value}`\n\n"
-        f"Отправьте новое значение.\n"
-        f"Для отмены отправьте /cancel",
-        parse_mode='Markdown'
-    )
-    
-    context.user_data['editing_event_id'] = event_id
-    context.user_data['editing_field'] = field
-    
-    return EDIT_EVENT_DETAILS
-
-async def save_event_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Сохраняет отредактированное поле мероприятия"""
-    if update.effective_user.id != ADMIN_ID:
-        await update.message.reply_text("⛔ У вас нет прав доступа.")
-        return ConversationHandler.END
-    
-    text = update.message.text.strip()
-    
-    if text.lower() == '/cancel':
-        await update.message.reply_text("✅ Редактирование отменено.")
-        return ConversationHandler.END
-    
-    event_id = context.user_data.get('editing_event_id')
-    field = context.user_data.get('editing_field')
-    
-    if not event_id or not field:
-        await update.message.reply_text("❌ Ошибка: данные не найдены.")
-        return ConversationHandler.END
-    
-    event = get_event_details(event_id)
-    if not event:
-        await update.message.reply_text("❌ Мероприятие не найдено.")
-        return ConversationHandler.END
-    
-    title = event[0]
-    
-    try:
-        # Валидация в зависимости от поля
-        if field == 'date':
-            try:
-                datetime.strptime(text, '%Y-%m-%d')
-            except ValueError:
-                await update.message.reply_text(
-                    "❌ Неверный формат даты! Используйте ГГГГ-ММ-ДД\n"
-                    "Пример: 2024-04-10\n\n"
-                    "Попробуйте еще раз или отправьте /cancel для отмены"
-                )
-                return EDIT_EVENT_DETAILS
-        
-        elif field == 'time':
-            try:
-                datetime.strptime(text, '%H:%M')
-            except ValueError:
-                await update.message.reply_text(
-                    "❌ Неверный формат времени! Используйте ЧЧ:ММ\n"
-                    "Пример: 14:00\n\n"
-                    "Попробуйте еще раз или отправьте /cancel для отмены"
-                )
-                return EDIT_EVENT_DETAILS
-        
-        elif field == 'max':
-            if not text.isdigit() and text != '0':
-                await update.message.reply_text(
-                    "❌ Введите число для максимального количества участников!\n"
-                    "Или 0 для неограниченного количества.\n\n"
-                    "Попробуйте еще раз или отправьте /cancel для отмены"
-                )
-                return EDIT_EVENT_DETAILS
-        
-        # Обновляем поле
-        db_field = {
-            'title': 'title',
-            'desc': 'description',
-            'date': 'date',
-            'time': 'time',
-            'location': 'location',
-            'max': 'max_volunteers'
-        }.get(field)
-        
-        if db_field:
-            update_event(event_id, db_field, text)
-        
-        await update.message.reply_text(
-            f"✅ Поле мероприятия '{title}' успешно обновлено!\n"
-            f"Новое значение: `{text}`",
-            parse_mode='Markdown'
-        )
-        
-    except Exception as e:
-        await update.message.reply_text(
-            f"❌ Ошибка при обновлении: {e}\n\n"
-            "Попробуйте еще раз или отправьте /cancel для отмены"
-        )
-        return EDIT_EVENT_DETAILS
-    
-    # Очищаем контекст
-    if 'editing_event_id' in context.user_data:
-        del context.user_data['editing_event_id']
-    if 'editing_field' in context.user_data:
-        del context.user_data['editing_field']
-    
-    return ConversationHandler.END
-
-async def admin_table(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет CSV таблицу админу"""
-    if update.effective_user.id != ADMIN_ID:
-        await update.message.reply_text("⛔ У вас нет прав доступа.")
-        return
-    
-    if not os.path.exists(CSV_FILE):
-        await update.message.reply_text("❌ Таблица еще не создана.")
-        return
-    
-    try:
-        with open(CSV_FILE, 'rb') as f:
-            await update.message.reply_document(
-                document=f,
-                filename=f'волонтеры_{datetime.now().strftime("%Y-%m-%d")}.csv',
-                caption=f"📊 Таблица волонтеров\nВсего записей: {count_csv_lines()}"
-            )
-        print(f"✅ Таблица отправлена админу {ADMIN_ID}")
-    except Exception as e:
-        await update.message.reply_text(f"❌ Ошибка при отправке таблицы: {e}")
-
-async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показывает статистику админу"""
-    if update.effective_user.id != ADMIN_ID:
-        await update.message.reply_text("⛔ У вас нет прав доступа.")
-        return
-    
-    # Статистика из БД
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    cur.execute("SELECT COUNT(*) FROM users")
-    users_count = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM events WHERE is_active = 1")
-    active_events = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM events WHERE is_active = 0")
-    inactive_events = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM events WHERE registration_open = 1 AND is_active = 1")
-    open_events = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM registrations")
-    regs_count = cur.fetchone()[0]
-    
-    # Популярные мероприятия
-    cur.execute('''
-        SELECT events.title, COUNT(registrations.id) as count
-        FROM events
-        LEFT JOIN registrations ON events.id = registrations.event_id
-        WHERE events.is_active = 1
-        GROUP BY events.id
-        ORDER BY count DESC
-        LIMIT 5
-    ''')
-    popular_events = cur.fetchall()
-    
-    conn.close()
-    
-    # Формируем текст
-    text = "👑 *Статистика для админа*\n\n"
-    text += f"👥 Пользователей: {users_count}\n"
-    text += f"📅 Всего мероприятий: {active_events + inactive_events}\n"
-    text += f"   ✅ Активных: {active_events}\n"
-    text += f"   ❌ Неактивных: {inactive_events}\n"
-    text += f"   📝 С открытой записью: {open_events}\n"
-    text += f"📝 Всего записей: {regs_count}\n"
-    text += f"📊 Записей в CSV: {count_csv_lines()}\n\n"
-    
-    text += "🔥 *Самые популярные мероприятия:*\n"
-    for title, count in popular_events:
-        text += f"• {title}: {count} записей\n"
-    
-    await update.message.reply_text(text, parse_mode='Markdown')
-
-async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /cancel"""
-    await update.message.reply_text("✅ Операция отменена.")
-    
-    # Сбрасываем флаги
-    if 'adding_event' in context.user_data:
-        del context.user_data['adding_event']
-    if 'editing_event_id' in context.user_data:
-        del context.user_data['editing_event_id']
-    if 'editing_field' in context.user_data:
-        del context.user_data['editing_field']
-    if 'registering_event_id' in context.user_data:
-        del context.user_data['registering_event_id']
-    
-    return ConversationHandler.END
-
-async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Админ-панель"""
-    if update.effective_user.id != ADMIN_ID:
-        await update.message.reply_text("⛔ У вас нет прав доступа.")
-        return
-    
-    keyboard = [
-        [InlineKeyboardButton("➕ Добавить мероприятие", callback_data='admin_add_event')],
-        [InlineKeyboardButton("🔧 Управление мероприятиями", callback_data='admin_manage')],
-        [InlineKeyboardButton("📋 Все мероприятия", callback_data='admin_list_events_btn')],
-        [InlineKeyboardButton("📊 Статистика", callback_data='admin_stats_btn')],
-        [InlineKeyboardButton("📥 Скачать общую таблицу", callback_data='admin_table_btn')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    text = (
-        "👑 *Админ-панель*\n\n"
-        "Выберите действие для управления волонтерскими мероприятиями:"
-    )
-    
-    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
-
-# ========== ИСПРАВЛЕННЫЕ ФУНКЦИИ КНОПОК ==========
-async def admin_add_event_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик кнопки добавления мероприятия (из админ-панели)"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    await query.edit_message_text(
-        "📝 *Добавление нового мероприятия*\n\n"
-        "Отправьте данные в формате:\n\n"
-        "`Название, Описание, Дата (ГГГГ-ММ-ДД), Время (ЧЧ:ММ), Место, Макс. участников`\n\n"
-        "*Пример:*\n"
-        "`Уборка парка, Субботник в центральном парке, 2024-04-10, 14:00, Центральный парк, 30`\n\n"
-        "📌 *Примечания:*\n"
-        "- Дата в формате ГГГГ-ММ-ДД\n"
-        "- Время в формате ЧЧ:ММ\n"
-        "- Макс. участников: число или 0 для неограниченного\n"
-        "- Описание не обязательно\n\n"
-        "Для отмены отправьте /cancel",
-        parse_mode='Markdown'
-    )
-    
-    context.user_data['adding_event'] = True
-
-async def admin_list_events_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик кнопки списка мероприятий"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    events = get_all_events_admin()
-    
-    if not events:
-        text = "📭 Нет мероприятий."
-    else:
-        text = "📋 *Все мероприятия:*\n\n"
-        for event in events:
-            event_id, title, date, time, location, max_vol, desc, is_active, registration_open, registered = event
-            status = "✅ Активно" if is_active == 1 else "❌ Неактивно"
-            reg_status = "✅ Открыта" if registration_open == 1 else "❌ Закрыта"
-            max_text = f"{max_vol}" if max_vol > 0 else "∞"
-            
-            text += f"🆔 *{event_id}*\n"
-            text += f"🎯 *{title}*\n"
-            text += f"   📅 {date} ⏰ {time}\n"
-            if location:
-                text += f"   📍 {location}\n"
-            text += f"   👥 {registered}/{max_text} записей\n"
-            text += f"   🏷️ Статус: {status}\n"
-            text += f"   📝 Запись: {reg_status}\n\n"
-    
-    keyboard = [[InlineKeyboardButton("◀️ Назад в админ-панель", callback_data='admin_back')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
-
-async def admin_stats_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик кнопки статистики"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    # Статистика из БД
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    
-    cur.execute("SELECT COUNT(*) FROM users")
-    users_count = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM events WHERE is_active = 1")
-    active_events = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM events WHERE is_active = 0")
-    inactive_events = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM events WHERE registration_open = 1 AND is_active = 1")
-    open_events = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM registrations")
-    regs_count = cur.fetchone()[0]
-    
-    # Популярные мероприятия
-    cur.execute('''
-        SELECT events.title, COUNT(registrations.id) as count
-        FROM events
-        LEFT JOIN registrations ON events.id = registrations.event_id
-        WHERE events.is_active = 1
-        GROUP BY events.id
-        ORDER BY count DESC
-        LIMIT 5
-    ''')
-    popular_events = cur.fetchall()
-    
-    conn.close()
-    
-    # Формируем текст
-    text = "👑 *Статистика для админа*\n\n"
-    text += f"👥 Пользователей: {users_count}\n"
-    text += f"📅 Всего мероприятий: {active_events + inactive_events}\n"
-    text += f"   ✅ Активных: {active_events}\n"
-    text += f"   ❌ Неактивных: {inactive_events}\n"
-    text += f"   📝 С открытой записью: {open_events}\n"
-    text += f"📝 Всего записей: {regs_count}\n"
-    text += f"📊 Записей в CSV: {count_csv_lines()}\n\n"
-    
-    text += "🔥 *Самые популярные мероприятия:*\n"
-    for title, count in popular_events:
-        text += f"• {title}: {count} записей\n"
-    
-    keyboard = [[InlineKeyboardButton("◀️ Назад в админ-панель", callback_data='admin_back')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
-
-async def admin_table_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик кнопки скачивания общей таблицы"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    if not os.path.exists(CSV_FILE):
-        await query.edit_message_text("❌ Таблица еще не создана.")
-        return
-    
-    try:
-        with open(CSV_FILE, 'rb') as f:
-            await context.bot.send_document(
-                chat_id=query.from_user.id,
-                document=f,
-                filename=f'волонтеры_{datetime.now().strftime("%Y-%m-%d")}.csv',
-                caption=f"📊 Общая таблица волонтеров\nВсего записей: {count_csv_lines()}"
-            )
-        
-        # Возвращаемся к админ-панели
-        keyboard = [[InlineKeyboardButton("◀️ Назад в админ-панель", callback_data='admin_back')]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            "✅ Общая таблица отправлена вам в личные сообщения!",
-            reply_markup=reply_markup
-        )
-        
-        print(f"✅ Общая таблица отправлена админу {ADMIN_ID}")
-    except Exception as e:
-        await query.edit_message_text(f"❌ Ошибка при отправке таблицы: {e}")
-
-async def admin_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Возврат в админ-панель"""
-    query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        return
-    
-    keyboard = [
-        [InlineKeyboardButton("➕ Добавить мероприятие", callback_data='admin_add_event')],
-        [InlineKeyboardButton("🔧 Управление мероприятиями", callback_data='admin_manage')],
-        [InlineKeyboardButton("📋 Все мероприятия", callback_data='admin_list_events_btn')],
-        [InlineKeyboardButton("📊 Статистика", callback_data='admin_stats_btn')],
-        [InlineKeyboardButton("📥 Скачать общую таблицу", callback_data='admin_table_btn')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    text = (
-        "👑 *Админ-панель*\n\n"
-        "Выберите действие для управления волонтерскими мероприятиями:"
-    )
-    
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
-
-# ========== ОБРАБОТЧИК СООБЩЕНИЙ ДЛЯ ДОБАВЛЕНИЯ МЕРОПРИЯТИЙ ==========
-async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает сообщения от админа для добавления мероприятий"""
-    # Проверяем, что это админ и он в режиме добавления мероприятия
-    if update.effective_user.id != ADMIN_ID:
-        return
-    
-    if context.user_data.get('adding_event'):
-        await save_new_event(update, context)
-    else:
-        # Если сообщение не связано с добавлением мероприятия, игнорируем
-        pass
-
-# ========== ОБРАБОТЧИК ОШИБОК ==========
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик ошибок"""
-    try:
-        raise context.error
-    except Exception as e:
-        print(f"⚠️ Ошибка: {e}")
-        
-        # Отправляем сообщение админу об ошибке
-        if ADMIN_ID:
-            try:
-                await context.bot.send_message(
-                    chat_id=ADMIN_ID,
-                    text=f"⚠️ Ошибка в боте: {type(e).__name__}: {e}"
-                )
-            except:
-                pass
-    
-    return ConversationHandler.END
-
-# ========== ОСНОВНАЯ ФУНКЦИЯ ==========
-def main():
-    print("=" * 50)
-    print("🤖 Волонтерский бот запускается...")
-    print(f"👑 Админ ID: {ADMIN_ID}")
-    print(f"💾 База данных: {DB_NAME}")
-    print(f"📊 CSV таблица: {CSV_FILE}")
-    print("=" * 50)
-    
-    # Инициализируем БД и CSV
-    init_db()
-    init_csv()
-    
-    # Создаем приложение
-    application = Application.builder().token(TOKEN).build()
-    
-    # Добавляем обработчик ошибок
-    application.add_error_handler(error_handler)
-    
-    # Создаем ConversationHandler для редактирования данных
-    edit_info_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(edit_info_start, pattern='^edit_info$')],
-        states={
-            EDITING_INFO: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_user_info)],
-        },
-        fallbacks=[CommandHandler('cancel', cancel_command)]
-    )
-    
-    # Создаем ConversationHandler для добавления мероприятий (из команд)
-    add_event_handler = ConversationHandler(
-        entry_points=[CommandHandler('addevent', admin_add_event)],
-        states={
-            ADDING_EVENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_new_event)],
-        },
-        fallbacks=[CommandHandler('cancel', cancel_command)]
-    )
-    
-    # Создаем ConversationHandler для редактирования мероприятий
-    edit_event_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(edit_event_field_start, pattern='^edit_field_')],
-        states={
-            EDIT_EVENT_DETAILS: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_event_field)],
-        },
-        fallbacks=[CommandHandler('cancel', cancel_command)]
-    )
-    
-    # Создаем ConversationHandler для записи с комментарием
-    register_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(register_for_event, pattern='^register_')],
-        states={
-            ADDING_COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_registration_with_comment)],
-        },
-        fallbacks=[CommandHandler('cancel', cancel_command)]
-    )
-    
-    # Регистрируем обработчики команд
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("admin", admin_panel))
-    application.add_handler(CommandHandler("events", admin_list_events))
-    application.add_handler(CommandHandler("table", admin_table))
-    application.add_handler(CommandHandler("stats", admin_stats))
-    
-    # Регистрируем ConversationHandlers
-    application.add_handler(edit_info_handler)
-    application.add_handler(add_event_handler)
-    application.add_handler(edit_event_handler)
-    application.add_handler(register_handler)
-    
-    # Регистрируем обработчики callback-запросов (ОБЫЧНЫЕ)
-    application.add_handler(CallbackQueryHandler(list_events, pattern='^list_events$'))
-    application.add_handler(CallbackQueryHandler(event_detail, pattern='^event_'))
-    application.add_handler(CallbackQueryHandler(cancel_registration, pattern='^cancel_reg_'))
-    application.add_handler(CallbackQueryHandler(my_info, pattern='^my_info$'))
-    application.add_handler(CallbackQueryHandler(my_registrations, pattern='^my_registrations$'))
-    application.add_handler(CallbackQueryHandler(main_menu, pattern='^main_menu$'))
-    
-    # Админ обработчики кнопок
-    application.add_handler(CallbackQueryHandler(admin_add_event_btn, pattern='^admin_add_event$'))
-    application.add_handler(CallbackQueryHandler(admin_manage_events, pattern='^admin_manage$'))
-    application.add_handler(CallbackQueryHandler(admin_list_events_btn, pattern='^admin_list_events_btn$'))
-    application.add_handler(CallbackQueryHandler(admin_stats_btn, pattern='^admin_stats_btn$'))
-    application.add_handler(CallbackQueryHandler(admin_table_btn, pattern='^admin_table_btn$'))
-    application.add_handler(CallbackQueryHandler(admin_back, pattern='^admin_back$'))
-    
-    # ОТДЕЛЬНЫЕ обработчики для управления мероприятиями
-    application.add_handler(CallbackQueryHandler(manage_event, pattern='^manage_'))
-    application.add_handler(CallbackQueryHandler(toggle_registration_handler, pattern='^toggle_reg_'))
-    application.add_handler(CallbackQueryHandler(toggle_active_handler, pattern='^toggle_active_'))
-    application.add_handler(CallbackQueryHandler(download_event_handler, pattern='^download_event_'))
-    application.add_handler(CallbackQueryHandler(delete_event_handler, pattern='^delete_'))
-    application.add_handler(CallbackQueryHandler(confirm_delete_handler, pattern='^confirm_delete_'))
-    application.add_handler(CallbackQueryHandler(view_event_participants, pattern='^view_'))
-    application.add_handler(CallbackQueryHandler(edit_event_start, pattern='^edit_'))
-    
-    # Обработчик сообщений для добавления мероприятий из кнопок
-    application.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND & filters.User(user_id=ADMIN_ID),
-        handle_admin_message
-    ))
-    
-    print("✅ Бот запущен и ожидает сообщений...")
-    print("=" * 50)
-    
-    # Запускаем бота с параметрами для Railway
-    try:
-        print("🔄 Запускаем бота с параметрами для Railway...")
-        application.run_polling(
-            drop_pending_updates=True,
-            allowed_updates=Update.ALL_TYPES,
-            close_loop=False
-        )
-    except KeyboardInterrupt:
-        print("🛑 Бот остановлен пользователем")
-    except Exception as e:
-        print(f"❌ Критическая ошибка: {e}")
-        sys.exit(1)
-
-if __name__ == "__main__":
+import os
+import sys
+import sqlite3
+import csv
+import io
+import asyncio
+import bisect
+import functools
+import heapq
+import hmac
+import json
+import pathlib
+import queue
+import random
+import re
+import signal
+import tempfile
+import threading
+import time as time_module
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.helpers import escape_markdown
+from telegram.ext import BasePersistence, BaseUpdateProcessor, PersistenceInput
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes, ConversationHandler
+# Загружаем .env файл
+from dotenv import load_dotenv
+import os
+
+# Пробуем загрузить из .env, если нет - из bot.env
+dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
+if not os.path.exists(dotenv_path):
+    dotenv_path = os.path.join(os.path.dirname(__file__), 'bot.env')
+    print(f"Использую bot.env: {dotenv_path}")
+
+load_dotenv(dotenv_path)
+print(f"Загружен файл: {dotenv_path}")
+
+# ========== НАСТРОЙКИ ==========
+TOKEN = os.environ.get('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
+ADMIN_ID = 1121098820  # ⬅️ ЗАМЕНИТЕ НА ВАШ TELEGRAM ID!
+
+if TOKEN == 'YOUR_BOT_TOKEN_HERE':
+    raise ValueError("❌ Токен бота не найден! Установите BOT_TOKEN в Railway")
+
+DB_NAME = "volunteer_bot.db"
+CSV_FILE = "volunteers.csv"
+CSV_JOURNAL_FILE = "volunteers_journal.csv"
+
+# Источник общей таблицы волонтеров:
+#   db  - таблица собирается из базы при скачивании (по умолчанию)
+#   csv - ведется файл volunteers.csv, как раньше
+TABLE_SOURCE = os.environ.get('TABLE_SOURCE', 'db')
+TABLE_FROM_DB = TABLE_SOURCE != 'csv'
+
+# Как часто (в секундах) журнал изменений применяется к volunteers.csv
+CSV_COMPACT_INTERVAL = int(os.environ.get('CSV_COMPACT_INTERVAL', '300'))
+# Запись строк в CSV пачками: сброс на диск по количеству строк или по времени (сек.)
+CSV_FLUSH_ROWS = int(os.environ.get('CSV_FLUSH_ROWS', '100'))
+CSV_FLUSH_INTERVAL = float(os.environ.get('CSV_FLUSH_INTERVAL', '0.5'))
+# Повтор пачки, которую не удалось записать: первая задержка (сек.), предел
+# задержки и число попыток при остановке бота
+CSV_RETRY_DELAY = float(os.environ.get('CSV_RETRY_DELAY', '0.5'))
+CSV_RETRY_MAX_DELAY = float(os.environ.get('CSV_RETRY_MAX_DELAY', '30'))
+CSV_STOP_RETRIES = int(os.environ.get('CSV_STOP_RETRIES', '3'))
+
+# Объем выгрузки, который держится в памяти, прежде чем уйти во временный файл
+EXPORT_SPOOL_BYTES = int(os.environ.get('EXPORT_SPOOL_BYTES', str(1024 * 1024)))
+# Сколько строк читается из базы за один раз при выгрузке
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+
+# Пул соединений с БД: одно соединение на запись и несколько только для чтения
+DB_READERS = int(os.environ.get('DB_READERS', '3'))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', '5000'))
+DB_BUSY_RETRIES = int(os.environ.get('DB_BUSY_RETRIES', '5'))
+
+# Сколько последних сообщений помнит проверка повторного редактирования
+EDIT_FINGERPRINTS = int(os.environ.get('EDIT_FINGERPRINTS', '10000'))
+
+# Кэш профилей пользователей: размер, время жизни записи (сек., 0 - без
+# ограничения) и порядок вытеснения: lru - давно не использованные, fifo - старые
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', '5000'))
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', '600'))
+PROFILE_CACHE_POLICY = os.environ.get('PROFILE_CACHE_POLICY', 'lru')
+
+# Режим получения обновлений:
+#   polling - бот сам опрашивает Telegram (по умолчанию, для разработки)
+#   webhook - Telegram присылает обновления на встроенный HTTP сервер
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+# Публичный адрес сервера (например, https://bot.up.railway.app). Если пусто,
+# webhook в Telegram не устанавливается - удобно для локальной проверки
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('PORT', '8080'))
+# Максимальный размер тела запроса к серверу, число и общий размер заголовков
+WEBHOOK_MAX_BODY = 1024 * 1024
+WEBHOOK_MAX_HEADERS = 64
+WEBHOOK_MAX_HEADER_BYTES = 16 * 1024
+# Сколько секунд соединение keep-alive может простаивать между запросами и
+# сколько можно читать один запрос (заголовки и тело)
+WEBHOOK_IDLE_TIMEOUT = float(os.environ.get('WEBHOOK_IDLE_TIMEOUT', '75'))
+WEBHOOK_READ_TIMEOUT = float(os.environ.get('WEBHOOK_READ_TIMEOUT', '10'))
+
+# Без секрета любой, кто знает адрес, может прислать боту поддельное обновление
+if BOT_MODE == 'webhook' and not WEBHOOK_SECRET:
+    raise ValueError("❌ В режиме webhook нужен WEBHOOK_SECRET! Установите его в Railway")
+
+# Сколько обновлений обрабатывается одновременно (обновления одного
+# пользователя всегда идут по очереди) и сколько их может ждать у одного пользователя
+UPDATE_CONCURRENCY = int(os.environ.get('UPDATE_CONCURRENCY', '16'))
+USER_QUEUE_LIMIT = int(os.environ.get('USER_QUEUE_LIMIT', '8'))
+
+# Рассылки записавшимся: сообщений в секунду на весь бот, минимальный
+# интервал между сообщениями в один чат (сек.) и число попыток доставки
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', '30'))
+BROADCAST_CHAT_INTERVAL = float(os.environ.get('BROADCAST_CHAT_INTERVAL', '1'))
+BROADCAST_MAX_ATTEMPTS = int(os.environ.get('BROADCAST_MAX_ATTEMPTS', '5'))
+BROADCAST_SENDERS = int(os.environ.get('BROADCAST_SENDERS', '8'))
+
+# Напоминания записавшимся: за сколько часов до начала (0 - выключены) и
+# часовой пояс, в котором указаны дата и время мероприятий (смещение от UTC)
+REMINDER_HOURS = float(os.environ.get('REMINDER_HOURS', '24'))
+EVENT_TZ_OFFSET_HOURS = float(os.environ.get('EVENT_TZ_OFFSET_HOURS', '3'))
+
+# Размер страницы в списках мероприятий (для пользователей и для админа)
+EVENTS_PAGE_SIZE = int(os.environ.get('EVENTS_PAGE_SIZE', '5'))
+ADMIN_PAGE_SIZE = int(os.environ.get('ADMIN_PAGE_SIZE', '10'))
+
+# Длинные отчеты (список мероприятий, участники) делятся на сообщения не длиннее
+# REPORT_LIMIT символов (лимит Telegram - 4096), строки читаются порциями
+REPORT_LIMIT = int(os.environ.get('REPORT_LIMIT', '4000'))
+REPORT_BATCH_SIZE = int(os.environ.get('REPORT_BATCH_SIZE', '50'))
+
+# Как часто (сек.) изменения user_data и состояния диалогов записываются в базу
+PERSISTENCE_INTERVAL = float(os.environ.get('PERSISTENCE_INTERVAL', '5'))
+
+# Количество потоков для запросов к БД и работы с файлами
+DB_WORKERS = int(os.environ.get('DB_WORKERS', str(DB_READERS + 1)))
+
+# Состояния для ConversationHandler
+EDITING_INFO, ADDING_EVENT, EDITING_EVENT, MANAGE_EVENT, EDIT_EVENT_DETAILS, ADDING_COMMENT = range(6)
+
+print(f"🚀 Бот запускается...")
+print(f"👑 Админ ID: {ADMIN_ID}")
+
+# ========== ВЫПОЛНЕНИЕ БЛОКИРУЮЩИХ ОПЕРАЦИЙ ==========
+# Все запросы к SQLite и работа с CSV выполняются в отдельном пуле потоков,
+# чтобы медленный запрос или запись на диск не останавливали обработку
+# нажатий кнопок других пользователей.
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='db')
+
+# Блокировка файлов volunteers.csv и журнала изменений
+csv_lock = threading.Lock()
+
+def in_executor(func):
+    """Превращает синхронную функцию в awaitable, выполняемую в пуле потоков БД"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+    
+    # Синхронная версия остается доступной для вызова вне цикла событий
+    wrapper.sync = func
+    return wrapper
+
+# ========== ПУЛ СОЕДИНЕНИЙ SQLITE ==========
+class SQLitePool:
+    """Долгоживущие соединения: одно для записи и несколько только для чтения.
+    
+    База работает в режиме WAL, поэтому долгие выгрузки админа через читающие
+    соединения не блокируют запись волонтеров. Все записи идут через одно
+    соединение по очереди, каждая в своей транзакции BEGIN IMMEDIATE.
+    """
+    
+    def __init__(self, path, readers=DB_READERS):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._readers = queue.Queue()
+        self._reader_count = readers
+        self.writer = self._connect()
+    
+    def _connect(self, readonly=False):
+        if readonly:
+            uri = pathlib.Path(self.path).absolute().as_uri() + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-8000')
+        return conn
+    
+    def open_readers(self):
+        """Открывает читающие соединения (после создания схемы)"""
+        for _ in range(self._reader_count):
+            self._readers.put(self._connect(readonly=True))
+    
+    @contextmanager
+    def read(self):
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+    
+    @contextmanager
+    def write(self):
+        with self._write_lock:
+            self.writer.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.writer
+                self.writer.execute('COMMIT')
+            except BaseException:
+                if self.writer.in_transaction:
+                    self.writer.execute('ROLLBACK')
+                raise
+    
+    def close(self):
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+        with self._write_lock:
+            self.writer.close()
+
+db_pool = None
+
+def is_busy_error(error):
+    """Проверяет, что ошибка вызвана блокировкой базы (SQLITE_BUSY/SQLITE_LOCKED)"""
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+def with_busy_retry(func, *args, **kwargs):
+    """Повторяет операцию с экспоненциальной задержкой, пока база занята"""
+    for attempt in range(DB_BUSY_RETRIES):
+        try:
+            return func(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e) or attempt == DB_BUSY_RETRIES - 1:
+                raise
+            delay = 0.05 * (2 ** attempt) * (1 + random.random())
+            print(f"⚠️ База занята, повтор через {delay:.2f} с: {e}")
+            time_module.sleep(delay)
+
+def db_read(func):
+    """Выполняет функцию с читающим соединением из пула (вне цикла событий)"""
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        def attempt():
+            with db_pool.read() as conn:
+                return func(conn, *args, **kwargs)
+        return with_busy_retry(attempt)
+    
+    return in_executor(run)
+
+# Действия, которые нужно выполнить после фиксации текущей транзакции записи
+_commit_hooks = threading.local()
+
+def after_commit(callback, *args):
+    """Откладывает вызов до успешного COMMIT текущей транзакции (например, сброс кэша).
+    
+    При откате транзакции вызов отменяется. Вне транзакции вызывается сразу.
+    """
+    hooks = getattr(_commit_hooks, 'pending', None)
+    if hooks is None:
+        callback(*args)
+    else:
+        hooks.append((callback, args))
+
+def db_write(func):
+    """Выполняет функцию в транзакции на соединении для записи (вне цикла событий)"""
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        def attempt():
+            _commit_hooks.pending = hooks = []
+            try:
+                with db_pool.write() as conn:
+                    result = func(conn, *args, **kwargs)
+            finally:
+                _commit_hooks.pending = None
+            return result, hooks
+        
+        result, hooks = with_busy_retry(attempt)
+        for callback, hook_args in hooks:
+            callback(*hook_args)
+        return result
+    
+    return in_executor(run)
+
+# ========== МИГРАЦИИ СХЕМЫ ==========
+def import_legacy_csv(conn):
+    """Переносит строки старого volunteers.csv в таблицу legacy_registrations.
+    
+    Так сохраняется история (в том числе отмененные записи), когда общая
+    таблица начинает собираться из базы.
+    """
+    if not os.path.exists(CSV_FILE):
+        return
+    
+    # Сначала применяем незавершенный журнал изменений
+    compact_csv_journal_sync()
+    
+    imported = 0
+    with open(CSV_FILE, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if not row or not row[0].isdigit():
+                continue
+            row = (row + [''] * 16)[:16]
+            conn.execute('''
+                INSERT OR IGNORE INTO legacy_registrations (
+                    registration_id, registration_day, registration_time,
+                    telegram_id, full_name, group_name, birth_date, phone_number, username,
+                    event_id, event_title, event_date, event_time, location,
+                    comment, status
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', row)
+            imported += 1
+    
+    print(f"✅ Импортировано строк из {CSV_FILE}: {imported}")
+
+def add_column_if_missing(conn, table, column, definition):
+    """Добавляет колонку, если ее еще нет (ALTER TABLE нельзя повторить)"""
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+# Каждая миграция: (версия, описание, список шагов). Шаг - SQL-запрос или
+# функция, принимающая соединение. Миграции применяются по порядку при запуске,
+# каждая в своей транзакции, и записываются в таблицу schema_migrations.
+# Все шаги должны быть безопасны для повторного запуска на существующей базе.
+# Пересчет снимка статистики одним агрегирующим запросом (миграция 9 и кнопка «🔄 Пересчитать»)
+STATS_SNAPSHOT_REFRESH = '''
+    INSERT OR REPLACE INTO stats_snapshot (
+        id, users, registrations, legacy_rows, active_events, inactive_events, open_events, computed_at
+    )
+    SELECT 1,
+           (SELECT COUNT(*) FROM users),
+           (SELECT COUNT(*) FROM registrations),
+           (SELECT COUNT(*) FROM legacy_registrations
+            WHERE registration_id NOT IN (SELECT id FROM registrations)),
+           COALESCE(SUM(is_active = 1), 0),
+           COALESCE(SUM(is_active = 0), 0),
+           COALESCE(SUM(is_active = 1 AND registration_open = 1), 0),
+           strftime('%Y-%m-%d %H:%M:%S', 'now')
+    FROM events
+'''
+
+MIGRATIONS = [
+    (1, 'Начальная схема', [
+        '''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            location TEXT,
+            max_volunteers INTEGER,
+            is_active BOOLEAN DEFAULT 1,
+            registration_open BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            telegram_id INTEGER PRIMARY KEY,
+            full_name TEXT NOT NULL,
+            group_name TEXT,
+            birth_date TEXT,
+            phone_number TEXT,
+            username TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS registrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            event_id INTEGER NOT NULL,
+            comment TEXT,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (telegram_id),
+            FOREIGN KEY (event_id) REFERENCES events (id),
+            UNIQUE(user_id, event_id)
+        )
+        ''',
+    ]),
+    (2, 'Индексы для списков мероприятий и записей', [
+        # Записи мероприятия в порядке регистрации (участники, выгрузки, подсчет).
+        # Поиск по user_id уже покрыт индексом UNIQUE(user_id, event_id)
+        'CREATE INDEX IF NOT EXISTS idx_registrations_event ON registrations (event_id, registration_date)',
+        # Фильтр get_active_events
+        'CREATE INDEX IF NOT EXISTS idx_events_listing ON events (is_active, registration_open, date, time)',
+        # Сортировка списков админа
+        'CREATE INDEX IF NOT EXISTS idx_events_date ON events (date, time)',
+    ]),
+    (3, 'Счетчик записей events.registered_count', [
+        lambda conn: add_column_if_missing(conn, 'events', 'registered_count', 'INTEGER NOT NULL DEFAULT 0'),
+        'UPDATE events SET registered_count = (SELECT COUNT(*) FROM registrations WHERE event_id = events.id)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_registrations_count_insert
+        AFTER INSERT ON registrations
+        BEGIN
+            UPDATE events SET registered_count = registered_count + 1 WHERE id = NEW.event_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_registrations_count_delete
+        AFTER DELETE ON registrations
+        BEGIN
+            UPDATE events SET registered_count = registered_count - 1 WHERE id = OLD.event_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_registrations_count_move
+        AFTER UPDATE OF event_id ON registrations
+        WHEN OLD.event_id != NEW.event_id
+        BEGIN
+            UPDATE events SET registered_count = registered_count - 1 WHERE id = OLD.event_id;
+            UPDATE events SET registered_count = registered_count + 1 WHERE id = NEW.event_id;
+        END
+        ''',
+    ]),
+    (4, 'История записей из volunteers.csv', [
+        '''
+        CREATE TABLE IF NOT EXISTS legacy_registrations (
+            registration_id INTEGER PRIMARY KEY,
+            registration_day TEXT,
+            registration_time TEXT,
+            telegram_id INTEGER,
+            full_name TEXT,
+            group_name TEXT,
+            birth_date TEXT,
+            phone_number TEXT,
+            username TEXT,
+            event_id INTEGER,
+            event_title TEXT,
+            event_date TEXT,
+            event_time TEXT,
+            location TEXT,
+            comment TEXT,
+            status TEXT
+        )
+        ''',
+        import_legacy_csv,
+    ]),
+    (5, 'Время изменения мероприятия events.updated_at', [
+        lambda conn: add_column_if_missing(conn, 'events', 'updated_at', 'TEXT'),
+        'UPDATE events SET updated_at = created_at WHERE updated_at IS NULL',
+        # Счетчик записей не меняет updated_at: записи учитываются в версии отдельно
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_events_updated_at
+        AFTER UPDATE OF title, description, date, time, location, max_volunteers,
+                        is_active, registration_open ON events
+        BEGIN
+            UPDATE events SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+        END
+        ''',
+    ]),
+    (6, 'Очередь рассылок', [
+        '''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            event_id INTEGER,
+            text TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            broadcast_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            error TEXT,
+            sent_at TIMESTAMP,
+            FOREIGN KEY (broadcast_id) REFERENCES broadcasts (id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(available_at) WHERE status = 'pending'",
+        'CREATE INDEX IF NOT EXISTS idx_outbox_broadcast ON outbox(broadcast_id, status)',
+    ]),
+    (7, 'Отметка о напоминании events.reminded_for', [
+        # Дата и время, для которых напоминание уже поставлено в рассылку
+        lambda conn: add_column_if_missing(conn, 'events', 'reminded_for', 'TEXT'),
+    ]),
+    (8, 'Состояние диалогов и user_data', [
+        '''
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (user_id, key)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, key)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (9, 'Снимок статистики stats_snapshot', [
+        # Одна строка со счетчиками; триггеры меняют ее в той же транзакции,
+        # что и сами данные, как registered_count у мероприятий
+        '''
+        CREATE TABLE IF NOT EXISTS stats_snapshot (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            users INTEGER NOT NULL,
+            registrations INTEGER NOT NULL,
+            legacy_rows INTEGER NOT NULL,
+            active_events INTEGER NOT NULL,
+            inactive_events INTEGER NOT NULL,
+            open_events INTEGER NOT NULL,
+            computed_at TEXT NOT NULL
+        )
+        ''',
+        STATS_SNAPSHOT_REFRESH,
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_insert
+        AFTER INSERT ON users
+        BEGIN
+            UPDATE stats_snapshot SET users = users + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_users_delete
+        AFTER DELETE ON users
+        BEGIN
+            UPDATE stats_snapshot SET users = users - 1;
+        END
+        ''',
+        # Строка из старого CSV показывается в таблице, только пока в базе нет записи с тем же id
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_registrations_insert
+        AFTER INSERT ON registrations
+        BEGIN
+            UPDATE stats_snapshot SET registrations = registrations + 1,
+                legacy_rows = legacy_rows - EXISTS (SELECT 1 FROM legacy_registrations WHERE registration_id = NEW.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_registrations_delete
+        AFTER DELETE ON registrations
+        BEGIN
+            UPDATE stats_snapshot SET registrations = registrations - 1,
+                legacy_rows = legacy_rows + EXISTS (SELECT 1 FROM legacy_registrations WHERE registration_id = OLD.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_events_insert
+        AFTER INSERT ON events
+        BEGIN
+            UPDATE stats_snapshot SET active_events = active_events + (NEW.is_active = 1),
+                inactive_events = inactive_events + (NEW.is_active = 0),
+                open_events = open_events + (NEW.is_active = 1 AND NEW.registration_open = 1);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_events_delete
+        AFTER DELETE ON events
+        BEGIN
+            UPDATE stats_snapshot SET active_events = active_events - (OLD.is_active = 1),
+                inactive_events = inactive_events - (OLD.is_active = 0),
+                open_events = open_events - (OLD.is_active = 1 AND OLD.registration_open = 1);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_events_update
+        AFTER UPDATE OF is_active, registration_open ON events
+        BEGIN
+            UPDATE stats_snapshot SET
+                active_events = active_events - (OLD.is_active = 1) + (NEW.is_active = 1),
+                inactive_events = inactive_events - (OLD.is_active = 0) + (NEW.is_active = 0),
+                open_events = open_events - (OLD.is_active = 1 AND OLD.registration_open = 1)
+                                          + (NEW.is_active = 1 AND NEW.registration_open = 1);
+        END
+        ''',
+        # Самые популярные активные мероприятия - без сортировки всей таблицы
+        'CREATE INDEX IF NOT EXISTS idx_events_popular ON events (is_active, registered_count)',
+    ]),
+    # save_user_profile раньше делал INSERT OR REPLACE, и каждое сохранение
+    # анкеты срабатывало как новая вставка и увеличивало счетчик пользователей
+    (10, 'Пересчет снимка статистики', [STATS_SNAPSHOT_REFRESH]),
+]
+
+def apply_migrations(pool):
+    """Применяет еще не примененные миграции по порядку"""
+    pool.writer.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    for version, name, steps in MIGRATIONS:
+        with pool.write() as conn:
+            # Проверяем внутри транзакции, чтобы два процесса не применили миграцию дважды
+            if conn.execute('SELECT 1 FROM schema_migrations WHERE version = ?', (version,)).fetchone():
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('INSERT INTO schema_migrations (version, name) VALUES (?, ?)', (version, name))
+        print(f"✅ Применена миграция {version}: {name}")
+    
+    pool.writer.execute('PRAGMA optimize')
+    return MIGRATIONS[-1][0]
+
+# ========== ИНИЦИАЛИЗАЦИЯ БАЗЫ ДАННЫХ И CSV ==========
+def init_db():
+    """Инициализирует базу данных и пул соединений"""
+    global db_pool
+    db_pool = SQLitePool(DB_NAME)
+    
+    schema_version = apply_migrations(db_pool)
+    
+    db_pool.open_readers()
+    print(f"✅ База данных инициализирована (версия схемы: {schema_version})")
+
+# Колонки общей таблицы волонтеров
+VOLUNTEERS_TABLE_HEADER = [
+    'ID записи', 'Дата записи', 'Время записи',
+    'Telegram ID', 'ФИО', 'Группа', 'Дата рождения', 'Телефон', 'Username',
+    'ID мероприятия', 'Название мероприятия',
+    'Дата мероприятия', 'Время мероприятия', 'Место',
+    'Комментарий к записи',
+    'Статус записи'
+]
+
+def init_csv():
+    """Создает CSV файл с заголовками"""
+    if not os.path.exists(CSV_FILE):
+        with open(CSV_FILE, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(VOLUNTEERS_TABLE_HEADER)
+        print(f"✅ Создан CSV файл: {CSV_FILE}")
+
+# Строки для volunteers.csv и журнала не пишутся на диск в обработчике:
+# они попадают в очередь, а одна фоновая задача собирает их в пачки и
+# сбрасывает с fsync, когда набралось CSV_FLUSH_ROWS строк или прошло
+# CSV_FLUSH_INTERVAL секунд. При остановке бота очередь дописывается до конца.
+# Если пачку записать не удалось, она не теряется: задача повторяет ее с
+# нарастающей задержкой, а новые строки ждут в очереди, сохраняя порядок.
+class CsvWriter:
+    """Фоновая запись строк в CSV файлы"""
+    
+    def __init__(self):
+        self.queue = None
+        self.task = None
+        self.rows_written = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.retries = 0
+        self.rows_lost = 0
+        self.stopping = None
+    
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+    
+    @property
+    def depth(self):
+        return self.queue.qsize() if self.queue else 0
+    
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.stopping = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        """Дописывает очередь и останавливает задачу"""
+        if not self.running:
+            return
+        self.stopping.set()
+        await self.queue.put(None)
+        await self.task
+        print(f"✅ Очередь CSV записана: {self.rows_written} строк за {self.flushes} сбросов")
+    
+    async def write(self, path, row):
+        """Ставит строку в очередь. Без запущенной задачи пишет сразу"""
+        if not self.running:
+            return not await asyncio.get_running_loop().run_in_executor(
+                db_executor, write_csv_rows, [(path, row)]
+            )
+        await self.queue.put((path, row))
+        return True
+    
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + CSV_FLUSH_INTERVAL
+            
+            # Добираем пачку, пока не вышло время или не набралось строк
+            while len(batch) < CSV_FLUSH_ROWS:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            await self.flush(batch)
+    
+    async def flush(self, batch):
+        """Записывает пачку, повторяя незаписанные строки с нарастающей задержкой.
+        
+        Пока бот работает, попытки не ограничены. После stop() делается еще не
+        больше CSV_STOP_RETRIES повторов, а строки, которые так и не удалось
+        записать, выводятся в лог. Возвращает True, если записано все.
+        """
+        loop = asyncio.get_running_loop()
+        delay = CSV_RETRY_DELAY
+        stop_retries = 0
+        while True:
+            started = time_module.perf_counter()
+            failed = await loop.run_in_executor(db_executor, write_csv_rows, batch)
+            elapsed_ms = (time_module.perf_counter() - started) * 1000
+            self.rows_written += len(batch) - len(failed)
+            
+            if not failed:
+                self.flushes += 1
+                self.last_flush_ms = elapsed_ms
+                self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+                return True
+            
+            batch = failed
+            if self.stopping.is_set():
+                if stop_retries >= CSV_STOP_RETRIES:
+                    print(f"❌ Не удалось записать {len(batch)} строк CSV при остановке:")
+                    for path, row in batch:
+                        print(f"   {path}: {row}")
+                    self.rows_lost += len(batch)
+                    return False
+                stop_retries += 1
+                delay = CSV_RETRY_DELAY * 2 ** (stop_retries - 1)
+            
+            self.retries += 1
+            print(f"⚠️ Повтор записи {len(batch)} строк CSV через {delay:.1f} с")
+            if self.stopping.is_set():
+                await asyncio.sleep(delay)
+            else:
+                try:
+                    # stop() прерывает долгое ожидание, дальше идут короткие повторы
+                    await asyncio.wait_for(self.stopping.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            delay = min(delay * 2, CSV_RETRY_MAX_DELAY)
+
+csv_writer = CsvWriter()
+
+def write_csv_rows(batch):
+    """Дописывает пачку строк [(файл, строка)] и сбрасывает их на диск.
+    
+    Строки таблицы пишутся раньше строк журнала, поэтому отмена записи
+    никогда не попадает на диск раньше самой записи. Возвращает строки,
+    которые записать не удалось (пустой список, если записано все): при
+    ошибке в таблице журнал тоже не пишется, чтобы сохранить этот порядок.
+    """
+    by_file = {}
+    for path, row in batch:
+        by_file.setdefault(path, []).append(row)
+    
+    paths = sorted(by_file, key=lambda p: p != CSV_FILE)
+    with csv_lock:
+        for index, path in enumerate(paths):
+            try:
+                with open(path, 'a', newline='', encoding='utf-8') as f:
+                    csv.writer(f).writerows(by_file[path])
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception as e:
+                print(f"❌ Ошибка сохранения в CSV: {e}")
+                return [(p, row) for p in paths[index:] for row in by_file[p]]
+    return []
+
+async def save_to_csv(user_data, event_data, comment='', status='Записан'):
+    """Сохраняет запись в CSV файл"""
+    now = datetime.now()
+    row = [
+        user_data.get('registration_id', ''),
+        now.strftime('%Y-%m-%d'),
+        now.strftime('%H:%M:%S'),
+        user_data.get('telegram_id', ''),
+        user_data.get('full_name', ''),
+        user_data.get('group', ''),
+        user_data.get('birth_date', ''),
+        user_data.get('phone', ''),
+        user_data.get('username', ''),
+        event_data.get('id', ''),
+        event_data.get('title', ''),
+        event_data.get('date', ''),
+        event_data.get('time', ''),
+        event_data.get('location', ''),
+        comment,
+        status
+    ]
+    return await csv_writer.write(CSV_FILE, row)
+
+# Журнал изменений таблицы: вместо перезаписи всего volunteers.csv при каждой
+# отмене в журнал дописывается одна строка (статус или удаление), а фоновая
+# задача периодически применяет журнал к основному файлу.
+JOURNAL_STATUS, JOURNAL_DELETE, JOURNAL_DELETE_EVENT = 'status', 'delete', 'delete_event'
+
+async def append_csv_journal(operation, target_id, value=''):
+    """Дописывает одну запись в журнал изменений CSV"""
+    row = [datetime.now().strftime('%Y-%m-%d %H:%M:%S'), operation, target_id, value]
+    return await csv_writer.write(CSV_JOURNAL_FILE, row)
+
+async def update_csv_status(registration_id, new_status):
+    """Обновляет статус записи в CSV файле"""
+    return await append_csv_journal(JOURNAL_STATUS, registration_id, new_status)
+
+async def delete_from_csv(registration_id):
+    """Удаляет запись из CSV файла"""
+    return await append_csv_journal(JOURNAL_DELETE, registration_id)
+
+async def delete_event_from_csv(event_id):
+    """Удаляет из CSV файла все записи на мероприятие"""
+    return await append_csv_journal(JOURNAL_DELETE_EVENT, event_id)
+
+def read_csv_journal():
+    """Читает журнал: удаленные записи, удаленные мероприятия, новые статусы"""
+    deleted_registrations = set()
+    deleted_events = set()
+    statuses = {}
+    records = 0
+    
+    with open(CSV_JOURNAL_FILE, 'r', newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            # Неполная последняя строка после аварийной остановки пропускается
+            if len(row) < 4:
+                continue
+            timestamp, operation, target_id, value = row[:4]
+            records += 1
+            if operation == JOURNAL_STATUS:
+                statuses[target_id] = value
+            elif operation == JOURNAL_DELETE:
+                deleted_registrations.add(target_id)
+            elif operation == JOURNAL_DELETE_EVENT:
+                deleted_events.add(target_id)
+    
+    return deleted_registrations, deleted_events, statuses, records
+
+def compact_csv_journal_sync():
+    """Применяет журнал к volunteers.csv и очищает журнал.
+    
+    Новая таблица пишется во временный файл и атомарно заменяет старую,
+    поэтому при сбое остается либо старая, либо новая версия. Повторное
+    применение журнала после сбоя ничего не меняет.
+    """
+    with csv_lock:
+        if not os.path.exists(CSV_JOURNAL_FILE) or os.path.getsize(CSV_JOURNAL_FILE) == 0:
+            return 0
+        
+        deleted_registrations, deleted_events, statuses, records = read_csv_journal()
+        
+        if os.path.exists(CSV_FILE):
+            temp_file = CSV_FILE + '.tmp'
+            with open(CSV_FILE, 'r', newline='', encoding='utf-8') as infile, \
+                 open(temp_file, 'w', newline='', encoding='utf-8') as outfile:
+                reader = csv.reader(infile)
+                writer = csv.writer(outfile)
+                writer.writerow(next(reader))
+                
+                for row in reader:
+                    if not row:
+                        continue
+                    if row[0] in deleted_registrations or (len(row) > 9 and row[9] in deleted_events):
+                        continue
+                    if row[0] in statuses:
+                        row[-1] = statuses[row[0]]
+                    writer.writerow(row)
+                
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            
+            os.replace(temp_file, CSV_FILE)
+        
+        os.remove(CSV_JOURNAL_FILE)
+    
+    print(f"✅ Журнал CSV применен: {records} изменений")
+    return records
+
+compact_csv_journal = in_executor(compact_csv_journal_sync)
+
+async def csv_compactor_loop():
+    """Фоновая задача: периодически применяет журнал к таблице"""
+    while True:
+        await asyncio.sleep(CSV_COMPACT_INTERVAL)
+        try:
+            await compact_csv_journal()
+        except Exception as e:
+            print(f"❌ Ошибка применения журнала CSV: {e}")
+
+@in_executor
+def count_csv_lines():
+    """Считает количество записей в CSV"""
+    compact_csv_journal_sync()
+    if os.path.exists(CSV_FILE):
+        with open(CSV_FILE, 'r', encoding='utf-8') as f:
+            return sum(1 for line in f) - 1
+    return 0
+
+# ========== ВЫГРУЗКИ CSV ==========
+# Выгрузки пишутся в буфер в памяти, который после EXPORT_SPOOL_BYTES переходит
+# во временный файл, а строки читаются из базы порциями по EXPORT_BATCH_SIZE.
+# Так сборка таблицы не держит в памяти ни строки запроса, ни весь файл, а на
+# диске ничего не остается: временный файл удаляется при закрытии буфера.
+# Отправка памяти не экономит: InputFile в PTB 20 принимает только байты
+# целиком (файл он тоже читает через read()), поэтому на время загрузки
+# в Telegram файл лежит в памяти один раз.
+def write_csv_export(cursor, header, preamble=()):
+    """Пишет результат запроса в CSV буфер. Возвращает (буфер, количество строк)"""
+    buffer = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, mode='w+b')
+    text = io.TextIOWrapper(buffer, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerows(preamble)
+    writer.writerow(header)
+    
+    rows = 0
+    while True:
+        batch = cursor.fetchmany(EXPORT_BATCH_SIZE)
+        if not batch:
+            break
+        writer.writerows(['' if value is None else value for value in row] for row in batch)
+        rows += len(batch)
+    
+    text.flush()
+    text.detach()
+    buffer.seek(0)
+    return buffer, rows
+
+@in_executor
+def export_document(f, filename):
+    """Готовит выгрузку к отправке в Telegram.
+    
+    PTB все равно читает файл целиком, а у буфера в памяти нет имени
+    (name is None), из-за чего PTB падает, даже если filename передан явно.
+    Поэтому файл читается здесь, в пуле потоков, а не в цикле событий.
+    """
+    return InputFile(f.read(), filename=filename)
+
+# Общая таблица из базы: текущие записи плюс история из старого CSV,
+# для которой в базе уже нет записи (например, отмененные). registration_date
+# в базе хранится в UTC, а строки CSV писались по местному времени сервера
+VOLUNTEERS_TABLE_QUERY = '''
+    SELECT registrations.id, date(registrations.registration_date, 'localtime'),
+           time(registrations.registration_date, 'localtime'),
+           users.telegram_id, users.full_name, users.group_name, users.birth_date,
+           users.phone_number, users.username,
+           events.id, events.title, events.date, events.time,
+           COALESCE(NULLIF(events.location, ''), 'Не указано'),
+           registrations.comment, 'Записан'
+    FROM registrations
+    JOIN users ON registrations.user_id = users.telegram_id
+    JOIN events ON registrations.event_id = events.id
+    UNION ALL
+    SELECT registration_id, registration_day, registration_time,
+           telegram_id, full_name, group_name, birth_date,
+           phone_number, username,
+           event_id, event_title, event_date, event_time, location,
+           comment, status
+    FROM legacy_registrations
+    WHERE registration_id NOT IN (SELECT id FROM registrations)
+    ORDER BY 1
+'''
+
+EVENT_TABLE_HEADER = [
+    'ID записи', 'Дата и время записи', 'ФИО', 'Группа',
+    'Дата рождения', 'Телефон', 'Username', 'Комментарий'
+]
+
+@db_read
+def build_volunteers_table(conn):
+    """Собирает общую таблицу волонтеров из базы.
+    
+    Возвращает (буфер, количество строк); буфер нужно закрыть после отправки.
+    """
+    return write_csv_export(conn.execute(VOLUNTEERS_TABLE_QUERY), VOLUNTEERS_TABLE_HEADER)
+
+async def open_volunteers_table():
+    """Открывает общую таблицу для отправки: (файл, строк) или None"""
+    if TABLE_FROM_DB:
+        return await build_volunteers_table()
+    
+    if not os.path.exists(CSV_FILE):
+        return None
+    
+    # Применяем накопленные изменения перед отправкой
+    rows = await count_csv_lines()
+    return open(CSV_FILE, 'rb'), rows
+
+@db_read
+def get_event_csv(conn, event_id):
+    """Собирает CSV таблицу участников мероприятия.
+    
+    Возвращает (буфер, количество строк) или None, если мероприятия нет;
+    буфер нужно закрыть после отправки.
+    """
+    cur = conn.cursor()
+    
+    # Получаем информацию о мероприятии
+    cur.execute('SELECT title, date, time, location FROM events WHERE id = ?', (event_id,))
+    event = cur.fetchone()
+    
+    if not event:
+        return None
+    
+    event_title, event_date, event_time, event_location = event
+    
+    # Получаем всех записанных на мероприятие
+    cur.execute('''
+        SELECT registrations.id, registrations.registration_date, users.full_name, users.group_name,
+               users.birth_date, users.phone_number, users.username, registrations.comment
+        FROM registrations
+        JOIN users ON registrations.user_id = users.telegram_id
+        WHERE registrations.event_id = ?
+        ORDER BY registrations.registration_date
+    ''', (event_id,))
+    
+    preamble = [
+        [f"Мероприятие: {event_title}"],
+        [f"Дата: {event_date} Время: {event_time}"],
+        [f"Место: {event_location}"],
+        [],
+    ]
+    
+    export = write_csv_export(cur, EVENT_TABLE_HEADER, preamble)
+    print(f"✅ Создана таблица мероприятия {event_id}: {export[1]} записей")
+    return export
+
+# Кэш выгрузок: для каждой таблицы запоминается версия содержимого и file_id
+# документа, который Telegram вернул после загрузки. Если версия не изменилась,
+# документ отправляется повторно по file_id без сборки и загрузки файла.
+class ExportCache:
+    """Версионированный кэш file_id выгрузок"""
+    
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, version):
+        """Возвращает file_id для версии или None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+    
+    def put(self, key, version, file_id):
+        with self.lock:
+            self.entries[key] = (version, file_id)
+    
+    def invalidate_event(self, event_id):
+        """Сбрасывает таблицу мероприятия и общую таблицу"""
+        with self.lock:
+            self.entries.pop(('event', event_id), None)
+            self.entries.pop('all', None)
+    
+    def invalidate_all(self):
+        with self.lock:
+            self.entries.clear()
+
+export_cache = ExportCache()
+
+@db_read
+def get_event_export_version(conn, event_id):
+    """Версия таблицы мероприятия: (изменение мероприятия, записей, последний ID записи)"""
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT COALESCE(updated_at, created_at), registered_count,
+               (SELECT MAX(id) FROM registrations WHERE event_id = events.id)
+        FROM events WHERE id = ?
+    ''', (event_id,))
+    return cur.fetchone()
+
+@db_read
+def get_volunteers_table_version(conn):
+    """Версия общей таблицы из базы"""
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT (SELECT MAX(id) FROM registrations),
+               (SELECT COUNT(*) FROM registrations),
+               (SELECT MAX(COALESCE(updated_at, created_at)) FROM events),
+               (SELECT COUNT(*) FROM legacy_registrations)
+    ''')
+    return cur.fetchone()
+
+@in_executor
+def get_csv_table_version():
+    """Версия общей таблицы из CSV: время изменения и размер файла"""
+    compact_csv_journal_sync()
+    if not os.path.exists(CSV_FILE):
+        return None
+    stat = os.stat(CSV_FILE)
+    return stat.st_mtime_ns, stat.st_size
+
+async def get_table_export_version():
+    """Версия общей таблицы волонтеров"""
+    if TABLE_FROM_DB:
+        return await get_volunteers_table_version()
+    return await get_csv_table_version()
+
+# ========== КЭШ МЕРОПРИЯТИЙ ==========
+# Каталог мероприятий небольшой и меняется только при действиях админа и при
+# записи/отмене, поэтому он целиком держится в памяти. Каждая изменяющая
+# функция через after_commit помечает мероприятие устаревшим, и при следующем
+# обращении перечитываются только помеченные строки. Список для пользователей
+# дополнительно пересобирается при смене даты (фильтр date('now') в UTC).
+CATALOG_COLUMNS = '''
+    id, title, description, date, time, location, max_volunteers,
+    is_active, registration_open, registered_count
+'''
+
+@db_read
+def load_events(conn, event_ids=None):
+    """Читает строки каталога: все мероприятия или только указанные"""
+    cur = conn.cursor()
+    if event_ids is None:
+        cur.execute(f'SELECT {CATALOG_COLUMNS} FROM events')
+    else:
+        placeholders = ','.join('?' * len(event_ids))
+        cur.execute(f'SELECT {CATALOG_COLUMNS} FROM events WHERE id IN ({placeholders})', list(event_ids))
+    return cur.fetchall()
+
+def catalog_sort_key(event):
+    """Порядок ORDER BY date, time"""
+    return event[3] or '', event[4] or '', event[0]
+
+def utc_today():
+    """Сегодняшняя дата так же, как ее считает date('now') в SQLite"""
+    return time_module.strftime('%Y-%m-%d', time_module.gmtime())
+
+class EventCatalog:
+    """Кэш таблицы events с точечной инвалидацией.
+    
+    Строки: id, название, описание, дата, время, место, макс. участников,
+    активно, запись открыта, записано.
+    """
+    
+    def __init__(self):
+        self.rows = None
+        self.dirty = set()
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.active = None
+        self.active_day = None
+        self.active_keys = []
+        self.active_keys_for = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_found = 0
+    
+    def invalidate(self, event_id):
+        """Помечает мероприятие устаревшим (вызывается после COMMIT)"""
+        with self.lock:
+            self.dirty.add(event_id)
+            self.generation += 1
+            self.active = None
+            self.invalidations += 1
+    
+    def invalidate_all(self):
+        with self.lock:
+            self.rows = None
+            self.dirty.clear()
+            self.generation += 1
+            self.active = None
+            self.invalidations += 1
+    
+    async def snapshot(self):
+        """Возвращает актуальный словарь {id: строка}"""
+        with self.lock:
+            if self.rows is not None and not self.dirty:
+                self.hits += 1
+                return self.rows
+            self.misses += 1
+            generation = self.generation
+            base = self.rows
+            event_ids = None if base is None else list(self.dirty)
+        
+        fresh = await load_events(event_ids)
+        
+        if event_ids is None:
+            rows = {event[0]: event for event in fresh}
+        else:
+            rows = dict(base)
+            for event_id in event_ids:
+                rows.pop(event_id, None)
+            rows.update((event[0], event) for event in fresh)
+        
+        with self.lock:
+            # Если пока шло чтение что-то изменилось, помеченные строки
+            # останутся устаревшими и перечитаются при следующем обращении
+            if generation == self.generation:
+                self.rows = rows
+                self.dirty.clear()
+            elif self.rows is base and base is not None:
+                self.rows = rows
+        return rows
+    
+    async def get(self, event_id):
+        """Строка мероприятия или None"""
+        return (await self.snapshot()).get(event_id)
+    
+    async def active_events(self):
+        """Мероприятия, доступные для записи, в формате get_active_events"""
+        today = utc_today()
+        with self.lock:
+            if self.active is not None and self.active_day == today and not self.dirty:
+                self.hits += 1
+                return self.active
+        
+        rows = await self.snapshot()
+        active = [
+            (event_id, title, date, time, location, max_vol, desc,
+             max_vol - registered if max_vol is not None else None)
+            for event_id, title, desc, date, time, location, max_vol, is_active, registration_open, registered
+            in sorted(rows.values(), key=catalog_sort_key)
+            if is_active and registration_open and (date or '') >= today
+            and (not max_vol or registered < max_vol)
+        ]
+        with self.lock:
+            if self.rows is rows:
+                self.active = active
+                self.active_day = today
+        return active
+    
+    async def active_page(self, cursor=None, backward=False, size=EVENTS_PAGE_SIZE):
+        """Страница списка для пользователей после (или перед) ключом (дата, время, id).
+        
+        Возвращает (мероприятия, есть предыдущие, есть следующие).
+        """
+        active = await self.active_events()
+        if self.active_keys_for is not active:
+            self.active_keys = [(event[2], event[3], event[0]) for event in active]
+            self.active_keys_for = active
+        keys = self.active_keys
+        
+        if cursor is None:
+            start = 0
+        elif backward:
+            start = max(0, bisect.bisect_left(keys, cursor) - size)
+        else:
+            start = bisect.bisect_right(keys, cursor)
+        
+        page = active[start:start + size]
+        return page, start > 0, start + len(page) < len(active)
+    
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    async def verify(self):
+        """Сравнивает кэш с базой и возвращает количество устаревших строк.
+        
+        Если расхождения есть, кэш перечитывается целиком.
+        """
+        cached = await self.snapshot()
+        actual = {event[0]: event for event in await load_events()}
+        stale = sum(1 for event_id in cached.keys() | actual.keys() if cached.get(event_id) != actual.get(event_id))
+        if stale:
+            self.stale_found += stale
+            self.invalidate_all()
+        return stale
+
+event_catalog = EventCatalog()
+
+def event_changed(event_id):
+    """Сбрасывает кэши, зависящие от мероприятия"""
+    event_catalog.invalidate(event_id)
+    export_cache.invalidate_event(event_id)
+
+# ========== КЭШ ПОЛЬЗОВАТЕЛЕЙ ==========
+# Профиль меняется только в save_user_info, поэтому профили держатся в
+# ограниченном кэше, который save_user_profile обновляет после COMMIT.
+# Отдельно хранится множество ID пользователей, которые уже есть в users:
+# для них /start не выполняет INSERT OR IGNORE.
+class ProfileCache:
+    """Кэш профилей с ограничением размера и времени жизни"""
+    
+    def __init__(self, size, ttl, policy):
+        self.size = size
+        self.ttl = ttl
+        self.lru = policy != 'fifo'
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, telegram_id):
+        with self.lock:
+            entry = self.entries.get(telegram_id)
+            if entry and (not self.ttl or time_module.monotonic() - entry[0] < self.ttl):
+                if self.lru:
+                    self.entries.move_to_end(telegram_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+    
+    def put(self, telegram_id, profile):
+        with self.lock:
+            self.entries[telegram_id] = (time_module.monotonic(), profile)
+            self.entries.move_to_end(telegram_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+    
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+profile_cache = ProfileCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL, PROFILE_CACHE_POLICY)
+
+# ID пользователей, которые точно есть в таблице users
+known_users = set()
+known_users_lock = threading.Lock()
+known_users_skipped = 0
+
+def remember_user(telegram_id):
+    with known_users_lock:
+        known_users.add(telegram_id)
+
+@db_read
+def load_known_users(conn):
+    """Загружает ID всех пользователей при запуске"""
+    ids = {row[0] for row in conn.execute('SELECT telegram_id FROM users')}
+    with known_users_lock:
+        known_users.update(ids)
+    return len(ids)
+
+# ========== ИНДЕКС ЗАПИСЕЙ ==========
+# Кто на какое мероприятие записан: event_id -> {user_id: ID записи}.
+# Индекс загружается при запуске и обновляется после COMMIT записи, отмены
+# и удаления мероприятия, поэтому проверка "записан ли пользователь" не
+# обращается к базе. До загрузки индекса используется запрос к базе.
+class MembershipIndex:
+    """Индекс записей пользователей на мероприятия"""
+    
+    def __init__(self):
+        self.events = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+    
+    def load(self, rows):
+        events = {}
+        for registration_id, user_id, event_id in rows:
+            events.setdefault(event_id, {})[user_id] = registration_id
+        with self.lock:
+            self.events = events
+            self.loaded = True
+    
+    def add(self, event_id, user_id, registration_id):
+        with self.lock:
+            self.events.setdefault(event_id, {})[user_id] = registration_id
+    
+    def remove(self, event_id, user_id):
+        with self.lock:
+            members = self.events.get(event_id)
+            if members:
+                members.pop(user_id, None)
+                if not members:
+                    del self.events[event_id]
+    
+    def drop_event(self, event_id):
+        with self.lock:
+            self.events.pop(event_id, None)
+    
+    def registration_id(self, event_id, user_id):
+        members = self.events.get(event_id)
+        return members.get(user_id) if members else None
+    
+    def has_registrations(self, user_id):
+        with self.lock:
+            return any(user_id in members for members in self.events.values())
+    
+    def size(self):
+        with self.lock:
+            return sum(len(members) for members in self.events.values())
+
+membership = MembershipIndex()
+
+@db_read
+def load_membership(conn):
+    """Загружает индекс записей при запуске"""
+    membership.load(conn.execute('SELECT id, user_id, event_id FROM registrations'))
+    return membership.size()
+
+# ========== РАССЫЛКИ ==========
+# Сообщения записавшимся сначала попадают в таблицу outbox - в той же
+# транзакции, что и изменение мероприятия, поэтому уведомление не теряется
+# и не уходит по отмененному изменению. Фоновая задача отправляет их не
+# быстрее BROADCAST_RATE в секунду и не чаще раза в BROADCAST_CHAT_INTERVAL
+# в один чат, выполняет RetryAfter и после перезапуска продолжает с того же места.
+OUTBOX_PENDING, OUTBOX_SENT, OUTBOX_FAILED = 'pending', 'sent', 'failed'
+
+def enqueue_event_broadcast(conn, event_id, kind, text, registered_before=None):
+    """Ставит сообщение всем записанным на мероприятие (внутри транзакции).
+    
+    registered_before (UNIX время) - только тем, кто записался раньше.
+    Возвращает количество сообщений в очереди.
+    """
+    cur = conn.cursor()
+    cur.execute('INSERT INTO broadcasts (kind, event_id, text) VALUES (?, ?, ?)', (kind, event_id, text))
+    broadcast_id = cur.lastrowid
+    query = '''
+        INSERT INTO outbox (broadcast_id, chat_id, available_at)
+        SELECT ?, user_id, ? FROM registrations WHERE event_id = ?
+    '''
+    params = [broadcast_id, time_module.time(), event_id]
+    if registered_before is not None:
+        query += " AND registration_date < datetime(?, 'unixepoch')"
+        params.append(registered_before)
+    cur.execute(query, params)
+    total = cur.rowcount
+    
+    if not total:
+        cur.execute('DELETE FROM broadcasts WHERE id = ?', (broadcast_id,))
+        return 0
+    
+    cur.execute('UPDATE broadcasts SET total = ? WHERE id = ?', (total, broadcast_id))
+    after_commit(outbox_worker.wake)
+    return total
+
+def event_notice(event, header, footer):
+    """Текст уведомления о мероприятии (без разметки)"""
+    title, date, time, location = event
+    text = f"{header} «{title}»\n\n📅 Дата: {date}\n⏰ Время: {time}\n"
+    if location:
+        text += f"📍 Место: {location}\n"
+    return text + f"\n{footer}"
+
+@db_read
+def fetch_outbox(conn, now, limit):
+    """Сообщения, которые пора отправить: (id, чат, текст, попыток)"""
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT outbox.id, outbox.chat_id, broadcasts.text, outbox.attempts
+        FROM outbox
+        JOIN broadcasts ON outbox.broadcast_id = broadcasts.id
+        WHERE outbox.status = 'pending' AND outbox.available_at <= ?
+        ORDER BY outbox.id
+        LIMIT ?
+    ''', (now, limit))
+    return cur.fetchall()
+
+@db_read
+def next_outbox_time(conn):
+    """Время ближайшего отложенного сообщения или None"""
+    cur = conn.cursor()
+    cur.execute("SELECT MIN(available_at) FROM outbox WHERE status = 'pending'")
+    return cur.fetchone()[0]
+
+@db_write
+def mark_outbox(conn, outbox_id, status, error=None, retry_at=None):
+    """Отмечает результат отправки; при retry_at сообщение остается в очереди"""
+    cur = conn.cursor()
+    if retry_at is not None:
+        cur.execute('''
+            UPDATE outbox SET attempts = attempts + 1, available_at = ?, error = ?
+            WHERE id = ?
+        ''', (retry_at, error, outbox_id))
+    else:
+        cur.execute('''
+            UPDATE outbox SET status = ?, error = ?, sent_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (status, error, outbox_id))
+
+@db_write
+def finish_broadcasts(conn):
+    """Закрывает рассылки без ожидающих сообщений: [(вид, текст, всего, доставлено, ошибок)]"""
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT broadcasts.id, broadcasts.kind, broadcasts.text, broadcasts.total,
+               SUM(outbox.status = 'sent'), SUM(outbox.status = 'failed')
+        FROM broadcasts
+        JOIN outbox ON outbox.broadcast_id = broadcasts.id
+        WHERE broadcasts.finished_at IS NULL
+        GROUP BY broadcasts.id
+        HAVING SUM(outbox.status = 'pending') = 0
+    ''')
+    finished = cur.fetchall()
+    for row in finished:
+        cur.execute('UPDATE broadcasts SET finished_at = CURRENT_TIMESTAMP WHERE id = ?', (row[0],))
+    return [row[1:] for row in finished]
+
+@db_read
+def get_outbox_stats(conn):
+    """Количество сообщений в очереди по статусам"""
+    cur = conn.cursor()
+    cur.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status')
+    return dict(cur.fetchall())
+
+class TokenBucket:
+    """Ограничение частоты: rate событий в секунду с запасом capacity"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time_module.monotonic()
+        self.paused_until = 0.0
+    
+    def pause(self, seconds):
+        """Останавливает выдачу на время (ответ RetryAfter)"""
+        self.paused_until = max(self.paused_until, time_module.monotonic() + seconds)
+        self.tokens = 0
+    
+    async def acquire(self):
+        while True:
+            now = time_module.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class OutboxWorker:
+    """Фоновая отправка сообщений из outbox"""
+    
+    def __init__(self):
+        self.bucket = TokenBucket(BROADCAST_RATE, 1)
+        self.chat_next = {}
+        self.bot = None
+        self.loop = None
+        self.event = None
+        self.task = None
+        self.sent = 0
+        self.failed = 0
+    
+    def start(self, bot):
+        self.bot = bot
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+        return self.task
+    
+    def wake(self):
+        """Будит задачу после COMMIT (может вызываться из потока БД)"""
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.event.set)
+    
+    async def run(self):
+        senders = asyncio.Semaphore(BROADCAST_SENDERS)
+        while True:
+            try:
+                batch = await fetch_outbox(time_module.time(), 100)
+                if batch:
+                    await asyncio.gather(*(self.deliver(row, senders) for row in batch))
+                    await self.report()
+                    # Старые отметки чатов больше не нужны
+                    now = time_module.monotonic()
+                    self.chat_next = {chat: t for chat, t in self.chat_next.items() if t > now}
+                    continue
+                
+                await self.report()
+                next_time = await next_outbox_time()
+                timeout = 60 if next_time is None else max(0.1, min(60, next_time - time_module.time()))
+                self.event.clear()
+                try:
+                    await asyncio.wait_for(self.event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка рассылки: {e}")
+                await asyncio.sleep(5)
+    
+    async def deliver(self, row, senders):
+        outbox_id, chat_id, text, attempts = row
+        async with senders:
+            # Не чаще одного сообщения в чат за BROADCAST_CHAT_INTERVAL
+            now = time_module.monotonic()
+            slot = max(now, self.chat_next.get(chat_id, 0))
+            self.chat_next[chat_id] = slot + BROADCAST_CHAT_INTERVAL
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+            except RetryAfter as e:
+                # Попытка не засчитывается: Telegram просит подождать весь бот
+                delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                self.bucket.pause(delay)
+                await mark_outbox(outbox_id, OUTBOX_PENDING, str(e), retry_at=time_module.time() + delay)
+                return
+            except (Forbidden, BadRequest) as e:
+                # Пользователь заблокировал бота или чат недоступен - повтор не поможет
+                self.failed += 1
+                await mark_outbox(outbox_id, OUTBOX_FAILED, str(e))
+                return
+            except TelegramError as e:
+                if attempts + 1 >= BROADCAST_MAX_ATTEMPTS:
+                    self.failed += 1
+                    await mark_outbox(outbox_id, OUTBOX_FAILED, str(e))
+                else:
+                    delay = 2 ** attempts * 5
+                    await mark_outbox(outbox_id, OUTBOX_PENDING, str(e), retry_at=time_module.time() + delay)
+                return
+            
+            self.sent += 1
+            await mark_outbox(outbox_id, OUTBOX_SENT)
+    
+    async def report(self):
+        """Сообщает админу о завершенных рассылках"""
+        for kind, text, total, sent, failed in await finish_broadcasts():
+            first_line = text.split('\n', 1)[0]
+            try:
+                await self.bot.send_message(
+                    chat_id=ADMIN_ID,
+                    text=f"📬 Рассылка завершена: {first_line}\n"
+                         f"Доставлено: {sent} из {total}, ошибок: {failed}"
+                )
+            except TelegramError as e:
+                print(f"⚠️ Не удалось отправить отчет о рассылке: {e}")
+
+outbox_worker = OutboxWorker()
+
+# Напоминания хранятся не по одному на запись, а по одному на мероприятие в
+# куче, упорядоченной по времени отправки. Когда время подходит, одна
+# транзакция ставит в outbox сообщения всем записавшимся. Изменение даты или
+# времени просто добавляет в кучу новую точку; старая отбрасывается при
+# проверке, потому что мероприятие сверяется с базой перед отправкой.
+# Напоминание получают те, кто записался до времени напоминания, - только им
+# оно обещано при записи. Записавшимся позже хватает подтверждения записи,
+# где уже есть дата, время и место.
+def event_start_timestamp(date, time):
+    """Начало мероприятия (дата и время в EVENT_TZ_OFFSET_HOURS) как UNIX время"""
+    try:
+        start = datetime.strptime(f"{date} {time}", '%Y-%m-%d %H:%M')
+    except (TypeError, ValueError):
+        return None
+    return (start - datetime(1970, 1, 1)).total_seconds() - EVENT_TZ_OFFSET_HOURS * 3600
+
+def reminder_timestamp(date, time):
+    """Когда записавшимся отправляется напоминание (UNIX время) или None"""
+    start = event_start_timestamp(date, time)
+    return None if start is None else start - REMINDER_HOURS * 3600
+
+def reminder_pending(date, time):
+    """Напоминание еще впереди - можно обещать его при записи"""
+    remind_at = reminder_timestamp(date, time)
+    return REMINDER_HOURS > 0 and remind_at is not None and time_module.time() < remind_at
+
+@db_read
+def load_reminder_events(conn, event_ids=None):
+    """Мероприятия, которым еще нужно напоминание: (id, дата, время)"""
+    cur = conn.cursor()
+    query = '''
+        SELECT id, date, time FROM events
+        WHERE is_active = 1 AND date >= date('now', '-1 day')
+          AND (reminded_for IS NULL OR reminded_for != date || ' ' || time)
+    '''
+    if event_ids is None:
+        cur.execute(query)
+    else:
+        placeholders = ','.join('?' * len(event_ids))
+        cur.execute(query + f' AND id IN ({placeholders})', list(event_ids))
+    return cur.fetchall()
+
+@db_write
+def enqueue_event_reminder(conn, event_id, slot):
+    """Ставит напоминание в рассылку, если мероприятие не изменилось.
+    
+    Возвращает количество сообщений или None, если напоминание не нужно.
+    Если напоминать некому, мероприятие не отмечается напомненным.
+    """
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT title, date, time, location FROM events
+        WHERE id = ? AND is_active = 1 AND date || ' ' || time = ?
+          AND (reminded_for IS NULL OR reminded_for != ?)
+    ''', (event_id, slot, slot))
+    event = cur.fetchone()
+    if not event:
+        return None
+    
+    total = enqueue_event_broadcast(conn, event_id, 'reminder', event_notice(
+        event, "🔔 Напоминание о мероприятии", "Ждем вас! Если не сможете прийти, отмените запись в боте."
+    ), registered_before=reminder_timestamp(event[1], event[2]))
+    if total:
+        cur.execute('UPDATE events SET reminded_for = ? WHERE id = ?', (slot, event_id))
+    return total
+
+class ReminderScheduler:
+    """Очередь напоминаний: куча (время отправки, мероприятие, дата и время)"""
+    
+    def __init__(self):
+        self.heap = []
+        self.reload = set()
+        self.loop = None
+        self.event = None
+        self.sent = 0
+    
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        return asyncio.create_task(self.run())
+    
+    def reschedule(self, event_id):
+        """Перечитывает мероприятие после COMMIT (может вызываться из потока БД)"""
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._request_reload, event_id)
+    
+    def _request_reload(self, event_id):
+        self.reload.add(event_id)
+        self.event.set()
+    
+    def push(self, events):
+        for event_id, date, time in events:
+            start = event_start_timestamp(date, time)
+            if start is None or start <= time_module.time():
+                continue
+            heapq.heappush(self.heap, (reminder_timestamp(date, time), event_id, f"{date} {time}"))
+    
+    async def run(self):
+        self.push(await load_reminder_events())
+        print(f"✅ Запланировано напоминаний: {len(self.heap)}")
+        
+        while True:
+            try:
+                if self.reload:
+                    event_ids, self.reload = list(self.reload), set()
+                    self.push(await load_reminder_events(event_ids))
+                
+                now = time_module.time()
+                while self.heap and self.heap[0][0] <= now:
+                    remind_at, event_id, slot = heapq.heappop(self.heap)
+                    total = await enqueue_event_reminder(event_id, slot)
+                    if total:
+                        self.sent += 1
+                        print(f"🔔 Напоминание о мероприятии {event_id}: {total} сообщений")
+                
+                timeout = 3600 if not self.heap else max(0.1, min(3600, self.heap[0][0] - time_module.time()))
+                self.event.clear()
+                if self.reload:
+                    continue
+                try:
+                    await asyncio.wait_for(self.event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка напоминаний: {e}")
+                await asyncio.sleep(5)
+
+reminder_scheduler = ReminderScheduler()
+
+# ========== ФУНКЦИИ ДЛЯ РАБОТЫ С БАЗОЙ ==========
+async def get_active_events():
+    """Получает список активных мероприятий (только для пользователей)"""
+    return await event_catalog.active_events()
+
+# Фильтры списка мероприятий в админке: название кнопки и условие
+ADMIN_EVENT_FILTERS = {
+    'all': ("Все", "1"),
+    'up': ("Предстоящие", "is_active = 1 AND date >= date('now')"),
+    'past': ("Прошедшие", "date < date('now')"),
+    'off': ("Неактивные", "is_active = 0"),
+}
+
+@db_read
+def get_admin_events_page(conn, event_filter, cursor=None, backward=False, size=ADMIN_PAGE_SIZE):
+    """Страница мероприятий для админа по ключу (дата, время, id).
+    
+    Возвращает (мероприятия, есть предыдущие, есть следующие, всего по фильтру).
+    """
+    condition = ADMIN_EVENT_FILTERS[event_filter][1]
+    cur = conn.cursor()
+    
+    params = []
+    where = condition
+    if cursor is not None:
+        where += f" AND (date, time, id) {'<' if backward else '>'} (?, ?, ?)"
+        params.extend(cursor)
+    order = 'DESC' if backward else 'ASC'
+    
+    cur.execute(f'''
+        SELECT id, title, date, time, is_active, registration_open
+        FROM events
+        WHERE {where}
+        ORDER BY date {order}, time {order}, id {order}
+        LIMIT ?
+    ''', params + [size + 1])
+    events = cur.fetchall()
+    
+    more = len(events) > size
+    events = events[:size]
+    if backward:
+        events.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = cursor is not None, more
+    
+    cur.execute(f'SELECT COUNT(*) FROM events WHERE {condition}')
+    return events, has_prev, has_next, cur.fetchone()[0]
+
+@db_read
+def get_user_registrations(conn, user_id):
+    """Получает записи пользователя"""
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT events.id, events.title, events.date, events.time, events.location,
+               registrations.id as registration_id, registrations.registration_date,
+               registrations.comment
+        FROM registrations
+        JOIN events ON registrations.event_id = events.id
+        WHERE registrations.user_id = ? AND events.date >= date('now') AND events.is_active = 1
+        ORDER BY events.date, events.time
+    ''', (user_id,))
+    events = cur.fetchall()
+    return events
+
+@db_write
+def toggle_event_registration(conn, event_id):
+    """Открывает/закрывает запись на мероприятие"""
+    cur = conn.cursor()
+    
+    cur.execute('SELECT registration_open FROM events WHERE id = ?', (event_id,))
+    current = cur.fetchone()[0]
+    new_value = 0 if current == 1 else 1
+    cur.execute('UPDATE events SET registration_open = ? WHERE id = ?', (new_value, event_id))
+    after_commit(event_changed, event_id)
+    return new_value == 1  # True если запись открыта, False если закрыта
+
+@db_write
+def toggle_event_active_status(conn, event_id):
+    """Активирует/деактивирует мероприятие"""
+    cur = conn.cursor()
+    
+    cur.execute('SELECT is_active FROM events WHERE id = ?', (event_id,))
+    current = cur.fetchone()[0]
+    new_value = 0 if current == 1 else 1
+    cur.execute('UPDATE events SET is_active = ? WHERE id = ?', (new_value, event_id))
+    after_commit(event_changed, event_id)
+    
+    if new_value:
+        after_commit(reminder_scheduler.reschedule, event_id)
+    else:
+        cur.execute('SELECT title, date, time, location FROM events WHERE id = ?', (event_id,))
+        enqueue_event_broadcast(conn, event_id, 'deactivated', event_notice(
+            cur.fetchone(), "⚠️ Мероприятие временно отменено:",
+            "Мы сообщим, если оно снова станет доступно."
+        ))
+    return new_value == 1  # True если активно, False если неактивно
+
+@db_write
+def delete_event(conn, event_id):
+    """Удаляет мероприятие"""
+    cur = conn.cursor()
+    
+    # Уведомляем записавшихся, пока записи еще есть
+    cur.execute('SELECT title, date, time, location FROM events WHERE id = ?', (event_id,))
+    event = cur.fetchone()
+    if event:
+        enqueue_event_broadcast(conn, event_id, 'deleted', event_notice(
+            event, "❌ Мероприятие отменено:", "Ваша запись на него аннулирована."
+        ))
+    
+    # Сначала удаляем все записи на это мероприятие
+    cur.execute('DELETE FROM registrations WHERE event_id = ?', (event_id,))
+    # Затем удаляем само мероприятие
+    cur.execute('DELETE FROM events WHERE id = ?', (event_id,))
+    deleted = cur.rowcount
+    after_commit(event_changed, event_id)
+    after_commit(membership.drop_event, event_id)
+    
+    return deleted > 0
+
+async def get_event_details(event_id):
+    """Получает детали мероприятия"""
+    event = await event_catalog.get(event_id)
+    return event[1:9] if event else None
+
+@db_write
+def update_event(conn, event_id, field, value):
+    """Обновляет поле мероприятия.
+    
+    При изменении даты, времени или места записавшимся ставится уведомление.
+    """
+    cur = conn.cursor()
+    cur.execute('SELECT title, date, time, location FROM events WHERE id = ?', (event_id,))
+    before = cur.fetchone()
+    
+    if field == 'title':
+        cur.execute('UPDATE events SET title = ? WHERE id = ?', (value, event_id))
+    elif field == 'description':
+        cur.execute('UPDATE events SET description = ? WHERE id = ?', (value, event_id))
+    elif field == 'date':
+        cur.execute('UPDATE events SET date = ? WHERE id = ?', (value, event_id))
+    elif field == 'time':
+        cur.execute('UPDATE events SET time = ? WHERE id = ?', (value, event_id))
+    elif field == 'location':
+        cur.execute('UPDATE events SET location = ? WHERE id = ?', (value, event_id))
+    elif field == 'max_volunteers':
+        cur.execute('UPDATE events SET max_volunteers = ? WHERE id = ?', (int(value), event_id))
+    
+    after_commit(event_changed, event_id)
+    
+    if field in ('date', 'time'):
+        after_commit(reminder_scheduler.reschedule, event_id)
+    
+    if before and field in ('date', 'time', 'location'):
+        cur.execute('SELECT title, date, time, location FROM events WHERE id = ?', (event_id,))
+        after = cur.fetchone()
+        if after != before:
+            enqueue_event_broadcast(conn, event_id, 'changed', event_notice(
+                after, "📢 Изменения в мероприятии", "Ваша запись сохранена."
+            ))
+    return True
+
+@db_read
+def get_registration_info(conn, registration_id):
+    """Получает информацию о записи"""
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT registrations.id, registrations.user_id, registrations.event_id, registrations.comment,
+               users.full_name, users.group_name, users.birth_date, users.phone_number, users.username,
+               events.title, events.date, events.time, events.location
+        FROM registrations
+        JOIN users ON registrations.user_id = users.telegram_id
+        JOIN events ON registrations.event_id = events.id
+        WHERE registrations.id = ?
+    ''', (registration_id,))
+    registration = cur.fetchone()
+    return registration
+
+@db_write
+def cancel_registration_db(conn, registration_id):
+    """Отменяет запись в базе данных"""
+    cur = conn.cursor()
+    
+    # Получаем информацию о записи перед удалением
+    cur.execute('''
+        SELECT user_id, event_id FROM registrations WHERE id = ?
+    ''', (registration_id,))
+    result = cur.fetchone()
+    
+    if not result:
+        return None
+    
+    user_id, event_id = result
+    
+    # Удаляем запись
+    cur.execute('DELETE FROM registrations WHERE id = ?', (registration_id,))
+    deleted = cur.rowcount
+    
+    if deleted > 0:
+        after_commit(event_changed, event_id)
+        after_commit(membership.remove, event_id, user_id)
+        return user_id, event_id
+    return None
+
+@db_write
+def insert_user(conn, telegram_id, full_name, username):
+    """Создает пользователя, если его еще нет в базе"""
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT OR IGNORE INTO users (telegram_id, full_name, username)
+        VALUES (?, ?, ?)
+    ''', (telegram_id, full_name, username))
+    after_commit(remember_user, telegram_id)
+
+async def ensure_user(telegram_id, full_name, username):
+    """Создает пользователя, если его еще нет в базе"""
+    global known_users_skipped
+    if telegram_id in known_users:
+        known_users_skipped += 1
+        return
+    await insert_user(telegram_id, full_name, username)
+
+@db_read
+def load_user_profile(conn, telegram_id):
+    """Читает данные пользователя из базы"""
+    cur = conn.cursor()
+    cur.execute('SELECT full_name, group_name, birth_date, phone_number, username FROM users WHERE telegram_id = ?', (telegram_id,))
+    user = cur.fetchone()
+    return user
+
+async def get_user_profile(telegram_id):
+    """Получает данные пользователя"""
+    user = profile_cache.get(telegram_id)
+    if user is None:
+        user = await load_user_profile(telegram_id)
+        if user is not None:
+            profile_cache.put(telegram_id, user)
+    return user
+
+@db_write
+def save_user_profile(conn, telegram_id, full_name, group, birth_date, phone, username):
+    """Сохраняет данные пользователя.
+    
+    Существующая строка обновляется на месте (а не заменяется), поэтому
+    created_at сохраняется, а триггер статистики не считает пользователя дважды.
+    """
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT INTO users
+        (telegram_id, full_name, group_name, birth_date, phone_number, username)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(telegram_id) DO UPDATE SET
+            full_name = excluded.full_name,
+            group_name = excluded.group_name,
+            birth_date = excluded.birth_date,
+            phone_number = excluded.phone_number,
+            username = excluded.username
+    ''', (telegram_id, full_name, group, birth_date, phone, username))
+    after_commit(profile_cache.put, telegram_id, (full_name, group, birth_date, phone, username))
+    after_commit(remember_user, telegram_id)
+    # Данные пользователя есть во всех выгрузках, где он записан
+    after_commit(export_cache.invalidate_all)
+
+async def get_user_registration_id(user_id, event_id):
+    """Возвращает ID записи пользователя на мероприятие или None"""
+    if membership.loaded:
+        return membership.registration_id(event_id, user_id)
+    return await load_user_registration_id(user_id, event_id)
+
+@db_read
+def load_user_registration_id(conn, user_id, event_id):
+    """Ищет ID записи пользователя на мероприятие в базе"""
+    cur = conn.cursor()
+    cur.execute('SELECT id FROM registrations WHERE user_id = ? AND event_id = ?', (user_id, event_id))
+    registration = cur.fetchone()
+    return registration[0] if registration else None
+
+async def count_event_registrations(event_id):
+    """Возвращает количество записей на мероприятие (счетчик ведут триггеры)"""
+    event = await event_catalog.get(event_id)
+    return event[9] if event else 0
+
+@db_write
+def check_registration_counters(conn, repair=False):
+    """Пересчитывает счетчики записей и возвращает расхождения.
+    
+    Возвращает список (event_id, title, сохраненное значение, фактическое значение).
+    При repair=True сохраненные значения исправляются.
+    """
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT events.id, events.title, events.registered_count, COUNT(registrations.id)
+        FROM events
+        LEFT JOIN registrations ON events.id = registrations.event_id
+        GROUP BY events.id
+        HAVING events.registered_count != COUNT(registrations.id)
+    ''')
+    drift = cur.fetchall()
+    
+    if repair:
+        for event_id, title, stored, actual in drift:
+            cur.execute('UPDATE events SET registered_count = ? WHERE id = ?', (actual, event_id))
+            after_commit(event_changed, event_id)
+    
+    return drift
+
+# Результаты записи на мероприятие
+REG_OK, REG_NOT_FOUND, REG_INACTIVE, REG_CLOSED, REG_DUPLICATE, REG_FULL = (
+    'ok', 'not_found', 'inactive', 'closed', 'duplicate', 'full'
+)
+
+REGISTRATION_ERRORS = {
+    REG_NOT_FOUND: "❌ Мероприятие не найдено.",
+    REG_INACTIVE: "❌ Это мероприятие временно недоступно!",
+    REG_CLOSED: "❌ Запись на это мероприятие закрыта!",
+    REG_DUPLICATE: "Вы уже записаны на это мероприятие!",
+    REG_FULL: "❌ К сожалению, все места уже заняты!",
+}
+
+@db_write
+def register_volunteer(conn, user_id, event_id, comment):
+    """Атомарно записывает пользователя на мероприятие.
+    
+    Все проверки и вставка выполняются в одной транзакции BEGIN IMMEDIATE,
+    поэтому два одновременных подтверждения не могут занять одно место.
+    Возвращает (результат, данные). При REG_OK данные - кортеж
+    (id записи, ФИО, группа, дата рождения, телефон, username,
+    название, дата, время, место, макс. участников, номер в списке).
+    """
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT is_active, registration_open, max_volunteers, registered_count
+        FROM events WHERE id = ?
+    ''', (event_id,))
+    event = cur.fetchone()
+    
+    if not event:
+        return REG_NOT_FOUND, None
+    
+    is_active, registration_open, max_vol, registered_count = event
+    
+    if not is_active:
+        return REG_INACTIVE, None
+    if not registration_open:
+        return REG_CLOSED, None
+    
+    cur.execute('SELECT 1 FROM registrations WHERE user_id = ? AND event_id = ?', (user_id, event_id))
+    if cur.fetchone():
+        return REG_DUPLICATE, None
+    
+    if max_vol and registered_count >= max_vol:
+        return REG_FULL, None
+    
+    # Вставка с тем же условием на случай записи из другого процесса
+    try:
+        cur.execute('''
+            INSERT INTO registrations (user_id, event_id, comment)
+            SELECT ?, id, ? FROM events
+            WHERE id = ? AND is_active = 1 AND registration_open = 1
+              AND (registered_count < max_volunteers OR max_volunteers IS NULL OR max_volunteers = 0)
+        ''', (user_id, comment, event_id))
+    except sqlite3.IntegrityError:
+        return REG_DUPLICATE, None
+    
+    if cur.rowcount == 0:
+        return REG_FULL, None
+    
+    after_commit(event_changed, event_id)
+    after_commit(membership.add, event_id, user_id, cur.lastrowid)
+    cur.execute('''
+        SELECT registrations.id, users.full_name, users.group_name, users.birth_date,
+               users.phone_number, users.username, events.title, events.date, events.time,
+               events.location, events.max_volunteers, events.registered_count
+        FROM registrations
+        JOIN users ON registrations.user_id = users.telegram_id
+        JOIN events ON registrations.event_id = events.id
+        WHERE registrations.id = ?
+    ''', (cur.lastrowid,))
+    return REG_OK, cur.fetchone()
+
+@db_write
+def insert_event(conn, title, description, date, time, location, max_volunteers):
+    """Добавляет новое мероприятие и возвращает его ID"""
+    cur = conn.cursor()
+    cur.execute('''
+        INSERT INTO events (title, description, date, time, location, max_volunteers, is_active, registration_open)
+        VALUES (?, ?, ?, ?, ?, ?, 1, 1)
+    ''', (title, description, date, time, location, max_volunteers))
+    event_id = cur.lastrowid
+    after_commit(event_changed, event_id)
+    after_commit(reminder_scheduler.reschedule, event_id)
+    return event_id
+
+# Счетчики статистики хранятся готовыми в stats_snapshot (миграция 9): одним
+# агрегирующим запросом STATS_SNAPSHOT_REFRESH они считаются при создании
+# таблицы и по кнопке «🔄 Пересчитать», а дальше триггеры меняют их в тех же транзакциях, что
+# добавляют пользователей, записи и мероприятия. Поэтому открыть статистику -
+# прочитать одну строку и пять строк по индексу, сколько бы ни было записей.
+@db_write
+def refresh_stats_snapshot(conn):
+    """Пересчитывает снимок статистики заново"""
+    conn.execute(STATS_SNAPSHOT_REFRESH)
+
+@db_read
+def get_admin_stats(conn):
+    """Собирает статистику для админа из снимка"""
+    cur = conn.cursor()
+    
+    cur.execute('''
+        SELECT users, registrations, legacy_rows, active_events, inactive_events, open_events, computed_at
+        FROM stats_snapshot WHERE id = 1
+    ''')
+    users_count, regs_count, legacy_rows, active_events, inactive_events, open_events, computed_at = cur.fetchone()
+    
+    # Популярные мероприятия (по индексу idx_events_popular)
+    cur.execute('''
+        SELECT title, registered_count
+        FROM events
+        WHERE is_active = 1
+        ORDER BY registered_count DESC
+        LIMIT 5
+    ''')
+    popular_events = cur.fetchall()
+    
+    return {
+        'users': users_count,
+        'active_events': active_events,
+        'inactive_events': inactive_events,
+        'open_events': open_events,
+        'registrations': regs_count,
+        'legacy_rows': legacy_rows,
+        'popular_events': popular_events,
+        'computed_at': computed_at
+    }
+
+# В режиме CSV таблица повторяет записи из базы с постоянной разницей (старые
+# строки, отмены, еще не примененные к файлу): она считается по файлу один раз
+# и при пересчете, а не чтением всего volunteers.csv на каждое открытие.
+csv_rows_offset = None
+
+async def get_stats_snapshot(refresh=False):
+    """Статистика для админа; refresh - пересчитать снимок заново"""
+    global csv_rows_offset
+    if refresh:
+        await refresh_stats_snapshot()
+    
+    stats = await get_admin_stats()
+    if TABLE_FROM_DB:
+        stats['table_rows'] = stats['registrations'] + stats['legacy_rows']
+    else:
+        if refresh or csv_rows_offset is None:
+            csv_rows_offset = await count_csv_lines() - stats['registrations']
+        stats['table_rows'] = stats['registrations'] + csv_rows_offset
+    return stats
+
+# ========== КНОПКИ (CALLBACK_DATA) ==========
+# callback_data кнопки: <версия><код действия>|<аргумент>|<аргумент>...
+# Например, карточка мероприятия 12 - "1e|12", страница списка - "1lp|n|2024-05-01|10:00|12".
+# Действие и его аргументы описаны в CALLBACK_ACTIONS один раз: одна и та же
+# схема и собирает callback_data, и разбирает ее, поэтому обработчики получают
+# уже проверенные аргументы нужного типа в context.args.
+# Кнопки старых сообщений (другая версия или старый формат) не разбираются -
+# пользователю предлагается открыть меню заново.
+CALLBACK_VERSION = '1'
+CALLBACK_SEPARATOR = '|'
+CALLBACK_DATA_LIMIT = 64  # ограничение Telegram в байтах
+
+class CallbackDataError(ValueError):
+    """callback_data не соответствует ни одному действию"""
+
+def callback_int(value):
+    """Неотрицательное целое (id, номер)"""
+    if not value.isdigit():
+        raise ValueError(f"ожидалось число: {value!r}")
+    return int(value)
+
+def callback_text(value):
+    """Непустая строка без разделителя (дата, время)"""
+    if not value or CALLBACK_SEPARATOR in value:
+        raise ValueError(f"недопустимая строка: {value!r}")
+    return value
+
+def callback_choice(*choices):
+    """Одно значение из списка"""
+    allowed = frozenset(choices)
+    def parse(value):
+        if value not in allowed:
+            raise ValueError(f"недопустимое значение: {value!r}")
+        return value
+    return parse
+
+PAGE_DIRECTION = callback_choice('n', 'p')
+EVENT_FIELD = callback_choice('title', 'desc', 'date', 'time', 'location', 'max')
+ADMIN_FILTER = callback_choice(*ADMIN_EVENT_FILTERS)
+PAGE_CURSOR = (callback_text, callback_text, callback_int)  # дата, время, id мероприятия
+
+# действие: (код, типы аргументов)
+CALLBACK_ACTIONS = {
+    'list_events': ('l', ()),
+    'list_page': ('lp', (PAGE_DIRECTION,) + PAGE_CURSOR),
+    'event': ('e', (callback_int,)),
+    'register': ('r', (callback_int,)),
+    'cancel_reg': ('c', (callback_int,)),
+    'my_info': ('i', ()),
+    'edit_info': ('ei', ()),
+    'my_registrations': ('m', ()),
+    'main_menu': ('mm', ()),
+    'admin_add_event': ('aa', ()),
+    'admin_manage': ('am', ()),
+    'admin_filter': ('af', (ADMIN_FILTER,)),
+    'admin_page': ('ap', (ADMIN_FILTER, PAGE_DIRECTION) + PAGE_CURSOR),
+    'admin_list': ('al', ()),
+    'admin_report': ('ar', (callback_int,) + PAGE_CURSOR),
+    'admin_stats': ('as', ()),
+    'admin_stats_refresh': ('rs', ()),
+    'admin_table': ('at', ()),
+    'admin_back': ('ab', ()),
+    'manage': ('g', (callback_int,)),
+    'toggle_reg': ('tr', (callback_int,)),
+    'toggle_active': ('ta', (callback_int,)),
+    'download': ('d', (callback_int,)),
+    'delete': ('x', (callback_int,)),
+    'confirm_delete': ('xx', (callback_int,)),
+    'view': ('v', (callback_int,)),
+    'view_page': ('vp', (callback_int, callback_int, callback_text, callback_int)),
+    'edit_event': ('ee', (callback_int,)),
+    'edit_field': ('ef', (EVENT_FIELD, callback_int)),
+}
+
+def build_callback_codes(actions):
+    """Обратная таблица код -> (действие, типы); совпадающие коды - ошибка"""
+    codes = {}
+    for action, (code, types) in actions.items():
+        if not code or CALLBACK_SEPARATOR in code:
+            raise ValueError(f"Недопустимый код {code!r} у действия {action}")
+        if code in codes:
+            raise ValueError(f"Код {code!r} у действий {codes[code][0]} и {action}")
+        codes[code] = (action, types)
+    return codes
+
+CALLBACK_CODES = build_callback_codes(CALLBACK_ACTIONS)
+
+def callback_data(action, *args):
+    """Собирает callback_data действия; аргументы проверяются той же схемой, что и при разборе"""
+    code, types = CALLBACK_ACTIONS[action]
+    if len(args) != len(types):
+        raise CallbackDataError(f"{action}: ожидалось аргументов {len(types)}, получено {len(args)}")
+    parts = [CALLBACK_VERSION + code]
+    for parse, arg in zip(types, args):
+        value = str(arg)
+        try:
+            parse(value)
+        except ValueError as e:
+            raise CallbackDataError(f"{action}: {e}") from None
+        parts.append(value)
+    data = CALLBACK_SEPARATOR.join(parts)
+    if len(data.encode()) > CALLBACK_DATA_LIMIT:
+        raise CallbackDataError(f"{action}: callback_data длиннее {CALLBACK_DATA_LIMIT} байт")
+    return data
+
+def callback_action(data):
+    """Действие кнопки без разбора аргументов (None для чужих и старых кнопок)"""
+    if not isinstance(data, str) or data[:1] != CALLBACK_VERSION:
+        return None
+    entry = CALLBACK_CODES.get(data[1:].split(CALLBACK_SEPARATOR, 1)[0])
+    return entry[0] if entry else None
+
+def parse_callback_data(data):
+    """Разбирает callback_data: (действие, [аргументы])"""
+    if not isinstance(data, str) or data[:1] != CALLBACK_VERSION:
+        raise CallbackDataError(f"Неизвестная версия: {data!r}")
+    code, *values = data[1:].split(CALLBACK_SEPARATOR)
+    entry = CALLBACK_CODES.get(code)
+    if entry is None:
+        raise CallbackDataError(f"Неизвестное действие: {data!r}")
+    action, types = entry
+    if len(values) != len(types):
+        raise CallbackDataError(f"Неверное число аргументов: {data!r}")
+    try:
+        return action, [parse(value) for parse, value in zip(types, values)]
+    except ValueError as e:
+        raise CallbackDataError(f"{data!r}: {e}") from None
+
+def button(text, action, *args):
+    """Кнопка с callback_data действия"""
+    return InlineKeyboardButton(text, callback_data=callback_data(action, *args))
+
+class CallbackRouter:
+    """Один обработчик всех кнопок: действие находится по коду словарем, а не перебором регулярных выражений"""
+    
+    def __init__(self):
+        self.routes = {}  # действие -> обработчик
+        self.entries = set()  # действия - точки входа ConversationHandler
+        self.dispatched = 0
+        self.outdated = 0
+    
+    def claim(self, action):
+        """Проверяет, что у действия еще нет обработчика"""
+        if action not in CALLBACK_ACTIONS:
+            raise ValueError(f"Неизвестное действие {action}")
+        if action in self.routes or action in self.entries:
+            raise ValueError(f"Обработчик действия {action} уже назначен")
+    
+    def add(self, action, handler):
+        """Назначает обработчик действию"""
+        self.claim(action)
+        self.routes[action] = handler
+    
+    def check(self):
+        """Все действия CALLBACK_ACTIONS должны обрабатываться"""
+        missing = set(CALLBACK_ACTIONS) - set(self.routes) - self.entries
+        if missing:
+            raise ValueError(f"Нет обработчиков для действий: {', '.join(sorted(missing))}")
+    
+    def entry_point(self, action, handler):
+        """Точка входа ConversationHandler для действия: аргументы тоже попадают в context.args"""
+        self.claim(action)
+        self.entries.add(action)
+        
+        async def entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            try:
+                context.args = parse_callback_data(update.callback_query.data)[1]
+            except CallbackDataError:
+                await self.reject(update.callback_query)
+                return ConversationHandler.END
+            self.dispatched += 1
+            return await handler(update, context)
+        
+        return CallbackQueryHandler(entry, pattern=lambda data: callback_action(data) == action)
+    
+    async def reject(self, query):
+        """Кнопка старого сообщения или с испорченными данными"""
+        self.outdated += 1
+        await query.answer("⚠️ Кнопка устарела. Откройте меню заново: /start", show_alert=True)
+    
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик для CallbackQueryHandler"""
+        query = update.callback_query
+        try:
+            action, args = parse_callback_data(query.data)
+        except CallbackDataError:
+            await self.reject(query)
+            return
+        handler = self.routes.get(action)
+        if handler is None:
+            # Точка входа диалога, пока пользователь в другом диалоге
+            await query.answer("⏳ Сначала завершите текущее действие или отправьте /cancel", show_alert=True)
+            return
+        context.args = args
+        self.dispatched += 1
+        await handler(update, context)
+
+callback_router = CallbackRouter()
+
+# ========== ОТРИСОВКА ЭКРАНОВ ==========
+# Карточка мероприятия и список мероприятий зависят только от строки каталога,
+# поэтому отрисовываются один раз на версию строки (сама строка - ключ кэша).
+# В обработчике к готовому тексту добавляются только части конкретного
+# пользователя: отметка о записи и кнопка записи/отмены.
+# Разметки InlineKeyboardMarkup неизменяемые, их можно переиспользовать.
+def md(value):
+    """Экранирует текст для parse_mode='Markdown'"""
+    return escape_markdown(str(value), version=1)
+
+MD_SPECIAL = re.compile(r'([_*`\[])')
+
+def md_entity(value, marker='*'):
+    """Текст внутри сущности Markdown (*жирный*, `код`).
+    
+    В старом Markdown экранирование внутри сущности не работает, поэтому
+    спецсимволы выносятся за ее пределы: "2*2" -> *2*\\**2*.
+    """
+    parts = []
+    for index, part in enumerate(MD_SPECIAL.split(str(value))):
+        if index % 2:
+            parts.append('\\' + part)
+        elif part.strip():
+            # Пробелы по краям тоже остаются снаружи: "* текст*" не разбирается
+            lead = part[:len(part) - len(part.lstrip())]
+            tail = part[len(part.rstrip()):]
+            parts.append(f"{lead}{marker}{part.strip()}{marker}{tail}")
+        else:
+            parts.append(part)
+    return ''.join(parts)
+
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [button("📝 Записаться на мероприятие", 'list_events')],
+    [button("👤 Мои данные", 'my_info')],
+    [button("📋 Мои записи", 'my_registrations')]
+])
+
+NO_EVENTS_TEXT = (
+    "📭 *На данный момент нет доступных мероприятий для записи.*\n\n"
+    "Загляните позже или свяжитесь с организаторами!"
+)
+NO_EVENTS_MARKUP = InlineKeyboardMarkup([
+    [button("👤 Мои данные", 'my_info')],
+    [button("📋 Мои записи", 'my_registrations')],
+    [button("🏠 В главное меню", 'main_menu')]
+])
+
+EVENT_INACTIVE_TEXT = (
+    "❌ *Это мероприятие временно недоступно.*\n\n"
+    "Оно было деактивировано организаторами.\n\n"
+    "Пожалуйста, выберите другое мероприятие."
+)
+
+EVENT_CARD_FOOTER = (
+    (button("📅 К списку мероприятий", 'list_events'),),
+    (button("👤 Мои данные", 'my_info'),),
+)
+REGISTERED_NOTE = "✅ *Вы уже записаны на это мероприятие*\n\n"
+
+def page_cursor(event):
+    """Ключ мероприятия для callback_data: (дата, время, id)"""
+    return event[2], event[3], event[0]
+
+def page_buttons(action, prefix, first, last, has_prev, has_next):
+    """Кнопки «назад» и «вперед»; prefix - аргументы действия перед направлением и ключом"""
+    row = []
+    if has_prev:
+        row.append(button("⬅️ Назад", action, *prefix, 'p', *first))
+    if has_next:
+        row.append(button("Вперед ➡️", action, *prefix, 'n', *last))
+    return row
+
+@functools.lru_cache(maxsize=64)
+def render_event_list(events, has_prev, has_next):
+    """Текст и кнопки страницы списка мероприятий"""
+    keyboard = []
+    for event_id, title, date, time, location, max_vol, desc, available in events:
+        button_text = f"{title[:25]}..." if len(title) > 25 else title
+        keyboard.append([button(f"{button_text} ({date})", 'event', event_id)])
+    
+    nav = page_buttons('list_page', (), page_cursor(events[0]), page_cursor(events[-1]), has_prev, has_next)
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([button("👤 Мои данные", 'my_info')])
+    keyboard.append([button("🏠 В главное меню", 'main_menu')])
+    
+    parts = ["📅 *Доступные мероприятия для записи:*\n\n"]
+    for event_id, title, date, time, location, max_vol, desc, available in events:
+        parts.append(f"• {md_entity(title)}\n")
+        parts.append(f"   📅 {md(date)} ⏰ {md(time)}\n")
+        if location:
+            parts.append(f"   📍 {md(location)}\n")
+        parts.append(f"   🎫 Свободно: {available if available else '∞'}/{max_vol if max_vol else '∞'}\n\n")
+    
+    parts.append("Выберите мероприятие для подробной информации:")
+    return ''.join(parts), InlineKeyboardMarkup(keyboard)
+
+@functools.lru_cache(maxsize=512)
+def render_event_card(event):
+    """Общая для всех пользователей часть карточки мероприятия (строка каталога)"""
+    event_id, title, desc, date, time, location, max_vol, is_active, registration_open, registered = event
+    
+    parts = [f"🎯 {md_entity(title)}\n\n"]
+    if desc:
+        parts.append(f"📝 *Описание:* {md(desc)}\n\n")
+    parts.append(f"📅 *Дата:* {md(date)}\n")
+    parts.append(f"⏰ *Время:* {md(time)}\n")
+    if location:
+        parts.append(f"📍 *Место:* {md(location)}\n")
+    parts.append(f"👥 *Участников:* {max_vol if max_vol else 'без ограничений'}\n")
+    parts.append("✅ *Запись открыта*\n\n" if registration_open else "❌ *Запись закрыта*\n\n")
+    
+    register_row = (button("✅ Записаться", 'register', event_id),)
+    return ''.join(parts), InlineKeyboardMarkup((register_row,) + EVENT_CARD_FOOTER)
+
+def event_card_markup(event, registration_id):
+    """Кнопки карточки для конкретного пользователя"""
+    text, register_markup = render_event_card(event)
+    if registration_id:
+        cancel_row = (button("❌ Отменить запись", 'cancel_reg', registration_id),)
+        return InlineKeyboardMarkup((cancel_row,) + EVENT_CARD_FOOTER)
+    if event[8]:
+        return register_markup
+    return InlineKeyboardMarkup(EVENT_CARD_FOOTER)
+
+# Повторное редактирование сообщения тем же текстом и кнопками Telegram
+# отклоняет ошибкой "message is not modified", а запрос все равно тратится.
+# Для последних EDIT_FINGERPRINTS сообщений запоминается отпечаток того, что
+# в них показано, и одинаковое редактирование пропускается без запроса.
+class EditFingerprints:
+    """Ограниченный LRU отпечатков содержимого сообщений"""
+    
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.skipped = 0
+        self.sent = 0
+    
+    def same(self, key, fingerprint):
+        if self.entries.get(key) == fingerprint:
+            self.entries.move_to_end(key)
+            return True
+        return False
+    
+    def remember(self, key, fingerprint):
+        self.entries[key] = fingerprint
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+    
+    def forget(self, key):
+        self.entries.pop(key, None)
+
+edit_fingerprints = EditFingerprints(EDIT_FINGERPRINTS)
+
+async def edit_message(query, text, reply_markup=None, parse_mode=None, **kwargs):
+    """query.edit_message_text, пропускающий редактирование без изменений"""
+    message = query.message
+    if message is None:
+        return await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode, **kwargs)
+    
+    key = (message.chat_id, message.message_id)
+    fingerprint = hash((text, reply_markup, parse_mode))
+    if edit_fingerprints.same(key, fingerprint):
+        edit_fingerprints.skipped += 1
+        return None
+    
+    try:
+        result = await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode, **kwargs)
+    except BadRequest as e:
+        if 'message is not modified' in str(e).lower():
+            edit_fingerprints.skipped += 1
+            edit_fingerprints.remember(key, fingerprint)
+            return None
+        edit_fingerprints.forget(key)
+        raise
+    
+    edit_fingerprints.sent += 1
+    edit_fingerprints.remember(key, fingerprint)
+    return result
+
+# ========== ДЛИННЫЕ ОТЧЕТЫ ==========
+# Отчет читается из курсора порциями по REPORT_BATCH_SIZE строк, пока текст
+# страницы помещается в REPORT_LIMIT. Следующая страница начинается после ключа
+# последней показанной строки, ключ и номер строки передаются в callback_data.
+# В памяти одновременно только одна страница, сколько бы строк ни было.
+def telegram_length(text):
+    """Длина текста так, как ее считает Telegram (в UTF-16)"""
+    return len(text.encode('utf-16-le')) // 2
+
+def pack_report_page(cursor, header, render, key, number=0):
+    """Собирает страницу отчета из курсора.
+    
+    render(номер, строка) возвращает блок текста, key(строка) - ключ строки.
+    Возвращает (текст, строк на странице, ключ последней строки или None,
+    если строк больше нет).
+    """
+    parts = [header]
+    size = telegram_length(header)
+    rows = 0
+    last = None
+    
+    while True:
+        batch = cursor.fetchmany(REPORT_BATCH_SIZE)
+        if not batch:
+            return ''.join(parts), rows, None
+        for row in batch:
+            block = render(number + rows + 1, row)
+            block_size = telegram_length(block)
+            if rows and size + block_size > REPORT_LIMIT:
+                return ''.join(parts), rows, last
+            parts.append(block)
+            size += block_size
+            rows += 1
+            last = key(row)
+
+def render_admin_event(number, event):
+    event_id, title, date, time, location, max_vol, is_active, registration_open, registered = event
+    status = "✅ Активно" if is_active == 1 else "❌ Неактивно"
+    reg_status = "✅ Открыта" if registration_open == 1 else "❌ Закрыта"
+    max_text = f"{max_vol}" if max_vol and max_vol > 0 else "∞"
+    
+    parts = [f"🆔 *{event_id}*\n", f"🎯 {md_entity(title)}\n", f"   📅 {md(date)} ⏰ {md(time)}\n"]
+    if location:
+        parts.append(f"   📍 {md(location)}\n")
+    parts.append(f"   👥 {registered}/{max_text} записей\n")
+    parts.append(f"   🏷️ Статус: {status}\n")
+    parts.append(f"   📝 Запись: {reg_status}\n\n")
+    return ''.join(parts)
+
+@db_read
+def get_admin_events_report(conn, cursor=None, number=0):
+    """Страница отчета по всем мероприятиям: (текст, ключ продолжения, номер)"""
+    cur = conn.cursor()
+    where, params = '', []
+    if cursor is not None:
+        where, params = 'WHERE (date, time, id) > (?, ?, ?)', list(cursor)
+    cur.execute(f'''
+        SELECT id, title, date, time, location, max_volunteers,
+               is_active, registration_open, registered_count
+        FROM events {where}
+        ORDER BY date, time, id
+    ''', params)
+    
+    header = "📋 *Все мероприятия:*\n\n" if cursor is None else "📋 *Все мероприятия (продолжение):*\n\n"
+    text, rows, last = pack_report_page(
+        cur, header, render_admin_event, lambda event: (event[2], event[3], event[0]), number
+    )
+    if not rows:
+        return "📭 Нет мероприятий.", None, number
+    return text, last, number + rows
+
+def render_participant(number, registration):
+    reg_id, registration_date, comment, full_name, group_name, phone, username = registration
+    parts = [f"{number}. {md_entity(full_name)}\n", f"   ID записи: {reg_id}\n"]
+    if group_name:
+        parts.append(f"   Группа: {md(group_name)}\n")
+    if phone:
+        parts.append(f"   Телефон: {md(phone)}\n")
+    if username:
+        parts.append(f"   @{md(username.replace('@', ''))}\n")
+    if comment:
+        parts.append(f"   💬 Комментарий: {md(comment)}\n")
+    parts.append("\n")
+    return ''.join(parts)
+
+@db_read
+def get_participants_report(conn, event_id, title, total, cursor=None, number=0):
+    """Страница списка участников: (текст, ключ продолжения, номер)"""
+    cur = conn.cursor()
+    where, params = '', [event_id]
+    if cursor is not None:
+        where = 'AND (registrations.registration_date, registrations.id) > (?, ?)'
+        params.extend(cursor)
+    cur.execute(f'''
+        SELECT registrations.id, registrations.registration_date, registrations.comment,
+               users.full_name, users.group_name, users.phone_number, users.username
+        FROM registrations
+        JOIN users ON registrations.user_id = users.telegram_id
+        WHERE registrations.event_id = ? {where}
+        ORDER BY registrations.registration_date, registrations.id
+    ''', params)
+    
+    header = f"👥 *Записанные на мероприятие:* {md(title)}\nВсего записей: {total}\n\n"
+    text, rows, last = pack_report_page(
+        cur, header, render_participant, lambda registration: (registration[1], registration[0]), number
+    )
+    if not rows:
+        return f"👥 *Записанные на мероприятие:* {md(title)}\n\nПока никто не записался.", None, number
+    return text, last, number + rows
+
+def admin_events_report_markup(last, number, first_page):
+    """Кнопки отчета по мероприятиям: «еще» (номер и ключ последнего мероприятия) и «в начало»"""
+    keyboard = []
+    row = []
+    if not first_page:
+        row.append(button("⏮ В начало", 'admin_list'))
+    if last:
+        row.append(button("📄 Еще", 'admin_report', number, *last))
+    if row:
+        keyboard.append(row)
+    keyboard.append([button("◀️ Назад в админ-панель", 'admin_back')])
+    return InlineKeyboardMarkup(keyboard)
+
+# ========== ОСНОВНЫЕ КОМАНДЫ БОТА ==========
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начало работы с ботом"""
+    user = update.effective_user
+    
+    # Регистрируем пользователя в БД
+    await ensure_user(user.id, user.full_name, f"@{user.username}" if user.username else "")
+    
+    await update.message.reply_text(
+        f"👋 Привет, {user.first_name}!\n\n"
+        "Я бот для записи на волонтерские мероприятия.\n"
+        "Сначала заполните свои данные, затем выбирайте мероприятия!",
+        reply_markup=MAIN_MENU_MARKUP
+    )
+
+async def list_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает список активных мероприятий ДЛЯ ПОЛЬЗОВАТЕЛЕЙ"""
+    query = update.callback_query
+    await query.answer()
+    
+    # Без аргументов - первая страница, иначе направление и ключ крайнего мероприятия
+    cursor, backward = None, False
+    if context.args:
+        direction, *cursor = context.args
+        backward = direction == 'p'
+        cursor = tuple(cursor)
+    
+    events, has_prev, has_next = await event_catalog.active_page(cursor, backward)
+    if not events and cursor is not None:
+        events, has_prev, has_next = await event_catalog.active_page()
+    
+    if not events:
+        await edit_message(
+            query,
+            NO_EVENTS_TEXT,
+            reply_markup=NO_EVENTS_MARKUP,
+            parse_mode='Markdown'
+        )
+        return
+    
+    events_text, reply_markup = render_event_list(tuple(events), has_prev, has_next)
+    
+    await edit_message(
+        query,
+        events_text,
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+async def event_detail(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает детали мероприятия"""
+    query = update.callback_query
+    await query.answer()
+    
+    event_id, = context.args
+    
+    # Получаем информацию о мероприятии
+    event = await event_catalog.get(event_id)
+    
+    if not event:
+        await edit_message(query, "❌ Мероприятие не найдено.")
+        return
+    
+    # Проверяем, активно ли мероприятие
+    if not event[7]:
+        await edit_message(query, EVENT_INACTIVE_TEXT, parse_mode='Markdown')
+        return
+    
+    # Проверяем, записан ли пользователь
+    registration_id = await get_user_registration_id(query.from_user.id, event_id)
+    
+    text, _ = render_event_card(event)
+    if registration_id:
+        text += REGISTERED_NOTE
+    
+    await edit_message(
+        query,
+        text,
+        reply_markup=event_card_markup(event, registration_id),
+        parse_mode='Markdown'
+    )
+
+async def my_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает данные пользователя"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = query.from_user.id
+    
+    # Получаем данные пользователя
+    user = await get_user_profile(user_id)
+    
+    if not user:
+        text = "❌ Ваши данные не найдены. Пожалуйста, нажмите /start"
+    else:
+        full_name, group_name, birth_date, phone, username = user
+        text = "👤 *Ваши данные:*\n\n"
+        text += f"• *ФИО:* {md(full_name) if full_name else '❌ Не заполнено'}\n"
+        text += f"• *Группа:* {md(group_name) if group_name else '❌ Не заполнена'}\n"
+        text += f"• *Дата рождения:* {md(birth_date) if birth_date else '❌ Не заполнена'}\n"
+        text += f"• *Телефон:* {md(phone) if phone else '❌ Не заполнен'}\n"
+        text += f"• *Username:* {md(username) if username else '❌ Не заполнен'}\n\n"
+        
+        # Проверяем, все ли данные заполнены
+        missing = []
+        if not full_name: missing.append("ФИО")
+        if not group_name: missing.append("группа")
+        if not birth_date: missing.append("дата рождения")
+        if not phone: missing.append("телефон")
+        
+        if missing:
+            text += f"⚠️ *Для записи необходимо заполнить:* {', '.join(missing)}\n"
+        else:
+            text += "✅ *Все данные заполнены, можно записываться!*\n"
+    
+    # Создаем кнопки
+    keyboard = [
+        [button("✏️ Заполнить/изменить данные", 'edit_info')],
+        [button("📝 Записаться на мероприятие", 'list_events')],
+        [button("📋 Мои записи", 'my_registrations')],
+        [button("🏠 В главное меню", 'main_menu')]
+    ]
+    
+    await edit_message(
+        query,
+        text,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='Markdown'
+    )
+
+async def edit_info_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начинает процесс редактирования данных"""
+    query = update.callback_query
+    await query.answer()
+    
+    await edit_message(
+        query,
+        "✏️ *Заполните ваши данные*\n\n"
+        "Отправьте сообщение в формате:\n\n"
+        "`ФИО, Группа, Дата рождения (ДД.ММ.ГГГГ), Телефон, @username`\n\n"
+        "*Пример:*\n"
+        "`Иванов Иван Иванович, ИВТ-20-1, 15.05.2000, +79161234567, @ivanov`\n\n"
+        "📌 *Все поля обязательны для записи на мероприятия.*\n"
+        "📌 *Данные сохранятся и не нужно будет вводить их заново.*\n\n"
+        "Для отмены отправьте /cancel",
+        parse_mode='Markdown'
+    )
+    
+    return EDITING_INFO
+
+async def save_user_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сохраняет данные пользователя"""
+    text = update.message.text.strip()
+    
+    # Проверяем отмену
+    if text.lower() == '/cancel':
+        await update.message.reply_text("✅ Заполнение данных отменено.")
+        return ConversationHandler.END
+    
+    parts = [part.strip() for part in text.split(',')]
+    
+    if len(parts) >= 5:
+        try:
+            full_name = parts[0]
+            group = parts[1]
+            birth_date = parts[2]
+            phone = parts[3]
+            username = parts[4]
+            
+            # Проверяем формат даты рождения
+            try:
+                datetime.strptime(birth_date, '%d.%m.%Y')
+            except ValueError:
+                await update.message.reply_text(
+                    "❌ Неверный формат даты рождения! Используйте ДД.ММ.ГГГГ\n"
+                    "Пример: 15.05.2000\n\n"
+                    "Попробуйте еще раз или отправьте /cancel для отмены"
+                )
+                return EDITING_INFO
+            
+            # Проверяем username
+            if not username.startswith('@'):
+                await update.message.reply_text(
+                    "❌ Username должен начинаться с @\n"
+                    "Пример: @ivanov\n\n"
+                    "Попробуйте еще раз или отправьте /cancel для отмены"
+                )
+                return EDITING_INFO
+            
+            # Сохраняем в БД
+            await save_user_profile(update.effective_user.id, full_name, group, birth_date, phone, username)
+            
+            await update.message.reply_text(
+                "✅ *Данные сохранены!*\n\n"
+                f"• ФИО: {md(full_name)}\n"
+                f"• Группа: {md(group)}\n"
+                f"• Дата рождения: {md(birth_date)}\n"
+                f"• Телефон: {md(phone)}\n"
+                f"• Username: {md(username)}\n\n"
+                "📌 *Данные сохранены. Теперь вы можете записываться на мероприятия!*",
+                parse_mode='Markdown'
+            )
+            
+            # Показываем кнопки
+            keyboard = [
+                [button("📝 Записаться на мероприятие", 'list_events')],
+                [button("👤 Посмотреть мои данные", 'my_info')]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            await update.message.reply_text("Выберите действие:", reply_markup=reply_markup)
+            
+        except Exception as e:
+            await update.message.reply_text(
+                f"❌ Ошибка при сохранении: {e}\n\n"
+                "Пожалуйста, проверьте правильность ввода данных."
+            )
+            return EDITING_INFO
+    else:
+        await update.message.reply_text(
+            "❌ *Неверный формат!*\n\n"
+            "Пожалуйста, отправьте данные в формате:\n"
+            "`ФИО, Группа, Дата рождения, Телефон, @username`\n\n"
+            "Пример:\n"
+            "`Иванов Иван Иванович, ИВТ-20-1, 15.05.2000, +79161234567, @ivanov`\n\n"
+            "Попробуйте еще раз или отправьте /cancel для отмены",
+            parse_mode='Markdown'
+        )
+        return EDITING_INFO
+    
+    return ConversationHandler.END
+
+async def register_for_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начинает процесс записи на мероприятие"""
+    query = update.callback_query
+    await query.answer()
+    
+    event_id, = context.args
+    context.user_data['registering_event_id'] = event_id
+    
+    await edit_message(
+        query,
+        "📝 *Добавление комментария к записи*\n\n"
+        "За какой семестр выставлять баллы:\n\n"
+        "Примеры комментариев:\n"
+        "• 'Осень 2024/ весна 2025/ другое'\n\n"
+        "Отправьте комментарий или отправьте /skip чтобы пропустить.\n"
+        "Для отмены отправьте /cancel",
+        parse_mode='Markdown'
+    )
+    
+    return ADDING_COMMENT
+
+async def save_registration_with_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сохраняет запись с комментарием"""
+    text = update.message.text.strip()
+    
+    # Проверяем отмену
+    if text.lower() == '/cancel':
+        await update.message.reply_text("✅ Запись отменена.")
+        if 'registering_event_id' in context.user_data:
+            del context.user_data['registering_event_id']
+        return ConversationHandler.END
+    
+    # Проверяем пропуск комментария
+    if text.lower() == '/skip':
+        comment = ''
+    else:
+        comment = text[:200]  # Ограничиваем длину комментария
+    
+    event_id = context.user_data.get('registering_event_id')
+    user_id = update.effective_user.id
+    
+    # Проверяем, что event_id существует
+    if not event_id:
+        await update.message.reply_text("❌ Ошибка: мероприятие не найдено.")
+        return ConversationHandler.END
+    
+    # 1. Проверяем данные пользователя
+    user = await get_user_profile(user_id)
+    
+    if not user:
+        await update.message.reply_text("❌ Ваши данные не найдены. Пожалуйста, сначала заполните данные.")
+        if 'registering_event_id' in context.user_data:
+            del context.user_data['registering_event_id']
+        return ConversationHandler.END
+    
+    full_name, group, birth_date, phone, username = user
+    
+    # Проверяем обязательные поля
+    missing = []
+    if not full_name: missing.append("ФИО")
+    if not group: missing.append("группа")
+    if not birth_date: missing.append("дата рождения")
+    if not phone: missing.append("телефон")
+    
+    if missing:
+        keyboard = [
+            [button("✏️ Заполнить данные", 'edit_info')],
+            [button("📅 К мероприятиям", 'list_events')]
+        ]
+        
+        await update.message.reply_text(
+            f"❌ *Не хватает данных для записи:*\n• {', '.join(missing)}\n\n"
+            f"Пожалуйста, заполните данные перед записью.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        if 'registering_event_id' in context.user_data:
+            del context.user_data['registering_event_id']
+        return ConversationHandler.END
+    
+    # 2. Атомарно проверяем мероприятие, свободные места и сохраняем запись
+    # (повторную запись видно по индексу без транзакции)
+    if await get_user_registration_id(user_id, event_id):
+        result, registration = REG_DUPLICATE, None
+    else:
+        result, registration = await register_volunteer(user_id, event_id, comment)
+    
+    if result != REG_OK:
+        await update.message.reply_text(REGISTRATION_ERRORS[result])
+        if 'registering_event_id' in context.user_data:
+            del context.user_data['registering_event_id']
+        return ConversationHandler.END
+    
+    reg_id, full_name, group_name, birth_date, phone, username, title, date, time, location, max_vol, registered_count = registration
+    
+    # 3. Сохраняем запись в CSV (если таблица ведется файлом)
+    user_data = {
+        'registration_id': reg_id,
+        'telegram_id': user_id,
+        'full_name': full_name,
+        'group': group_name,
+        'birth_date': birth_date,
+        'phone': phone,
+        'username': username
+    }
+    
+    event_data = {
+        'id': event_id,
+        'title': title,
+        'date': date,
+        'time': time,
+        'location': location if location else 'Не указано'
+    }
+    
+    csv_success = TABLE_FROM_DB or await save_to_csv(user_data, event_data, comment, 'Записан')
+    
+    # 4. Отправляем ответ пользователю
+    if csv_success:
+        text = (
+            "✅ *Вы успешно записаны!*\n\n"
+            f"🎯 *Мероприятие:* {md(title)}\n"
+            f"📅 *Дата:* {md(date)}\n"
+            f"⏰ *Время:* {md(time)}\n"
+        )
+        
+        if location:
+            text += f"📍 *Место:* {md(location)}\n"
+        
+        if comment:
+            text += f"💬 *Ваш комментарий:* {md(comment)}\n\n"
+        
+        text += (
+            f"👥 *Место в списке:* {registered_count}/{max_vol if max_vol else '∞'}\n\n"
+            "📊 *Ваши данные сохранены в таблицу волонтеров.*\n"
+            "Организаторы увидят вашу запись.\n\n"
+            "📌 *Не забудьте добавить мероприятие в календарь!*"
+        )
+        if reminder_pending(date, time):
+            text += f"\n🔔 Мы напомним о мероприятии за {REMINDER_HOURS:g} ч. до начала."
+        
+        # Отправляем уведомление
+        await update.message.reply_text("✅ Запись сохранена в таблицу!")
+    else:
+        text = (
+            "⚠️ *Запись сохранена в боте, но возникла ошибка при сохранении в таблицу.*\n\n"
+            f"🎯 *Мероприятие:* {md(title)}\n"
+            f"📅 *Дата:* {md(date)}\n\n"
+            "Пожалуйста, свяжитесь с организаторами для подтверждения записи."
+        )
+        
+        await update.message.reply_text("⚠️ Ошибка сохранения в таблицу")
+    
+    # Кнопки после записи
+    keyboard = [
+        [button("📝 Записаться еще", 'list_events')],
+        [button("📋 Мои записи", 'my_registrations')],
+        [button("🏠 В главное меню", 'main_menu')]
+    ]
+    
+    await update.message.reply_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='Markdown'
+    )
+    
+    # Очищаем контекст
+    if 'registering_event_id' in context.user_data:
+        del context.user_data['registering_event_id']
+    
+    return ConversationHandler.END
+
+async def my_registrations(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает записи пользователя с возможностью отмены"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = query.from_user.id
+    if membership.loaded and not membership.has_registrations(user_id):
+        registrations = []
+    else:
+        registrations = await get_user_registrations(user_id)
+    
+    if not registrations:
+        text = (
+            "📭 *У вас пока нет записей на мероприятия.*\n\n"
+            "Выберите мероприятие из списка и запишитесь!"
+        )
+        keyboard = [
+            [button("📝 Записаться на мероприятие", 'list_events')],
+            [button("👤 Мои данные", 'my_info')],
+            [button("🏠 В главное меню", 'main_menu')]
+        ]
+    else:
+        parts = ["📋 *Ваши записи на мероприятия:*\n\n"]
+        keyboard = []
+        
+        for i, reg in enumerate(registrations, 1):
+            event_id, title, date, time, location, registration_id, reg_date, comment = reg
+            parts.append(f"{i}. {md_entity(title)}\n")
+            parts.append(f"   📅 {md(date)} ⏰ {md(time)}\n")
+            if location:
+                parts.append(f"   📍 {md(location)}\n")
+            if comment:
+                parts.append(f"   💬 Комментарий: {md(comment)}\n")
+            parts.append(f"   📝 Записан: {reg_date[:10]}\n")
+            parts.append(f"   🆔 ID записи: {registration_id}\n\n")
+            
+            # Добавляем кнопку отмены для каждой записи
+            keyboard.append([
+                button(f"❌ Отменить запись на '{title[:15]}...'", 'cancel_reg', registration_id)
+            ])
+        
+        keyboard.append([button("📝 Записаться на мероприятие", 'list_events')])
+        keyboard.append([button("👤 Мои данные", 'my_info')])
+        keyboard.append([button("🏠 В главное меню", 'main_menu')])
+        text = ''.join(parts)
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await edit_message(
+        query,
+        text,
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+async def cancel_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отменяет запись пользователя"""
+    query = update.callback_query
+    await query.answer()
+    
+    registration_id, = context.args
+    user_id = query.from_user.id
+    
+    # Получаем информацию о записи
+    registration_info = await get_registration_info(registration_id)
+    
+    if not registration_info:
+        await query.answer("❌ Запись не найдена", show_alert=True)
+        return
+    
+    # Проверяем, что это запись текущего пользователя
+    reg_id, reg_user_id, event_id, comment, full_name, group_name, birth_date, phone, username, title, date, time, location = registration_info
+    
+    if reg_user_id != user_id:
+        await query.answer("❌ Вы не можете отменить чужую запись!", show_alert=True)
+        return
+    
+    # Отменяем запись в БД
+    result = await cancel_registration_db(registration_id)
+    
+    if result:
+        # Удаляем из CSV (после фиксации транзакции)
+        if not TABLE_FROM_DB:
+            await delete_from_csv(registration_id)
+        
+        await query.answer("✅ Запись успешно отменена!", show_alert=True)
+        
+        # Показываем подтверждение
+        text = (
+            "✅ *Запись отменена успешно!*\n\n"
+            f"🎯 *Мероприятие:* {md(title)}\n"
+            f"📅 *Дата:* {md(date)}\n"
+            f"⏰ *Время:* {md(time)}\n"
+        )
+        
+        if location:
+            text += f"📍 *Место:* {md(location)}\n"
+        
+        if comment:
+            text += f"💬 *Ваш комментарий:* {md(comment)}\n"
+        
+        text += "\n📊 *Запись удалена из таблицы волонтеров.*\n"
+        text += "Место освобождено для других участников."
+        
+        keyboard = [
+            [button("📝 Записаться на другое мероприятие", 'list_events')],
+            [button("📋 Мои записи", 'my_registrations')],
+            [button("🏠 В главное меню", 'main_menu')]
+        ]
+        
+        await edit_message(
+            query,
+            text,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
+    else:
+        await query.answer("❌ Ошибка при отмене записи", show_alert=True)
+
+async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Главное меню"""
+    query = update.callback_query
+    await query.answer()
+    
+    await edit_message(
+        query,
+        "🏠 *Главное меню*\n\nВыберите действие:",
+        reply_markup=MAIN_MENU_MARKUP,
+        parse_mode='Markdown'
+    )
+
+# ========== АДМИН КОМАНДЫ ==========
+async def admin_add_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начало процесса добавления мероприятия"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ У вас нет прав доступа.")
+        return ConversationHandler.END
+    
+    await update.message.reply_text(
+        "📝 *Добавление нового мероприятия*\n\n"
+        "Отправьте данные в формате:\n\n"
+        "`Название, Описание, Дата (ГГГГ-ММ-ДД), Время (ЧЧ:ММ), Место, Макс. участников`\n\n"
+        "*Пример:*\n"
+        "`Уборка парка, Субботник в центральном парке, 2024-04-10, 14:00, Центральный парк, 30`\n\n"
+        "📌 *Примечания:*\n"
+        "- Дата в формате ГГГГ-ММ-ДД\n"
+        "- Время в формате ЧЧ:ММ\n"
+        "- Макс. участников: число или 0 для неограниченного\n"
+        "- Описание не обязательно\n\n"
+        "Для отмены отправьте /cancel",
+        parse_mode='Markdown'
+    )
+    
+    context.user_data['adding_event'] = True
+    return ADDING_EVENT
+
+async def save_new_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сохраняет новое мероприятие из сообщения"""
+    # Проверяем, что это именно админ и он в режиме добавления
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ У вас нет прав доступа.")
+        return ConversationHandler.END
+    
+    text = update.message.text.strip()
+    
+    if text.lower() == '/cancel':
+        await update.message.reply_text("✅ Добавление мероприятия отменено.")
+        return ConversationHandler.END
+    
+    parts = [part.strip() for part in text.split(',')]
+    
+    if len(parts) >= 5:
+        try:
+            # Определяем части в зависимости от количества
+            if len(parts) == 5:
+                # Формат без описания: Название, Дата, Время, Место, Макс
+                title = parts[0]
+                description = ""
+                date = parts[1]
+                time = parts[2]
+                location = parts[3]
+                max_volunteers = int(parts[4]) if parts[4].isdigit() else 0
+            else:
+                # Формат с описанием: Название, Описание, Дата, Время, Место, Макс
+                title = parts[0]
+                description = parts[1]
+                date = parts[2]
+                time = parts[3]
+                location = parts[4]
+                max_volunteers = int(parts[5]) if parts[5].isdigit() else 0
+            
+            # Проверяем формат даты
+            try:
+                datetime.strptime(date, '%Y-%m-%d')
+            except ValueError:
+                await update.message.reply_text(
+                    "❌ Неверный формат даты! Используйте ГГГГ-ММ-ДД\n"
+                    "Пример: 2024-04-10\n\n"
+                    "Попробуйте еще раз или отправьте /cancel для отмены"
+                )
+                return ADDING_EVENT
+            
+            # Проверяем формат времени
+            try:
+                datetime.strptime(time, '%H:%M')
+            except ValueError:
+                await update.message.reply_text(
+                    "❌ Неверный формат времени! Используйте ЧЧ:ММ\n"
+                    "Пример: 14:00\n\n"
+                    "Попробуйте еще раз или отправьте /cancel для отмены"
+                )
+                return ADDING_EVENT
+            
+            # Сохраняем в БД
+            event_id = await insert_event(title, description, date, time, location, max_volunteers)
+            
+            # Формируем ответ
+            response_text = (
+                "✅ *Мероприятие добавлено!*\n\n"
+                f"🎯 *Название:* {md(title)}\n"
+                f"📅 *Дата:* {md(date)}\n"
+                f"⏰ *Время:* {md(time)}\n"
+                f"📍 *Место:* {md(location)}\n"
+                f"👥 *Макс. участников:* {max_volunteers if max_volunteers > 0 else 'не ограничено'}\n"
+            )
+            
+            if description:
+                response_text += f"📝 *Описание:* {md(description)}\n"
+            
+            response_text += f"\n🆔 *ID мероприятия:* {event_id}"
+            
+            await update.message.reply_text(response_text, parse_mode='Markdown')
+            
+            print(f"✅ Добавлено мероприятие: {title} (ID: {event_id})")
+            
+        except Exception as e:
+            print(f"❌ Ошибка при добавлении мероприятия: {e}")
+            await update.message.reply_text(
+                f"❌ Ошибка: {str(e)[:200]}\n\n"
+                "Проверьте правильность ввода данных и попробуйте еще раз.\n"
+                "Для отмены отправьте /cancel"
+            )
+            return ADDING_EVENT
+    else:
+        await update.message.reply_text(
+            "❌ *Неверный формат!* Требуется минимум 5 полей.\n\n"
+            "Отправьте данные в формате:\n"
+            "`Название, Описание, Дата, Время, Место, Макс. участников`\n\n"
+            "*Пример:*\n"
+            "`Уборка парка, Субботник в парке, 2024-04-10, 14:00, Центральный парк, 30`\n\n"
+            "Попробуйте еще раз или отправьте /cancel для отмены",
+            parse_mode='Markdown'
+        )
+        return ADDING_EVENT
+    
+    # Сбрасываем флаг
+    if 'adding_event' in context.user_data:
+        del context.user_data['adding_event']
+    
+    return ConversationHandler.END
+
+async def admin_list_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает список мероприятий админу"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ У вас нет прав доступа.")
+        return
+    
+    text, last, number = await get_admin_events_report()
+    await update.message.reply_text(
+        text,
+        reply_markup=admin_events_report_markup(last, number, True),
+        parse_mode='Markdown'
+    )
+
+async def admin_manage_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Меню управления мероприятиями для админа"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    # Без аргументов - первая страница всех мероприятий,
+    # иначе фильтр и, для следующих страниц, направление и ключ
+    event_filter, cursor, backward = 'all', None, False
+    if context.args:
+        event_filter, *page = context.args
+        if page:
+            direction, *cursor = page
+            backward = direction == 'p'
+            cursor = tuple(cursor)
+    
+    events, has_prev, has_next, total = await get_admin_events_page(event_filter, cursor, backward)
+    if not events and cursor is not None:
+        events, has_prev, has_next, total = await get_admin_events_page(event_filter)
+    
+    # Кнопки фильтров
+    keyboard = [[
+        button(("• " if key == event_filter else "") + label, 'admin_filter', key)
+        for key, (label, condition) in ADMIN_EVENT_FILTERS.items()
+    ]]
+    
+    # Создаем кнопки для мероприятий страницы
+    for event_id, title, date, time, is_active, registration_open in events:
+        button_text = f"🆔{event_id}: {title[:20]}"
+        if len(title) > 20:
+            button_text += "..."
+        button_text += f" ({date})"
+        
+        # Иконки статуса
+        status_icon = "✅" if is_active == 1 else "❌"
+        reg_icon = "📝" if registration_open == 1 else "🔒"
+        
+        button_text = f"{status_icon}{reg_icon} {button_text}"
+        keyboard.append([button(button_text, 'manage', event_id)])
+    
+    if events:
+        nav = page_buttons('admin_page', (event_filter,), page_cursor(events[0]), page_cursor(events[-1]), has_prev, has_next)
+        if nav:
+            keyboard.append(nav)
+    
+    keyboard.append([button("◀️ Назад в админ-панель", 'admin_back')])
+    
+    if not events:
+        text = "📭 Нет мероприятий для управления."
+    else:
+        text = (
+            "🔧 *Управление мероприятиями*\n\n"
+            "Выберите мероприятие для управления:\n"
+            "✅❌ - активность мероприятия\n"
+            "📝🔒 - статус записи\n\n"
+            f"{ADMIN_EVENT_FILTERS[event_filter][0]}: {total}"
+        )
+    
+    await edit_message(
+        query,
+        text,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='Markdown'
+    )
+
+async def manage_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Управление конкретным мероприятием"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    # Кнопки действий над мероприятием тоже передают только его id
+    event_id, = context.args
+    
+    event = await get_event_details(event_id)
+    if not event:
+        await edit_message(query, "❌ Мероприятие не найдено.")
+        return
+    
+    title, desc, date, time, location, max_vol, is_active, registration_open = event
+    
+    # Получаем количество записанных
+    registered = await count_event_registrations(event_id)
+    
+    # Формируем текст
+    text = f"🔧 *Управление мероприятием*\n\n"
+    text += f"🆔 *ID:* {event_id}\n"
+    text += f"🎯 *Название:* {md(title)}\n"
+    if desc:
+        text += f"📝 *Описание:* {md(desc)}\n"
+    text += f"📅 *Дата:* {md(date)}\n"
+    text += f"⏰ *Время:* {md(time)}\n"
+    if location:
+        text += f"📍 *Место:* {md(location)}\n"
+    text += f"👥 *Участников:* {registered}/{max_vol if max_vol > 0 else '∞'}\n"
+    text += f"🏷️ *Статус:* {'✅ Активно' if is_active == 1 else '❌ Неактивно'}\n"
+    text += f"📝 *Запись:* {'✅ Открыта' if registration_open == 1 else '❌ Закрыта'}\n"
+    
+    # Создаем кнопки управления
+    keyboard = []
+    
+    # Кнопка для активации/деактивации мероприятия
+    if is_active == 1:
+        keyboard.append([button("❌ Деактивировать мероприятие", 'toggle_active', event_id)])
+    else:
+        keyboard.append([button("✅ Активировать мероприятие", 'toggle_active', event_id)])
+    
+    # Кнопка для открытия/закрытия записи
+    if registration_open == 1:
+        keyboard.append([button("🔒 Закрыть запись", 'toggle_reg', event_id)])
+    else:
+        keyboard.append([button("📝 Открыть запись", 'toggle_reg', event_id)])
+    
+    # Кнопка для скачивания таблицы мероприятия
+    keyboard.append([button("📥 Скачать таблицу мероприятия", 'download', event_id)])
+    
+    # Кнопки для редактирования
+    keyboard.append([button("✏️ Изменить данные", 'edit_event', event_id)])
+    
+    # Кнопка удаления
+    keyboard.append([button("🗑️ Удалить мероприятие", 'delete', event_id)])
+    
+    # Кнопка просмотра записавшихся
+    keyboard.append([button("👥 Просмотреть записавшихся", 'view', event_id)])
+    
+    keyboard.append([button("◀️ Назад к списку", 'admin_manage')])
+    keyboard.append([button("🏠 В админ-панель", 'admin_back')])
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await edit_message(
+        query,
+        text,
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+# ========== ОТДЕЛЬНЫЕ ОБРАБОТЧИКИ ДЛЯ КНОПОК ==========
+async def toggle_registration_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает кнопку открытия/закрытия записи"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    event_id, = context.args
+    
+    event = await get_event_details(event_id)
+    if not event:
+        await query.answer("❌ Мероприятие не найдено", show_alert=True)
+        return
+    
+    title = event[0]
+    
+    # Переключаем запись
+    is_now_open = await toggle_event_registration(event_id)
+    if is_now_open:
+        message = f"📝 Запись на мероприятие '{title}' открыта."
+    else:
+        message = f"🔒 Запись на мероприятие '{title}' закрыта."
+    
+    await query.answer(message, show_alert=True)
+    
+    # Обновляем страницу
+    await asyncio.sleep(0.5)
+    await manage_event(update, context)
+
+async def toggle_active_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает кнопку активации/деактивации мероприятия"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    event_id, = context.args
+    
+    event = await get_event_details(event_id)
+    if not event:
+        await query.answer("❌ Мероприятие не найдено", show_alert=True)
+        return
+    
+    title = event[0]
+    
+    # Переключаем активность
+    is_now_active = await toggle_event_active_status(event_id)
+    if is_now_active:
+        message = f"✅ Мероприятие '{title}' активировано."
+    else:
+        message = f"❌ Мероприятие '{title}' деактивировано."
+    
+    await query.answer(message, show_alert=True)
+    
+    # Обновляем страницу
+    await asyncio.sleep(0.5)
+    await manage_event(update, context)
+
+async def download_event_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает кнопку скачивания таблицы мероприятия"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    event_id, = context.args
+    
+    event = await get_event_details(event_id)
+    if not event:
+        await query.answer("❌ Мероприятие не найдено", show_alert=True)
+        return
+    
+    title = event[0]
+    caption = f"📊 Таблица участников мероприятия: {title}"
+    
+    # Если таблица не менялась, отправляем уже загруженный файл
+    version = await get_event_export_version(event_id)
+    file_id = export_cache.get(('event', event_id), version)
+    if file_id:
+        try:
+            await context.bot.send_document(chat_id=query.from_user.id, document=file_id, caption=caption)
+            await query.answer("✅ Таблица отправлена вам в личные сообщения!", show_alert=True)
+            return
+        except Exception as e:
+            print(f"⚠️ Не удалось отправить таблицу из кэша: {e}")
+    
+    # Собираем таблицу мероприятия
+    try:
+        export = await get_event_csv(event_id)
+    except Exception as e:
+        print(f"❌ Ошибка создания CSV для мероприятия: {e}")
+        export = None
+    
+    if export:
+        f, rows = export
+        try:
+            message = await context.bot.send_document(
+                chat_id=query.from_user.id,
+                document=await export_document(
+                    f, f'мероприятие_{event_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+                ),
+                caption=caption
+            )
+            export_cache.put(('event', event_id), version, message.document.file_id)
+            
+            await query.answer("✅ Таблица отправлена вам в личные сообщения!", show_alert=True)
+            
+        except Exception as e:
+            print(f"❌ Ошибка при отправке CSV: {e}")
+            await query.answer("❌ Ошибка при отправке файла", show_alert=True)
+        finally:
+            f.close()
+    else:
+        await query.answer("❌ Ошибка при создании файла", show_alert=True)
+
+async def delete_event_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает кнопку удаления мероприятия"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    event_id, = context.args
+    
+    event = await get_event_details(event_id)
+    if not event:
+        await query.answer("❌ Мероприятие не найдено", show_alert=True)
+        return
+    
+    title = event[0]
+    
+    # Подтверждение удаления
+    keyboard = [
+        [button("✅ Да, удалить", 'confirm_delete', event_id)],
+        [button("❌ Нет, отменить", 'manage', event_id)]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await edit_message(
+        query,
+        f"⚠️ *Вы уверены, что хотите удалить мероприятие?*\n\n"
+        f"🎯 *Название:* {md(title)}\n\n"
+        f"Это действие удалит:\n"
+        f"• Само мероприятие\n"
+        f"• Все записи на него\n"
+        f"• Все данные из таблицы CSV\n\n"
+        f"*Действие необратимо!*",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+async def confirm_delete_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает подтверждение удаления мероприятия"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    event_id, = context.args
+    
+    event = await get_event_details(event_id)
+    if not event:
+        await query.answer("❌ Мероприятие не найдено", show_alert=True)
+        return
+    
+    title = event[0]
+    
+    # Удаляем мероприятие
+    if await delete_event(event_id):
+        if not TABLE_FROM_DB:
+            await delete_event_from_csv(event_id)
+        message = f"🗑️ Мероприятие '{title}' удалено."
+        # Возвращаемся к первой странице списка
+        context.args = []
+        await admin_manage_events(update, context)
+    else:
+        message = f"❌ Ошибка при удалении мероприятия."
+        await query.answer(message, show_alert=True)
+        await asyncio.sleep(0.5)
+        context.args = []
+        await admin_manage_events(update, context)
+
+async def view_event_participants(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает участников мероприятия"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    # id мероприятия - первая страница; продолжение - еще номер, дата и id последней записи
+    event_id, number, cursor = context.args[0], 0, None
+    if len(context.args) > 1:
+        number, cursor = context.args[1], tuple(context.args[2:])
+    
+    event = await event_catalog.get(event_id)
+    if not event:
+        await edit_message(query, "❌ Мероприятие не найдено.")
+        return
+    
+    text, last, next_number = await get_participants_report(event_id, event[1], event[9], cursor, number)
+    
+    keyboard = []
+    row = []
+    if cursor is not None:
+        row.append(button("⏮ В начало", 'view', event_id))
+    if last:
+        row.append(button("📄 Еще", 'view_page', event_id, next_number, *last))
+    if row:
+        keyboard.append(row)
+    keyboard.append([button("◀️ Назад к управлению", 'manage', event_id)])
+    
+    await edit_message(
+        query,
+        text,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='Markdown'
+    )
+
+async def edit_event_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начинает редактирование мероприятия"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    event_id, = context.args
+    
+    context.user_data['editing_event_id'] = event_id
+    context.user_data['editing_field'] = None
+    
+    event = await get_event_details(event_id)
+    if not event:
+        await edit_message(query, "❌ Мероприятие не найдено.")
+        return
+    
+    title = event[0]
+    
+    keyboard = [
+        [button("✏️ Название", 'edit_field', 'title', event_id)],
+        [button("📝 Описание", 'edit_field', 'desc', event_id)],
+        [button("📅 Дата", 'edit_field', 'date', event_id)],
+        [button("⏰ Время", 'edit_field', 'time', event_id)],
+        [button("📍 Место", 'edit_field', 'location', event_id)],
+        [button("👥 Макс. участников", 'edit_field', 'max', event_id)],
+        [button("◀️ Назад", 'manage', event_id)]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await edit_message(
+        query,
+        f"✏️ *Редактирование мероприятия:* {md(title)}\n\n"
+        "Выберите поле для редактирования:",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+async def edit_event_field_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начинает редактирование поля мероприятия"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    field, event_id = context.args
+    
+    event = await get_event_details(event_id)
+    if not event:
+        await edit_message(query, "❌ Мероприятие не найдено.")
+        return
+    
+    title, desc, date, time, location, max_vol, is_active, registration_open = event
+    
+    field_names = {
+        'title': 'Название',
+        'desc': 'Описание',
+        'date': 'Дату (ГГГГ-ММ-ДД)',
+        'time': 'Время (ЧЧ:ММ)',
+        'location': 'Место',
+        'max': 'Максимальное количество участников'
+    }
+    
+    field_values = {
+        'title': title,
+        'desc': desc,
+        'date': date,
+        'time': time,
+        'location': location,
+        'max': str(max_vol)
+    }
+    
+    field_name = field_names.get(field, 'поле')
+    current_value = field_values.get(field, '')
+    
+    await edit_message(
+        query,
+        f"✏️ *Редактирование {field_name}*\n\n"
+        f"Текущее значение: {md_entity(current_value, '`') if current_value else '—'}\n\n"
+        f"Отправьте новое значение.\n"
+        f"Для отмены отправьте /cancel",
+        parse_mode='Markdown'
+    )
+    
+    context.user_data['editing_event_id'] = event_id
+    context.user_data['editing_field'] = field
+    
+    return EDIT_EVENT_DETAILS
+
+async def save_event_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сохраняет отредактированное поле мероприятия"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ У вас нет прав доступа.")
+        return ConversationHandler.END
+    
+    text = update.message.text.strip()
+    
+    if text.lower() == '/cancel':
+        await update.message.reply_text("✅ Редактирование отменено.")
+        return ConversationHandler.END
+    
+    event_id = context.user_data.get('editing_event_id')
+    field = context.user_data.get('editing_field')
+    
+    if not event_id or not field:
+        await update.message.reply_text("❌ Ошибка: данные не найдены.")
+        return ConversationHandler.END
+    
+    event = await get_event_details(event_id)
+    if not event:
+        await update.message.reply_text("❌ Мероприятие не найдено.")
+        return ConversationHandler.END
+    
+    title = event[0]
+    
+    try:
+        # Валидация в зависимости от поля
+        if field == 'date':
+            try:
+                datetime.strptime(text, '%Y-%m-%d')
+            except ValueError:
+                await update.message.reply_text(
+                    "❌ Неверный формат даты! Используйте ГГГГ-ММ-ДД\n"
+                    "Пример: 2024-04-10\n\n"
+                    "Попробуйте еще раз или отправьте /cancel для отмены"
+                )
+                return EDIT_EVENT_DETAILS
+        
+        elif field == 'time':
+            try:
+                datetime.strptime(text, '%H:%M')
+            except ValueError:
+                await update.message.reply_text(
+                    "❌ Неверный формат времени! Используйте ЧЧ:ММ\n"
+                    "Пример: 14:00\n\n"
+                    "Попробуйте еще раз или отправьте /cancel для отмены"
+                )
+                return EDIT_EVENT_DETAILS
+        
+        elif field == 'max':
+            if not text.isdigit() and text != '0':
+                await update.message.reply_text(
+                    "❌ Введите число для максимального количества участников!\n"
+                    "Или 0 для неограниченного количества.\n\n"
+                    "Попробуйте еще раз или отправьте /cancel для отмены"
+                )
+                return EDIT_EVENT_DETAILS
+        
+        # Обновляем поле
+        db_field = {
+            'title': 'title',
+            'desc': 'description',
+            'date': 'date',
+            'time': 'time',
+            'location': 'location',
+            'max': 'max_volunteers'
+        }.get(field)
+        
+        if db_field:
+            await update_event(event_id, db_field, text)
+        
+        await update.message.reply_text(
+            f"✅ Поле мероприятия '{md(title)}' успешно обновлено!\n"
+            f"Новое значение: {md_entity(text, '`')}",
+            parse_mode='Markdown'
+        )
+        
+    except Exception as e:
+        await update.message.reply_text(
+            f"❌ Ошибка при обновлении: {e}\n\n"
+            "Попробуйте еще раз или отправьте /cancel для отмены"
+        )
+        return EDIT_EVENT_DETAILS
+    
+    # Очищаем контекст
+    if 'editing_event_id' in context.user_data:
+        del context.user_data['editing_event_id']
+    if 'editing_field' in context.user_data:
+        del context.user_data['editing_field']
+    
+    return ConversationHandler.END
+
+async def admin_table(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отправляет CSV таблицу админу"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ У вас нет прав доступа.")
+        return
+    
+    version = await get_table_export_version()
+    cached = export_cache.get('all', version)
+    if cached:
+        file_id, rows = cached
+        try:
+            await update.message.reply_document(
+                document=file_id,
+                caption=f"📊 Таблица волонтеров\nВсего записей: {rows}"
+            )
+            return
+        except Exception as e:
+            print(f"⚠️ Не удалось отправить таблицу из кэша: {e}")
+    
+    table = await open_volunteers_table()
+    if not table:
+        await update.message.reply_text("❌ Таблица еще не создана.")
+        return
+    
+    f, rows = table
+    try:
+        message = await update.message.reply_document(
+            document=await export_document(f, f'волонтеры_{datetime.now().strftime("%Y-%m-%d")}.csv'),
+            caption=f"📊 Таблица волонтеров\nВсего записей: {rows}"
+        )
+        export_cache.put('all', version, (message.document.file_id, rows))
+        print(f"✅ Таблица отправлена админу {ADMIN_ID}")
+    except Exception as e:
+        await update.message.reply_text(f"❌ Ошибка при отправке таблицы: {e}")
+    finally:
+        f.close()
+
+async def admin_stats_text(stats, application):
+    """Текст статистики для команды /stats и кнопки «📊 Статистика»"""
+    text = "👑 *Статистика для админа*\n\n"
+    text += f"👥 Пользователей: {stats['users']}\n"
+    text += f"📅 Всего мероприятий: {stats['active_events'] + stats['inactive_events']}\n"
+    text += f"   ✅ Активных: {stats['active_events']}\n"
+    text += f"   ❌ Неактивных: {stats['inactive_events']}\n"
+    text += f"   📝 С открытой записью: {stats['open_events']}\n"
+    text += f"📝 Всего записей: {stats['registrations']}\n"
+    text += f"📊 Записей в таблице: {stats['table_rows']}\n"
+    text += f"📦 Кэш выгрузок: попаданий {export_cache.hits}, промахов {export_cache.misses}\n"
+    text += (f"🗂 Кэш мероприятий: попаданий {event_catalog.hit_ratio():.0%}, "
+             f"сбросов {event_catalog.invalidations}, устаревших найдено {event_catalog.stale_found}\n")
+    text += (f"👤 Кэш профилей: попаданий {profile_cache.hit_ratio():.0%}, "
+             f"пропущено /start без запроса: {known_users_skipped}\n")
+    text += (f"🚦 Обновлений: пользователей в очереди {len(update_processor.user_waiting)}, "
+             f"отброшено {update_processor.dropped}\n")
+    outbox = await get_outbox_stats()
+    text += (f"📬 Рассылки: в очереди {outbox.get(OUTBOX_PENDING, 0)}, "
+             f"доставлено {outbox.get(OUTBOX_SENT, 0)}, ошибок {outbox.get(OUTBOX_FAILED, 0)}\n")
+    text += f"✏️ Пропущено повторных редактирований: {edit_fingerprints.skipped} из {edit_fingerprints.skipped + edit_fingerprints.sent}\n"
+    text += f"🔘 Кнопок обработано: {callback_router.dispatched}, устаревших: {callback_router.outdated}\n"
+    text += (f"💾 Состояние диалогов: загружено пользователей {state_persistence.loads}, "
+             f"записано строк {state_persistence.rows_written} (последняя запись {state_persistence.last_write_ms:.1f} мс)\n")
+    resident, resident_bytes = user_state_size(application.user_data)
+    text += (f"🧠 Состояние в памяти: пользователей {resident} (~{resident_bytes // 1024} КБ), "
+             f"вытеснено {user_states.evicted}, истекших действий {user_states.expired}\n")
+    if csv_writer.running:
+        text += (f"🖊 Очередь CSV: {csv_writer.depth}, сброс {csv_writer.last_flush_ms:.1f} мс "
+                 f"(макс. {csv_writer.max_flush_ms:.1f} мс), повторов {csv_writer.retries}\n")
+    text += "\n"
+    
+    text += "🔥 *Самые популярные мероприятия:*\n"
+    for title, count in stats['popular_events']:
+        text += f"• {md(title)}: {count} записей\n"
+    text += f"\n🕒 Снимок пересчитан: {stats['computed_at']} UTC"
+    return text
+
+async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает статистику админу (/stats refresh - пересчитать снимок заново)"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ У вас нет прав доступа.")
+        return
+    
+    stats = await get_stats_snapshot(refresh=context.args == ['refresh'])
+    text = await admin_stats_text(stats, context.application)
+    await update.message.reply_text(text, parse_mode='Markdown')
+
+async def admin_check_counters(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Проверяет и исправляет счетчики записей на мероприятия"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ У вас нет прав доступа.")
+        return
+    
+    drift = await check_registration_counters(repair=True)
+    
+    if not drift:
+        text = "✅ Счетчики записей совпадают с данными."
+    else:
+        text = f"⚠️ Исправлено расхождений: {len(drift)}\n\n"
+        for event_id, title, stored, actual in drift:
+            text += f"🆔 {event_id} {title}: было {stored}, стало {actual}\n"
+    
+    stale = await event_catalog.verify()
+    if stale:
+        text += f"\n⚠️ Кэш мероприятий расходился с базой: {stale} строк, перечитан"
+    else:
+        text += "\n✅ Кэш мероприятий совпадает с базой."
+    
+    await update.message.reply_text(text)
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /cancel"""
+    await update.message.reply_text("✅ Операция отменена.")
+    
+    # Сбрасываем флаги
+    if 'adding_event' in context.user_data:
+        del context.user_data['adding_event']
+    if 'editing_event_id' in context.user_data:
+        del context.user_data['editing_event_id']
+    if 'editing_field' in context.user_data:
+        del context.user_data['editing_field']
+    if 'registering_event_id' in context.user_data:
+        del context.user_data['registering_event_id']
+    
+    return ConversationHandler.END
+
+async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Админ-панель"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("⛔ У вас нет прав доступа.")
+        return
+    
+    keyboard = [
+        [button("➕ Добавить мероприятие", 'admin_add_event')],
+        [button("🔧 Управление мероприятиями", 'admin_manage')],
+        [button("📋 Все мероприятия", 'admin_list')],
+        [button("📊 Статистика", 'admin_stats')],
+        [button("📥 Скачать общую таблицу", 'admin_table')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    text = (
+        "👑 *Админ-панель*\n\n"
+        "Выберите действие для управления волонтерскими мероприятиями:"
+    )
+    
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+# ========== ИСПРАВЛЕННЫЕ ФУНКЦИИ КНОПОК ==========
+async def admin_add_event_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик кнопки добавления мероприятия (из админ-панели)"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    await edit_message(
+        query,
+        "📝 *Добавление нового мероприятия*\n\n"
+        "Отправьте данные в формате:\n\n"
+        "`Название, Описание, Дата (ГГГГ-ММ-ДД), Время (ЧЧ:ММ), Место, Макс. участников`\n\n"
+        "*Пример:*\n"
+        "`Уборка парка, Субботник в центральном парке, 2024-04-10, 14:00, Центральный парк, 30`\n\n"
+        "📌 *Примечания:*\n"
+        "- Дата в формате ГГГГ-ММ-ДД\n"
+        "- Время в формате ЧЧ:ММ\n"
+        "- Макс. участников: число или 0 для неограниченного\n"
+        "- Описание не обязательно\n\n"
+        "Для отмены отправьте /cancel",
+        parse_mode='Markdown'
+    )
+    
+    context.user_data['adding_event'] = True
+
+async def admin_list_events_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик кнопки списка мероприятий"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    # Без аргументов - первая страница, иначе номер и ключ последнего мероприятия
+    cursor, number = None, 0
+    if context.args:
+        number, *cursor = context.args
+        cursor = tuple(cursor)
+    
+    text, last, next_number = await get_admin_events_report(cursor, number)
+    
+    await edit_message(
+        query,
+        text,
+        reply_markup=admin_events_report_markup(last, next_number, cursor is None),
+        parse_mode='Markdown'
+    )
+
+async def admin_stats_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик кнопки статистики и кнопки «🔄 Пересчитать»"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    stats = await get_stats_snapshot(refresh=callback_action(query.data) == 'admin_stats_refresh')
+    text = await admin_stats_text(stats, context.application)
+    
+    keyboard = [
+        [button("🔄 Пересчитать", 'admin_stats_refresh')],
+        [button("◀️ Назад в админ-панель", 'admin_back')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await edit_message(query, text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def admin_table_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик кнопки скачивания общей таблицы"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    version = await get_table_export_version()
+    cached = export_cache.get('all', version)
+    f = None
+    try:
+        if cached:
+            file_id, rows = cached
+            await context.bot.send_document(
+                chat_id=query.from_user.id,
+                document=file_id,
+                caption=f"📊 Общая таблица волонтеров\nВсего записей: {rows}"
+            )
+        else:
+            table = await open_volunteers_table()
+            if not table:
+                await edit_message(query, "❌ Таблица еще не создана.")
+                return
+            
+            f, rows = table
+            message = await context.bot.send_document(
+                chat_id=query.from_user.id,
+                document=await export_document(f, f'волонтеры_{datetime.now().strftime("%Y-%m-%d")}.csv'),
+                caption=f"📊 Общая таблица волонтеров\nВсего записей: {rows}"
+            )
+            export_cache.put('all', version, (message.document.file_id, rows))
+        
+        # Возвращаемся к админ-панели
+        keyboard = [[button("◀️ Назад в админ-панель", 'admin_back')]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await edit_message(
+            query,
+            "✅ Общая таблица отправлена вам в личные сообщения!",
+            reply_markup=reply_markup
+        )
+        
+        print(f"✅ Общая таблица отправлена админу {ADMIN_ID}")
+    except Exception as e:
+        await edit_message(query, f"❌ Ошибка при отправке таблицы: {e}")
+    finally:
+        if f:
+            f.close()
+
+async def admin_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Возврат в админ-панель"""
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return
+    
+    keyboard = [
+        [button("➕ Добавить мероприятие", 'admin_add_event')],
+        [button("🔧 Управление мероприятиями", 'admin_manage')],
+        [button("📋 Все мероприятия", 'admin_list')],
+        [button("📊 Статистика", 'admin_stats')],
+        [button("📥 Скачать общую таблицу", 'admin_table')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    text = (
+        "👑 *Админ-панель*\n\n"
+        "Выберите действие для управления волонтерскими мероприятиями:"
+    )
+    
+    await edit_message(query, text, reply_markup=reply_markup, parse_mode='Markdown')
+
+# ========== ОБРАБОТЧИК СООБЩЕНИЙ ДЛЯ ДОБАВЛЕНИЯ МЕРОПРИЯТИЙ ==========
+async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обрабатывает сообщения от админа для добавления мероприятий"""
+    # Проверяем, что это админ и он в режиме добавления мероприятия
+    if update.effective_user.id != ADMIN_ID:
+        return
+    
+    if context.user_data.get('adding_event'):
+        await save_new_event(update, context)
+    else:
+        # Если сообщение не связано с добавлением мероприятия, игнорируем
+        pass
+
+# ========== ОБРАБОТЧИК ОШИБОК ==========
+async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик ошибок"""
+    try:
+        raise context.error
+    except Exception as e:
+        print(f"⚠️ Ошибка: {e}")
+        
+        # Отправляем сообщение админу об ошибке
+        if ADMIN_ID:
+            try:
+                await context.bot.send_message(
+                    chat_id=ADMIN_ID,
+                    text=f"⚠️ Ошибка в боте: {type(e).__name__}: {e}"
+                )
+            except:
+                pass
+    
+    return ConversationHandler.END
+
+# ========== ОБРАБОТКА ОБНОВЛЕНИЙ ==========
+# Обновления разных пользователей обрабатываются параллельно, а обновления
+# одного пользователя - строго по очереди: от этого зависят ConversationHandler.
+# Базовый семафор BaseUpdateProcessor берется до нашей очереди, поэтому он
+# сделан неограниченным, а лимит UPDATE_CONCURRENCY применяется уже после
+# очереди пользователя - ждущие обновления не занимают общие места.
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка с сохранением порядка внутри пользователя"""
+    
+    def __init__(self, concurrency, user_queue_limit):
+        # BaseUpdateProcessor берет свой семафор до вызова do_process_update:
+        # с лимитом concurrency ждущие своей очереди обновления одного
+        # пользователя занимали бы места других. Настоящий лимит - self.slots
+        super().__init__(max_concurrent_updates=2 ** 30)
+        self.concurrency = concurrency
+        self.user_queue_limit = user_queue_limit
+        self.slots = asyncio.Semaphore(concurrency)
+        self.user_locks = {}
+        self.user_waiting = {}
+        self.dropped = 0
+    
+    async def do_process_update(self, update, coroutine):
+        key = None
+        if isinstance(update, Update):
+            if update.effective_user:
+                key = update.effective_user.id
+            elif update.effective_chat:
+                key = update.effective_chat.id
+        
+        if key is None:
+            async with self.slots:
+                await coroutine
+            return
+        
+        waiting = self.user_waiting.get(key, 0)
+        if waiting >= self.user_queue_limit:
+            # Пользователь прислал слишком много обновлений подряд
+            coroutine.close()
+            self.dropped += 1
+            print(f"⚠️ Очередь пользователя {key} переполнена, обновление пропущено (всего {self.dropped})")
+            # Иначе кнопка так и останется с часиками
+            if update.callback_query:
+                try:
+                    await update.callback_query.answer("⏳ Слишком много нажатий, подождите немного")
+                except TelegramError as e:
+                    print(f"⚠️ Не удалось ответить на пропущенное нажатие {key}: {e}")
+            return
+        
+        self.user_waiting[key] = waiting + 1
+        user_states.touch(key)
+        lock = self.user_locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                async with self.slots:
+                    await coroutine
+        finally:
+            self.user_waiting[key] -= 1
+            if not self.user_waiting[key]:
+                del self.user_waiting[key]
+                del self.user_locks[key]
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+update_processor = PerUserUpdateProcessor(UPDATE_CONCURRENCY, USER_QUEUE_LIMIT)
+
+# ========== СОХРАНЕНИЕ СОСТОЯНИЯ ДИАЛОГОВ ==========
+# context.user_data и состояния ConversationHandler хранятся в той же базе
+# (таблицы user_state и conversation_state), поэтому пользователь, начавший
+# запись или редактирование, продолжает с того же шага после перезапуска.
+# Значения сравниваются с тем, что уже лежит в базе, и записываются только
+# изменившиеся ключи - все вместе одной транзакцией. user_data пользователя
+# читается из базы при первом его обновлении после запуска, а не целиком при
+# старте. Состояний диалогов немного (только незавершенные), они загружаются сразу.
+# Значения сохраняются в JSON, поэтому в user_data кладем только числа и строки.
+@db_read
+def load_user_state(conn, user_id):
+    """Сохраненные ключи user_data пользователя: {ключ: JSON}"""
+    return dict(conn.execute('SELECT key, value FROM user_state WHERE user_id = ?', (user_id,)))
+
+@db_read
+def load_conversation_states(conn, name):
+    """Незавершенные диалоги ConversationHandler: {ключ: состояние}"""
+    cursor = conn.execute('SELECT key, state FROM conversation_state WHERE name = ?', (name,))
+    return {tuple(json.loads(key)): json.loads(state) for key, state in cursor}
+
+@db_write
+def save_state_changes(conn, user_drops, user_changes, conversation_changes):
+    """Записывает накопленные изменения; None - удалить ключ"""
+    conn.executemany('DELETE FROM user_state WHERE user_id = ?', [(user_id,) for user_id in user_drops])
+    conn.executemany(
+        'INSERT OR REPLACE INTO user_state (user_id, key, value) VALUES (?, ?, ?)',
+        [(user_id, key, value) for (user_id, key), value in user_changes.items() if value is not None]
+    )
+    conn.executemany(
+        'DELETE FROM user_state WHERE user_id = ? AND key = ?',
+        [key for key, value in user_changes.items() if value is None]
+    )
+    conn.executemany(
+        'INSERT OR REPLACE INTO conversation_state (name, key, state) VALUES (?, ?, ?)',
+        [(name, key, state) for (name, key), state in conversation_changes.items() if state is not None]
+    )
+    conn.executemany(
+        'DELETE FROM conversation_state WHERE name = ? AND key = ?',
+        [key for key, state in conversation_changes.items() if state is None]
+    )
+
+class SQLitePersistence(BasePersistence):
+    """BasePersistence для user_data и диалогов поверх базы бота"""
+    
+    def __init__(self, update_interval):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.saved = {}  # user_id -> {ключ: JSON} - что лежит в базе у загруженных пользователей
+        self.user_drops = set()
+        self.user_changes = {}  # (user_id, ключ) -> JSON или None
+        self.conversation_changes = {}  # (имя, ключ) -> JSON состояния или None
+        self.write_lock = asyncio.Lock()
+        self.write_task = None
+        self.loads = 0
+        self.rows_written = 0
+        self.last_write_ms = 0.0
+    
+    @property
+    def pending(self):
+        return len(self.user_drops) + len(self.user_changes) + len(self.conversation_changes)
+    
+    def schedule_write(self):
+        """Запись начнется, когда PTB передаст все изменения текущего цикла"""
+        if self.write_task is None or self.write_task.done():
+            self.write_task = asyncio.create_task(self.write_pending())
+    
+    async def write_pending(self):
+        async with self.write_lock:
+            while self.pending:
+                user_drops, self.user_drops = self.user_drops, set()
+                user_changes, self.user_changes = self.user_changes, {}
+                conversation_changes, self.conversation_changes = self.conversation_changes, {}
+                started = time_module.perf_counter()
+                try:
+                    await save_state_changes(user_drops, user_changes, conversation_changes)
+                except Exception as e:
+                    # Вернем изменения в очередь; более новые значения важнее
+                    print(f"❌ Ошибка сохранения состояния диалогов: {e}")
+                    self.user_drops |= user_drops
+                    for key, value in user_changes.items():
+                        self.user_changes.setdefault(key, value)
+                    for key, value in conversation_changes.items():
+                        self.conversation_changes.setdefault(key, value)
+                    return
+                self.last_write_ms = (time_module.perf_counter() - started) * 1000
+                self.rows_written += len(user_drops) + len(user_changes) + len(conversation_changes)
+    
+    async def get_user_data(self):
+        # user_data загружается по пользователю в refresh_user_data
+        return {}
+    
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self.saved:
+            return
+        self.saved[user_id] = saved = await load_user_state(user_id)
+        self.loads += 1
+        for key, value in saved.items():
+            user_data.setdefault(key, json.loads(value))
+    
+    async def update_user_data(self, user_id, data):
+        saved = self.saved.get(user_id)
+        if saved is None:
+            # Пользователь не загружался - сохраненное в базе заменяется целиком
+            saved = {}
+            self.user_drops.add(user_id)
+        encoded = {str(key): json.dumps(value, ensure_ascii=False) for key, value in data.items()}
+        for key, value in encoded.items():
+            if saved.get(key) != value:
+                self.user_changes[(user_id, key)] = value
+        for key in saved.keys() - encoded.keys():
+            self.user_changes[(user_id, key)] = None
+        self.saved[user_id] = encoded
+        if self.pending:
+            self.schedule_write()
+    
+    async def drop_user_data(self, user_id):
+        saved = self.saved.pop(user_id, None)
+        pending = [key for key in self.user_changes if key[0] == user_id]
+        for key in pending:
+            del self.user_changes[key]
+        if saved == {} and not pending:
+            # В базе у пользователя ничего нет (частый случай при вытеснении из памяти)
+            return
+        self.user_drops.add(user_id)
+        self.schedule_write()
+    
+    def unload_user(self, user_id):
+        """Забывает пользователя, выгруженного из памяти; его строки в базе остаются"""
+        self.saved.pop(user_id, None)
+    
+    def drop_user_keys(self, user_id, keys):
+        """Удаляет ключи user_data прямо в базе - для пользователя, которого нет в памяти"""
+        for key in keys:
+            self.user_changes[(user_id, key)] = None
+        self.schedule_write()
+    
+    async def get_conversations(self, name):
+        return await load_conversation_states(name)
+    
+    async def update_conversation(self, name, key, new_state):
+        state = None if new_state is None else json.dumps(new_state)
+        self.conversation_changes[(name, json.dumps(list(key)))] = state
+        self.schedule_write()
+    
+    async def flush(self):
+        if self.write_task is not None:
+            await self.write_task
+        await self.write_pending()
+    
+    # chat_data, bot_data и callback_data бот не использует
+    async def get_chat_data(self):
+        return {}
+    
+    async def get_bot_data(self):
+        return {}
+    
+    async def get_callback_data(self):
+        return None
+    
+    async def update_chat_data(self, chat_id, data):
+        pass
+    
+    async def update_bot_data(self, data):
+        pass
+    
+    async def update_callback_data(self, data):
+        pass
+    
+    async def drop_chat_data(self, chat_id):
+        pass
+    
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+    
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+state_persistence = SQLitePersistence(PERSISTENCE_INTERVAL)
+
+# ========== ПАМЯТЬ СОСТОЯНИЯ ПОЛЬЗОВАТЕЛЕЙ ==========
+# PTB держит user_data каждого, кто хоть раз нажал кнопку, а брошенные диалоги
+# (нажал «Записаться» и не прислал комментарий) не завершаются никогда.
+# Раз в STATE_SWEEP_INTERVAL секунд:
+#   - диалоги, в которых пользователь молчит дольше CONVERSATION_TIMEOUT,
+#     завершаются, ключи диалога удаляются, пользователю приходит сообщение;
+#   - user_data пользователей вне диалогов, молчащих дольше USER_STATE_IDLE,
+#     выгружается из памяти, а сверх USER_STATE_MAX - самые давние. Из базы
+#     оно не удаляется: вернувшийся пользователь получит его обратно.
+# Свой таймер вместо conversation_timeout: для него нужен JobQueue (APScheduler),
+# а его задачи не переживают перезапуск, в отличие от сохраненных диалогов.
+CONVERSATION_TIMEOUT = float(os.environ.get('CONVERSATION_TIMEOUT', '900'))
+USER_STATE_IDLE = float(os.environ.get('USER_STATE_IDLE', '1800'))
+USER_STATE_MAX = int(os.environ.get('USER_STATE_MAX', '10000'))
+STATE_SWEEP_INTERVAL = float(os.environ.get('STATE_SWEEP_INTERVAL', '60'))
+
+# Ключи user_data незавершенных действий (их же сбрасывает /cancel)
+FLOW_KEYS = ('adding_event', 'editing_event_id', 'editing_field', 'registering_event_id')
+
+# Сообщение об истекшем действии: (текст, кнопки)
+FLOW_EXPIRED = {
+    'register': ("⌛ Запись не завершена: комментарий так и не пришел.\n\n"
+                 "Чтобы записаться, выберите мероприятие заново.", MAIN_MENU_MARKUP),
+    'edit_info': ("⌛ Заполнение данных отменено: ответа не было слишком долго.\n\n"
+                  "Начните заново через «👤 Мои данные».", MAIN_MENU_MARKUP),
+    'edit_event': ("⌛ Редактирование мероприятия отменено по таймауту. Начните заново: /admin", None),
+    'add_event': ("⌛ Добавление мероприятия отменено по таймауту. Начните заново: /admin", None),
+}
+
+def user_state_size(user_data):
+    """Число пользователей с user_data в памяти и примерный объем в байтах"""
+    total = 0
+    for data in user_data.values():
+        total += sys.getsizeof(data)
+        for key, value in data.items():
+            total += sys.getsizeof(key) + sys.getsizeof(value)
+    return len(user_data), total
+
+def end_conversation(handler, key):
+    """Завершает диалог вне его обработчиков.
+    
+    Публичного способа в PTB нет; так же диалог завершает его conversation_timeout.
+    """
+    handler._update_state(ConversationHandler.END, key)
+
+class UserStateJanitor:
+    """Таймауты диалогов и вытеснение user_data давно молчащих пользователей"""
+    
+    def __init__(self):
+        self.activity = OrderedDict()  # user_id -> время последнего обновления, старые в начале
+        self.conversations = []
+        self.expired = 0
+        self.evicted = 0
+    
+    def watch(self, handler):
+        """Добавляет ConversationHandler под таймаут"""
+        self.conversations.append(handler)
+        return handler
+    
+    def touch(self, user_id):
+        self.activity[user_id] = time_module.monotonic()
+        self.activity.move_to_end(user_id)
+    
+    def start(self, application):
+        return asyncio.create_task(self.run(application))
+    
+    async def run(self, application):
+        while True:
+            try:
+                await asyncio.sleep(STATE_SWEEP_INTERVAL)
+                await self.sweep(application)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка очистки состояния пользователей: {e}")
+    
+    async def sweep(self, application):
+        now = time_module.monotonic()
+        in_flow = set()
+        
+        for handler in self.conversations:
+            for key in list(handler._conversations):
+                # Ключ диалога - (chat_id, user_id). После перезапуска время отсчитывается от первой проверки
+                user_id = key[-1]
+                seen = self.activity.setdefault(user_id, now)
+                if now - seen < CONVERSATION_TIMEOUT:
+                    in_flow.add(user_id)
+                    continue
+                end_conversation(handler, key)
+                await self.expire(application, user_id, key[0], handler.name)
+        
+        # Добавление мероприятия кнопкой идет без ConversationHandler
+        admin_data = application.user_data.get(ADMIN_ID)
+        if admin_data and admin_data.get('adding_event') and ADMIN_ID not in in_flow:
+            if now - self.activity.get(ADMIN_ID, now) >= CONVERSATION_TIMEOUT:
+                await self.expire(application, ADMIN_ID, ADMIN_ID, 'add_event')
+        
+        # Самые давние - в начале activity; того, кто писал в последнюю минуту, не трогаем
+        victims = []
+        resident = len(self.activity)
+        for user_id, seen in self.activity.items():
+            idle = now - seen
+            if idle < STATE_SWEEP_INTERVAL or (idle < USER_STATE_IDLE and resident - len(victims) <= USER_STATE_MAX):
+                break
+            if user_id not in in_flow:
+                victims.append(user_id)
+        
+        # application.drop_user_data удалил бы и строки в базе, поэтому словарь
+        # убирается только из памяти. Кого PTB еще не передал в persistence,
+        # выгрузим при следующей проверке - иначе он сохранил бы пустой словарь
+        for user_id in victims:
+            if user_id in application._user_ids_to_be_updated_in_persistence:
+                continue
+            del self.activity[user_id]
+            application._user_data.pop(user_id, None)
+            if isinstance(application.persistence, SQLitePersistence):
+                application.persistence.unload_user(user_id)
+            self.evicted += 1
+    
+    async def expire(self, application, user_id, chat_id, flow):
+        """Удаляет ключи брошенного действия и сообщает об этом пользователю"""
+        data = application.user_data.get(user_id)
+        if data is not None:
+            for key in FLOW_KEYS:
+                data.pop(key, None)
+            application.mark_data_for_update_persistence(user_ids=user_id)
+        elif isinstance(application.persistence, SQLitePersistence):
+            # После перезапуска user_data загружается при первом обновлении
+            # пользователя - молчащему ключи действия удаляются прямо в базе
+            application.persistence.drop_user_keys(user_id, FLOW_KEYS)
+        self.expired += 1
+        
+        if flow not in FLOW_EXPIRED:
+            return
+        text, reply_markup = FLOW_EXPIRED[flow]
+        try:
+            await application.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+        except TelegramError as e:
+            print(f"⚠️ Не удалось сообщить {user_id} об истекшем действии: {e}")
+
+user_states = UserStateJanitor()
+
+# ========== ЗАПУСК И ОСТАНОВКА ==========
+background_tasks = []
+
+async def on_startup(application: Application):
+    """Запускает фоновые задачи"""
+    users = await load_known_users()
+    print(f"✅ Загружено пользователей: {users}")
+    registrations = await load_membership()
+    print(f"✅ Загружен индекс записей: {registrations}")
+    
+    # Рассылка продолжает неотправленные после перезапуска сообщения
+    background_tasks.append(outbox_worker.start(application.bot))
+    if REMINDER_HOURS > 0:
+        background_tasks.append(reminder_scheduler.start())
+    background_tasks.append(user_states.start(application))
+    
+    if not TABLE_FROM_DB:
+        csv_writer.start()
+        background_tasks.append(asyncio.create_task(csv_compactor_loop()))
+
+async def on_shutdown(application: Application):
+    """Останавливает фоновые задачи и закрывает соединения с базой"""
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    
+    # Дописываем строки из очереди до применения журнала
+    await csv_writer.stop()
+    
+    # Применяем оставшийся журнал, чтобы таблица была актуальной после остановки
+    if not TABLE_FROM_DB:
+        try:
+            compact_csv_journal_sync()
+        except Exception as e:
+            print(f"❌ Ошибка применения журнала CSV: {e}")
+    
+    if db_pool:
+        db_pool.close()
+    db_executor.shutdown(wait=True)
+    print("🛑 Соединения с базой данных закрыты")
+
+# ========== РЕЖИМ WEBHOOK ==========
+# Небольшой HTTP сервер на asyncio: POST на WEBHOOK_PATH с правильным
+# X-Telegram-Bot-Api-Secret-Token кладет обновление в application.update_queue,
+# GET /healthz отвечает, что процесс жив, GET /readyz - что бот принимает
+# обновления. Обновления можно проверить локально, отправив записанный JSON:
+#   curl -H 'X-Telegram-Bot-Api-Secret-Token: ...' -d @update.json localhost:8080/telegram
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 408: 'Request Timeout',
+               413: 'Payload Too Large', 431: 'Request Header Fields Too Large', 503: 'Service Unavailable'}
+
+class HttpError(Exception):
+    """Запрос нельзя обработать: ответить кодом status и закрыть соединение"""
+    
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+async def read_http_request(reader, request_line):
+    """Читает заголовки и тело запроса. Возвращает (метод, путь, версия, заголовки, тело)"""
+    try:
+        method, target, version = request_line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400)
+    
+    headers = {}
+    header_bytes = 0
+    while True:
+        try:
+            line = await reader.readline()
+        except ValueError:
+            # Строка длиннее буфера (limit сервера)
+            raise HttpError(431)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        header_bytes += len(line)
+        if len(headers) >= WEBHOOK_MAX_HEADERS or header_bytes > WEBHOOK_MAX_HEADER_BYTES:
+            raise HttpError(431)
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        length = -1
+    if length < 0:
+        raise HttpError(400)
+    if length > WEBHOOK_MAX_BODY:
+        raise HttpError(413)
+    body = await reader.readexactly(length) if length else b''
+    return method, target, version, headers, body
+
+async def write_http_response(writer, status, body=b'', keep_alive=True):
+    writer.write(
+        f"HTTP/1.1 {status} {HTTP_STATUS[status]}\r\n"
+        f"Content-Type: text/plain; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+
+async def handle_webhook_request(application, method, path, headers, body):
+    """Обрабатывает один запрос. Возвращает (код, тело)"""
+    if method == 'GET' and path == '/healthz':
+        return 200, b'ok'
+    if method == 'GET' and path == '/readyz':
+        return (200, b'ready') if application.running else (503, b'starting')
+    if method != 'POST' or path != WEBHOOK_PATH:
+        return 404, b''
+    
+    # Сравниваем байты: compare_digest не принимает строки с символами вне ASCII
+    token = headers.get('x-telegram-bot-api-secret-token', '').encode('utf-8')
+    if not WEBHOOK_SECRET or not hmac.compare_digest(token, WEBHOOK_SECRET.encode('utf-8')):
+        return 403, b''
+    
+    try:
+        update = Update.de_json(json.loads(body), application.bot)
+    except Exception as e:
+        print(f"⚠️ Неверное обновление в webhook: {e}")
+        return 400, b''
+    
+    await application.update_queue.put(update)
+    return 200, b''
+
+# Открытые соединения: при остановке закрываются, не дожидаясь клиента
+webhook_connections = set()
+
+async def serve_webhook_connection(application, reader, writer):
+    """Обслуживает одно соединение (с поддержкой keep-alive)"""
+    webhook_connections.add(writer)
+    try:
+        while True:
+            # Простаивающее соединение закрывается, а запрос должен прийти
+            # целиком за WEBHOOK_READ_TIMEOUT: медленный клиент не держит память
+            try:
+                request_line = await asyncio.wait_for(reader.readline(), WEBHOOK_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            if not request_line:
+                break
+            
+            try:
+                method, target, version, headers, body = await asyncio.wait_for(
+                    read_http_request(reader, request_line), WEBHOOK_READ_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                await write_http_response(writer, 408, keep_alive=False)
+                break
+            except HttpError as e:
+                await write_http_response(writer, e.status, keep_alive=False)
+                break
+            
+            status, response = await handle_webhook_request(
+                application, method, target.split('?')[0], headers, body
+            )
+            keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+            await write_http_response(writer, status, response, keep_alive)
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+        # Оборванный запрос или строка длиннее буфера StreamReader
+        pass
+    finally:
+        webhook_connections.discard(writer)
+        writer.close()
+
+async def run_webhook(application):
+    """Запускает бота в режиме webhook и ждет сигнала остановки"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+    
+    server = await asyncio.start_server(
+        functools.partial(serve_webhook_connection, application),
+        WEBHOOK_LISTEN, WEBHOOK_PORT, limit=WEBHOOK_MAX_HEADER_BYTES
+    )
+    print(f"🌐 Webhook сервер слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    
+    if WEBHOOK_URL:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        print(f"✅ Webhook установлен: {WEBHOOK_URL}{WEBHOOK_PATH}")
+    
+    try:
+        await stop.wait()
+    finally:
+        # Webhook не удаляется: пока бот перезапускается, Telegram копит
+        # обновления и доставит их новому процессу
+        server.close()
+        for writer in list(webhook_connections):
+            writer.close()
+        await server.wait_closed()
+        await application.stop()
+        # Как в run_polling: сначала shutdown (последнее сохранение состояния
+        # диалогов в базу), и только потом закрываются пул соединений и потоки БД
+        await application.shutdown()
+        await on_shutdown(application)
+        print("🛑 Webhook сервер остановлен")
+
+# ========== ОСНОВНАЯ ФУНКЦИЯ ==========
+def main():
+    print("=" * 50)
+    print("🤖 Волонтерский бот запускается...")
+    print(f"👑 Админ ID: {ADMIN_ID}")
+    print(f"💾 База данных: {DB_NAME}")
+    print(f"📊 Таблица волонтеров: {'из базы данных' if TABLE_FROM_DB else CSV_FILE}")
+    print(f"📡 Режим: {BOT_MODE}")
+    print("=" * 50)
+    
+    # Инициализируем БД и CSV
+    init_db()
+    if not TABLE_FROM_DB:
+        init_csv()
+    
+    # Создаем приложение
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(update_processor)
+        .persistence(state_persistence)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    
+    # Добавляем обработчик ошибок
+    application.add_error_handler(error_handler)
+    
+    # Создаем ConversationHandler для редактирования данных
+    edit_info_handler = user_states.watch(ConversationHandler(
+        name='edit_info',
+        persistent=True,
+        entry_points=[callback_router.entry_point('edit_info', edit_info_start)],
+        states={
+            EDITING_INFO: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_user_info)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel_command)]
+    ))
+    
+    # Создаем ConversationHandler для добавления мероприятий (из команд)
+    add_event_handler = user_states.watch(ConversationHandler(
+        name='add_event',
+        persistent=True,
+        entry_points=[CommandHandler('addevent', admin_add_event)],
+        states={
+            ADDING_EVENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_new_event)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel_command)]
+    ))
+    
+    # Создаем ConversationHandler для редактирования мероприятий
+    edit_event_handler = user_states.watch(ConversationHandler(
+        name='edit_event',
+        persistent=True,
+        entry_points=[callback_router.entry_point('edit_field', edit_event_field_start)],
+        states={
+            EDIT_EVENT_DETAILS: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_event_field)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel_command)]
+    ))
+    
+    # Создаем ConversationHandler для записи с комментарием
+    register_handler = user_states.watch(ConversationHandler(
+        name='register',
+        persistent=True,
+        entry_points=[callback_router.entry_point('register', register_for_event)],
+        states={
+            ADDING_COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_registration_with_comment)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel_command)]
+    ))
+    
+    # Регистрируем обработчики команд
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("admin", admin_panel))
+    application.add_handler(CommandHandler("events", admin_list_events))
+    application.add_handler(CommandHandler("table", admin_table))
+    application.add_handler(CommandHandler("stats", admin_stats))
+    application.add_handler(CommandHandler("recount", admin_check_counters))
+    
+    # Регистрируем ConversationHandlers
+    application.add_handler(edit_info_handler)
+    application.add_handler(add_event_handler)
+    application.add_handler(edit_event_handler)
+    application.add_handler(register_handler)
+    
+    # Действия кнопок (ОБЫЧНЫЕ)
+    callback_router.add('list_events', list_events)
+    callback_router.add('list_page', list_events)
+    callback_router.add('event', event_detail)
+    callback_router.add('cancel_reg', cancel_registration)
+    callback_router.add('my_info', my_info)
+    callback_router.add('my_registrations', my_registrations)
+    callback_router.add('main_menu', main_menu)
+    
+    # Админ кнопки
+    callback_router.add('admin_add_event', admin_add_event_btn)
+    callback_router.add('admin_manage', admin_manage_events)
+    callback_router.add('admin_filter', admin_manage_events)
+    callback_router.add('admin_page', admin_manage_events)
+    callback_router.add('admin_list', admin_list_events_btn)
+    callback_router.add('admin_report', admin_list_events_btn)
+    callback_router.add('admin_stats', admin_stats_btn)
+    callback_router.add('admin_stats_refresh', admin_stats_btn)
+    callback_router.add('admin_table', admin_table_btn)
+    callback_router.add('admin_back', admin_back)
+    
+    # ОТДЕЛЬНЫЕ действия для управления мероприятиями
+    callback_router.add('manage', manage_event)
+    callback_router.add('toggle_reg', toggle_registration_handler)
+    callback_router.add('toggle_active', toggle_active_handler)
+    callback_router.add('download', download_event_handler)
+    callback_router.add('delete', delete_event_handler)
+    callback_router.add('confirm_delete', confirm_delete_handler)
+    callback_router.add('view', view_event_participants)
+    callback_router.add('view_page', view_event_participants)
+    callback_router.add('edit_event', edit_event_start)
+    
+    # Все остальные кнопки - один обработчик после ConversationHandlers
+    callback_router.check()
+    application.add_handler(CallbackQueryHandler(callback_router.dispatch))
+    
+    # Обработчик сообщений для добавления мероприятий из кнопок
+    application.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND & filters.User(user_id=ADMIN_ID),
+        handle_admin_message
+    ))
+    
+    print("✅ Бот запущен и ожидает сообщений...")
+    print("=" * 50)
+    
+    # Запускаем бота с параметрами для Railway
+    try:
+        if BOT_MODE == 'webhook':
+            print("🔄 Запускаем бота в режиме webhook...")
+            asyncio.run(run_webhook(application))
+        else:
+            # run_polling сам удаляет webhook, если он был установлен
+            print("🔄 Запускаем бота с параметрами для Railway...")
+            application.run_polling(
+                drop_pending_updates=True,
+                allowed_updates=Update.ALL_TYPES,
+                close_loop=False
+            )
+    except KeyboardInterrupt:
+        print("🛑 Бот остановлен пользователем")
+    except Exception as e:
+        print(f"❌ Критическая ошибка: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
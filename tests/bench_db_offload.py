@@ -0,0 +1,82 @@
+"""Задержка цикла событий, пока идут тяжелые запросы к базе (user-001).
+
+Несколько админских выгрузок по большой базе выполняются одновременно,
+а фоновая задача каждую миллисекунду отмечает, насколько она опоздала -
+так же опаздывал бы ответ на нажатие кнопки любого пользователя.
+Сравниваются два режима: запросы в пуле потоков БД (как в боте) и те же
+функции, вызванные прямо в цикле событий (как было до переноса).
+
+    python tests/bench_db_offload.py [--registrations 50000] [--exports 8]
+"""
+import argparse
+import asyncio
+import time
+
+from harness import bot, percentile
+
+
+def fill_database(events, registrations):
+    bot.init_db()
+    with bot.db_pool.write() as conn:
+        conn.executemany(
+            'INSERT INTO users (telegram_id, full_name, group_name, phone_number) VALUES (?, ?, ?, ?)',
+            ((user_id, f'Волонтер {user_id}', 'Группа', '+70000000000') for user_id in range(1, registrations + 1))
+        )
+        conn.executemany(
+            'INSERT INTO events (title, description, date, time, location, max_volunteers) VALUES (?, ?, ?, ?, ?, 0)',
+            ((f'Мероприятие {i}', 'Описание', '2099-01-01', '10:00', 'Парк') for i in range(events))
+        )
+        conn.executemany(
+            'INSERT INTO registrations (user_id, event_id, comment) VALUES (?, ?, ?)',
+            ((user_id, user_id % events + 1, 'комментарий') for user_id in range(1, registrations + 1))
+        )
+
+
+async def measure(exports, offload):
+    lags = []
+    done = asyncio.Event()
+    
+    async def ticker():
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            expected = loop.time() + 0.001
+            await asyncio.sleep(0.001)
+            lags.append((loop.time() - expected) * 1000)
+    
+    async def export():
+        if offload:
+            f, rows = await bot.build_volunteers_table()
+        else:
+            f, rows = bot.build_volunteers_table.sync()
+        f.close()
+        await asyncio.sleep(0)
+    
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await asyncio.gather(*(export() for _ in range(exports)))
+    wall = time.perf_counter() - started
+    done.set()
+    await task
+    return wall, lags
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--registrations', type=int, default=50000)
+    parser.add_argument('--exports', type=int, default=8)
+    args = parser.parse_args()
+    
+    fill_database(args.events, args.registrations)
+    print(f"База: {args.events} мероприятий, {args.registrations} записей; одновременных выгрузок: {args.exports}")
+    for offload in (False, True):
+        wall, lags = asyncio.run(measure(args.exports, offload))
+        mode = 'пул потоков БД' if offload else 'в цикле событий'
+        print(f"{mode:>16}: {wall:.2f} с, задержка цикла p50 {percentile(lags, 0.5):.1f} мс, "
+              f"p99 {percentile(lags, 0.99):.1f} мс, макс. {max(lags):.1f} мс")
+    bot.db_pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Память и время выгрузки таблицы участников (user-008).
+
+На одно мероприятие записывается --participants волонтеров, затем таблица
+собирается так же, как по кнопке админа, и готовится к отправке. Для каждой
+стадии - время и пик памяти по tracemalloc. Для сравнения та же таблица
+собирается "в лоб": fetchall и строка CSV целиком в памяти.
+
+    python tests/bench_export.py [--participants 10000] [--spool-kb 1024]
+"""
+import argparse
+import csv
+import io
+import time
+import tracemalloc
+
+from bench_db_offload import fill_database
+from harness import bot
+
+
+def traced(func, *args):
+    """(результат, мс, пик памяти в байтах)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = (time.perf_counter() - started) * 1000
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def export_in_memory(event_id):
+    """Выгрузка без буфера и порций: все строки и весь файл в памяти"""
+    with bot.db_pool.read() as conn:
+        rows = conn.execute('''
+            SELECT registrations.id, registrations.registration_date, users.full_name, users.group_name,
+                   users.birth_date, users.phone_number, users.username, registrations.comment
+            FROM registrations JOIN users ON registrations.user_id = users.telegram_id
+            WHERE registrations.event_id = ? ORDER BY registrations.registration_date
+        ''', (event_id,)).fetchall()
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(bot.EVENT_TABLE_HEADER)
+    writer.writerows(rows)
+    return text.getvalue().encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--participants', type=int, default=10_000)
+    parser.add_argument('--spool-kb', type=int, default=1024)
+    args = parser.parse_args()
+    
+    bot.EXPORT_SPOOL_BYTES = args.spool_kb * 1024
+    fill_database(1, args.participants)
+    
+    (f, rows), build_ms, build_peak = traced(bot.get_event_csv.sync, 1)
+    on_disk = f._rolled
+    document, send_ms, send_peak = traced(bot.export_document.sync, f, 'мероприятие.csv')
+    f.close()
+    size = len(document.input_file_content)
+    content, naive_ms, naive_peak = traced(export_in_memory, 1)
+    
+    kb = 1024
+    print(f"участников {rows}, файл {size // kb} КБ ({'во временном файле' if on_disk else 'в памяти'}, "
+          f"порог {args.spool_kb} КБ)")
+    for name, ms, peak in (('сборка таблицы', build_ms, build_peak),
+                           ('подготовка к отправке', send_ms, send_peak),
+                           ('все в памяти', naive_ms, naive_peak)):
+        print(f"  {name:>21}: {ms:5.0f} мс, пик памяти {peak // kb:6} КБ")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Память и скорость индекса записей MembershipIndex (user-015).
+
+База заполняется --registrations записями --users пользователей на
+--events мероприятий, затем индекс загружается, как при запуске бота.
+Память индекса считается через tracemalloc после освобождения строк
+курсора, время - для загрузки и для проверок из обработчиков.
+
+    python tests/bench_membership.py [--registrations 100000] [--users 20000] [--events 200]
+"""
+import argparse
+import time
+import tracemalloc
+
+from harness import bot
+
+
+def fill_database(registrations, users, events):
+    bot.init_db()
+    with bot.db_pool.write() as conn:
+        conn.executemany(
+            'INSERT INTO users (telegram_id, full_name, group_name, phone_number) VALUES (?, ?, ?, ?)',
+            ((user_id, f'Волонтер {user_id}', 'Группа', '+70000000000') for user_id in range(1, users + 1))
+        )
+        conn.executemany(
+            'INSERT INTO events (title, description, date, time, location, max_volunteers) VALUES (?, ?, ?, ?, ?, 0)',
+            ((f'Мероприятие {i}', 'Описание', '2099-01-01', '10:00', 'Парк') for i in range(events))
+        )
+        # Пары (пользователь, мероприятие) без повторов: i-я запись - пользователь i % users
+        conn.executemany(
+            'INSERT INTO registrations (user_id, event_id, comment) VALUES (?, ?, ?)',
+            ((i % users + 1, (i // users * 7 + i) % events + 1, '') for i in range(registrations))
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--registrations', type=int, default=100_000)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--events', type=int, default=200)
+    args = parser.parse_args()
+    
+    fill_database(args.registrations, args.users, args.events)
+    # Строки читаются под tracemalloc: числа в индексе - те же объекты, что в строках
+    tracemalloc.start()
+    rows = bot.db_pool.writer.execute('SELECT id, user_id, event_id FROM registrations').fetchall()
+    index = bot.MembershipIndex()
+    started = time.perf_counter()
+    index.load(rows)
+    load_ms = (time.perf_counter() - started) * 1000
+    del rows
+    footprint = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    
+    started = time.perf_counter()
+    bot.membership = bot.MembershipIndex()
+    count = bot.load_membership.sync()
+    startup_ms = (time.perf_counter() - started) * 1000
+    
+    lookups = 100_000
+    started = time.perf_counter()
+    for i in range(lookups):
+        index.registration_id(i % args.events + 1, i % args.users + 1)
+    lookup_us = (time.perf_counter() - started) / lookups * 1e6
+    
+    checks = 1_000
+    started = time.perf_counter()
+    for user_id in range(1, checks + 1):
+        index.has_registrations(user_id)
+    has_us = (time.perf_counter() - started) / checks * 1e6
+    
+    print(f"записей {count}, пользователей {args.users}, мероприятий {args.events}")
+    print(f"память индекса {footprint / 2 ** 20:.1f} МБ ({footprint / count:.0f} байт на запись)")
+    print(f"загрузка из строк {load_ms:.0f} мс, при запуске вместе с запросом {startup_ms:.0f} мс")
+    print(f"registration_id {lookup_us:.2f} мкс, has_registrations {has_us:.1f} мкс")
+
+
+if __name__ == '__main__':
+    main()
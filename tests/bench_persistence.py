@@ -0,0 +1,87 @@
+"""Стоимость сохранения состояния: SQLitePersistence и PicklePersistence (user-023).
+
+У --users пользователей в памяти по несколько ключей user_data; за цикл
+сохранения (раз в PERSISTENCE_INTERVAL) меняется --changed из них, и PTB
+передает их в update_user_data. Для каждого варианта измеряется время
+цикла целиком и время, на которое занят цикл событий (запись SQLite идет
+в потоке БД, pickle пишется прямо в обработчике). PicklePersistence
+проверяется как по умолчанию (файл переписывается при каждом изменении)
+и с on_flush=True (файл пишется только при остановке - без сохранности).
+
+    python tests/bench_persistence.py [--users 10000] [--changed 10 100] [--cycles 10]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from telegram.ext import PicklePersistence
+
+from harness import bot
+
+
+def user_data(user_id, cycle=0):
+    return {'registering_event_id': user_id % 200, 'editing_field': 'comment', 'cycle': cycle}
+
+
+async def measure(persistence, users, changed, cycles):
+    # Начальное состояние pickle записывается одним разом, а не файлом на пользователя
+    pickle = isinstance(persistence, PicklePersistence)
+    if pickle:
+        on_flush, persistence.on_flush = persistence.on_flush, True
+    for user_id in range(1, users + 1):
+        await persistence.update_user_data(user_id, user_data(user_id))
+    await persistence.flush()
+    if pickle:
+        persistence.on_flush = on_flush
+    
+    wall, blocked = [], []
+    for cycle in range(1, cycles + 1):
+        started = time.perf_counter()
+        for i in range(changed):
+            user_id = (cycle * changed + i) % users + 1
+            await persistence.update_user_data(user_id, user_data(user_id, cycle))
+        blocked.append(time.perf_counter() - started)
+        if isinstance(persistence, bot.SQLitePersistence):
+            await persistence.flush()
+        wall.append(time.perf_counter() - started)
+    return sum(wall) / cycles * 1000, sum(blocked) / cycles * 1000
+
+
+async def run(users, changed, cycles):
+    bot.init_db()
+    results = {}
+    results['SQLite'] = await measure(bot.SQLitePersistence(5), users, changed, cycles)
+    results['pickle'] = await measure(PicklePersistence('state.pickle'), users, changed, cycles)
+    
+    on_flush = PicklePersistence('state-on-flush.pickle', on_flush=True)
+    results['pickle, on_flush'] = await measure(on_flush, users, changed, cycles)
+    started = time.perf_counter()
+    await on_flush.flush()
+    results['pickle, on_flush'] += ((time.perf_counter() - started) * 1000,)
+    
+    bot.db_pool.close()
+    bot.db_pool = None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--changed', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--cycles', type=int, default=10)
+    args = parser.parse_args()
+    
+    for changed in args.changed:
+        os.chdir(tempfile.mkdtemp(prefix='volunteer-bot-'))
+        print(f"пользователей {args.users}, изменилось за цикл {changed}:")
+        for name, (wall, blocked, *flush) in asyncio.run(run(args.users, changed, args.cycles)).items():
+            line = f"  {name:>17}: цикл {wall:8.2f} мс, цикл событий занят {blocked:8.2f} мс"
+            if flush:
+                line += f", запись при остановке {flush[0]:.0f} мс"
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
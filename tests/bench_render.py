@@ -0,0 +1,47 @@
+"""Скорость отрисовки экранов пользователя (user-012).
+
+Сравнивается отрисовка карточки мероприятия и страницы списка заново на
+каждое нажатие (как было до кэша, функция без lru_cache) и с кэшем по
+версии строки каталога, как сейчас в боте.
+
+    python tests/bench_render.py [--seconds 1]
+"""
+import argparse
+import time
+
+from harness import bot
+
+
+def rate(func, args, seconds):
+    calls = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            func(*args)
+        calls += 100
+    return calls / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+    
+    card = (7, 'Субботник в парке *Сокольники*', 'Уборка территории, инвентарь выдадим_на месте',
+            '2099-05-01', '10:00', 'Парк «Сокольники», главный вход', 30, 1, 1, 12)
+    page = tuple(
+        (i, f'Мероприятие_{i} *особое*', '2099-05-01', f'1{i}:00', 'Парк', 30, 'Описание', 18)
+        for i in range(bot.EVENTS_PAGE_SIZE)
+    )
+    
+    for name, render, render_args in (('карточка', bot.render_event_card, (card,)),
+                                      ('список', bot.render_event_list, (page, False, True))):
+        cold = rate(render.__wrapped__, render_args, args.seconds)
+        cached = rate(render, render_args, args.seconds)
+        print(f"{name:>9}: без кэша {cold:10.0f} отрисовок/с, с кэшем {cached:10.0f} отрисовок/с "
+              f"(x{cached / cold:.0f})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Пропускная способность обработки обновлений по пользователям (user-017).
+
+Обработчик имитирует ответ Telegram задержкой --handler-ms. Обновления
+подаются так же, как это делает Application: по задаче на обновление.
+Для каждого числа пользователей печатается скорость обработки и
+проверяется, что обновления одного пользователя обработаны по порядку.
+Для сравнения запускается последовательная обработка PTB по умолчанию.
+
+    python tests/bench_update_processor.py [--updates 400] [--handler-ms 10]
+"""
+import argparse
+import asyncio
+import time
+
+from telegram.ext import SimpleUpdateProcessor
+
+from harness import bot, message_update
+
+
+class FakeApplication:
+    bot = None
+
+
+async def run(processor, updates, handler_ms):
+    seen = {}
+    in_order = True
+    
+    async def handle(update):
+        nonlocal in_order
+        user_id = update.effective_user.id
+        if seen.get(user_id, -1) > update.update_id:
+            in_order = False
+        seen[user_id] = update.update_id
+        await asyncio.sleep(handler_ms / 1000)
+    
+    await processor.initialize()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        asyncio.create_task(processor.process_update(update, handle(update))) for update in updates
+    ))
+    return len(updates) / (time.perf_counter() - started), in_order
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=400)
+    parser.add_argument('--handler-ms', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=bot.UPDATE_CONCURRENCY)
+    args = parser.parse_args()
+    
+    application = FakeApplication()
+    for users in (1, 4, 16, 64):
+        updates = [message_update(application, user_id=i % users + 1, text='/start') for i in range(args.updates)]
+        # Ограничение очереди пользователя не проверяется: все обновления подаются сразу
+        processor = bot.PerUserUpdateProcessor(args.concurrency, args.updates)
+        rate, in_order = asyncio.run(run(processor, updates, args.handler_ms))
+        baseline, _ = asyncio.run(run(SimpleUpdateProcessor(1), updates, args.handler_ms))
+        print(f"пользователей {users:>3}: {rate:7.0f} обн/с (последовательно {baseline:5.0f} обн/с), "
+              f"порядок {'сохранен' if in_order else 'НАРУШЕН'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Webhook и polling: пропускная способность и задержка доставки (user-016).
+
+Заглушка "Telegram" выпускает обновления и доставляет их боту двумя
+способами: POST на встроенный webhook сервер по keep-alive соединениям
+(как Telegram, до --connections параллельно) и ответами на getUpdates
+с длинным опросом, как у run_polling. Сеть до Telegram имитируется
+задержкой --rtt-ms туда и обратно. Задержка считается от появления
+обновления в "Telegram" до вызова обработчика.
+
+    python tests/bench_webhook.py [--updates 2000] [--rate 200] [--rtt-ms 40]
+"""
+import argparse
+import asyncio
+import functools
+import json
+import time
+
+from telegram import Update, User
+from telegram.ext import Application, ExtBot, TypeHandler
+
+from harness import bot, percentile
+
+SECRET = 'bench-secret'
+
+
+def update_json(update_id):
+    user = {'id': update_id % 500 + 1, 'is_bot': False, 'first_name': 'Волонтер'}
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'text': '/start', 'from': user,
+        'chat': {'id': user['id'], 'type': 'private'},
+    }}
+
+
+class FakeTelegram:
+    """Источник обновлений: время появления каждого обновления и очередь для getUpdates"""
+    
+    def __init__(self):
+        self.appeared = {}
+        self.pending = []
+        self.arrived = asyncio.Event()
+    
+    async def produce(self, count, rate, deliver):
+        for update_id in range(1, count + 1):
+            self.appeared[update_id] = time.perf_counter()
+            await deliver(update_json(update_id))
+            if rate:
+                await asyncio.sleep(1 / rate)
+
+
+async def build_application(handled):
+    async def record(update, context):
+        handled[update.update_id] = time.perf_counter()
+    
+    application = (
+        Application.builder().token(bot.TOKEN)
+        .concurrent_updates(bot.PerUserUpdateProcessor(bot.UPDATE_CONCURRENCY, 10 ** 6))
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, record))
+    await application.initialize()
+    application.bot._bot_user = User(1, 'bench_bot', True)
+    await application.start()
+    return application
+
+
+async def wait_all(handled, count):
+    while len(handled) < count:
+        await asyncio.sleep(0.005)
+
+
+async def run_webhook(count, rate, rtt, connections):
+    handled = {}
+    telegram = FakeTelegram()
+    application = await build_application(handled)
+    server = await asyncio.start_server(
+        functools.partial(bot.serve_webhook_connection, application), '127.0.0.1', 0,
+        limit=bot.WEBHOOK_MAX_HEADER_BYTES
+    )
+    port = server.sockets[0].getsockname()[1]
+    outgoing = asyncio.Queue()
+    
+    async def sender():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        while True:
+            body = await outgoing.get()
+            await asyncio.sleep(rtt / 2)
+            writer.write(
+                f"POST {bot.WEBHOOK_PATH} HTTP/1.1\r\nHost: bot\r\n"
+                f"X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            length = 0
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                if line.lower().startswith(b'content-length'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+    
+    async def deliver(update):
+        await outgoing.put(json.dumps(update).encode())
+    
+    senders = [asyncio.create_task(sender()) for _ in range(connections)]
+    started = time.perf_counter()
+    await telegram.produce(count, rate, deliver)
+    await wait_all(handled, count)
+    elapsed = time.perf_counter() - started
+    
+    for task in senders:
+        task.cancel()
+    server.close()
+    for writer in list(bot.webhook_connections):
+        writer.close()
+    await server.wait_closed()
+    await application.stop()
+    await application.shutdown()
+    return elapsed, [handled[i] - telegram.appeared[i] for i in handled]
+
+
+async def run_polling(count, rate, rtt):
+    handled = {}
+    telegram = FakeTelegram()
+    
+    async def get_updates(self, offset=None, timeout=None, **kwargs):
+        await asyncio.sleep(rtt / 2)
+        telegram.pending = [u for u in telegram.pending if offset is None or u['update_id'] >= offset]
+        if not telegram.pending:
+            telegram.arrived.clear()
+            try:
+                await asyncio.wait_for(telegram.arrived.wait(), timeout or 0)
+            except asyncio.TimeoutError:
+                pass
+        batch = telegram.pending[:100]
+        await asyncio.sleep(rtt / 2)
+        return tuple(Update.de_json(u, self) for u in batch)
+    
+    async def delete_webhook(self, *args, **kwargs):
+        return True
+    
+    ExtBot.get_updates = get_updates
+    ExtBot.delete_webhook = delete_webhook
+    
+    async def deliver(update):
+        telegram.pending.append(update)
+        telegram.arrived.set()
+    
+    application = await build_application(handled)
+    await application.updater.initialize()
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+    started = time.perf_counter()
+    await telegram.produce(count, rate, deliver)
+    await wait_all(handled, count)
+    elapsed = time.perf_counter() - started
+    
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    return elapsed, [handled[i] - telegram.appeared[i] for i in handled]
+
+
+def report(name, count, elapsed, latencies):
+    ms = [value * 1000 for value in latencies]
+    print(f"{name:>8}: {count / elapsed:7.0f} обн/с, задержка p50 {percentile(ms, 0.5):6.1f} мс, "
+          f"p99 {percentile(ms, 0.99):6.1f} мс, макс. {max(ms):6.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=200, help='обновлений в секунду; 0 - все сразу')
+    parser.add_argument('--rtt-ms', type=float, default=40)
+    parser.add_argument('--connections', type=int, default=40)
+    args = parser.parse_args()
+    
+    bot.WEBHOOK_SECRET = SECRET
+    rtt = args.rtt_ms / 1000
+    for rate in (args.rate, 0):
+        print(f"Обновлений: {args.updates}, поток: {'все сразу' if not rate else f'{rate:g} в секунду'}, "
+              f"RTT до Telegram {args.rtt_ms:g} мс")
+        report('webhook', args.updates, *asyncio.run(run_webhook(args.updates, rate, rtt, args.connections)))
+        report('polling', args.updates, *asyncio.run(run_polling(args.updates, rate, rtt)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+# bot.py читает токен при импорте; для тестов подойдет любой
+os.environ.setdefault('BOT_TOKEN', '1:test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+
+def reset_state(tmp_path, monkeypatch):
+    """Временный рабочий каталог и пустые кэши бота"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bot, 'event_catalog', bot.EventCatalog())
+    monkeypatch.setattr(bot, 'export_cache', bot.ExportCache())
+    monkeypatch.setattr(bot, 'membership', bot.MembershipIndex())
+    monkeypatch.setattr(bot, 'profile_cache', bot.ProfileCache(100, 0, 'lru'))
+    monkeypatch.setattr(bot, 'known_users', set())
+
+
+@pytest.fixture
+def bot_module():
+    return bot
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Чистая база во временном каталоге и пустые кэши бота"""
+    reset_state(tmp_path, monkeypatch)
+    bot.init_db()
+    yield bot
+    bot.db_pool.close()
+    bot.db_pool = None
+
+
+@pytest.fixture
+def application(tmp_path, monkeypatch):
+    """Приложение, собранное main() без запуска опроса Telegram"""
+    reset_state(tmp_path, monkeypatch)
+    monkeypatch.setattr(bot, 'BOT_MODE', 'polling')
+    monkeypatch.setattr(bot, 'callback_router', bot.CallbackRouter())
+    monkeypatch.setattr(bot, 'user_states', bot.UserStateJanitor())
+    monkeypatch.setattr(bot, 'state_persistence', bot.SQLitePersistence(bot.PERSISTENCE_INTERVAL))
+    captured = []
+    monkeypatch.setattr(Application, 'run_polling', lambda self, **kwargs: captured.append(self))
+    bot.main()
+    yield captured[0]
+    bot.db_pool.close()
+    bot.db_pool = None
@@ -0,0 +1,62 @@
+"""Общая подготовка для нагрузочных скриптов в этом каталоге.
+
+Бот импортируется с тестовым токеном и работает с базой во временном
+каталоге; обращения к Telegram заменены заглушками, поэтому сеть не нужна.
+Скрипты запускаются напрямую, например: python tests/bench_update_processor.py
+"""
+import datetime
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('BOT_TOKEN', '1:test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='volunteer-bot-'))
+
+import bot  # noqa: E402
+from telegram import CallbackQuery, Chat, Message, Update, User  # noqa: E402
+from telegram.ext import Application, ExtBot  # noqa: E402
+
+
+async def _sent(self, *args, **kwargs):
+    return True
+
+
+for cls, names in ((ExtBot, ('initialize', 'shutdown', 'send_message')),
+                   (CallbackQuery, ('answer', 'edit_message_text')),
+                   (Message, ('reply_text',))):
+    for name in names:
+        setattr(cls, name, _sent)
+
+_update_ids = iter(range(1, 2 ** 62))
+
+
+def build_application():
+    """Приложение со всеми обработчиками, собранное main() без запуска опроса"""
+    captured = []
+    Application.run_polling = lambda self, **kwargs: captured.append(self)
+    bot.main()
+    return captured[0]
+
+
+def message_update(application, user_id, text):
+    update_id = next(_update_ids)
+    message = Message(update_id, datetime.datetime.now(), Chat(user_id, 'private'),
+                      from_user=User(user_id, 'Волонтер', False), text=text)
+    message.set_bot(application.bot)
+    return Update(update_id, message=message)
+
+
+def callback_update(application, user_id, data):
+    update_id = next(_update_ids)
+    user = User(user_id, 'Волонтер', False)
+    message = Message(update_id, datetime.datetime.now(), Chat(user_id, 'private'), from_user=user)
+    query = CallbackQuery(str(update_id), user, 'chat', message=message, data=data)
+    for obj in (message, query):
+        obj.set_bot(application.bot)
+    return Update(update_id, callback_query=query)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
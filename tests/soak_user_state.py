@@ -0,0 +1,82 @@
+"""Долгая нагрузка на память состояния пользователей (user-024).
+
+Часы бота подменяются, и за --minutes "минут" приходят --users новых
+пользователей: каждый нажимает кнопку, каждый десятый начинает запись на
+мероприятие и бросает ее. После каждой минуты состояние сохраняется в базу
+и выполняется проход UserStateJanitor. С --no-janitor таймауты и вытеснение
+выключены - так выглядел рост памяти до них.
+
+    python tests/soak_user_state.py [--users 100000] [--minutes 120] [--no-janitor]
+"""
+import argparse
+import asyncio
+import resource
+import time
+
+from harness import bot, build_application, callback_update
+
+
+class Clock:
+    """time_module бота, у которого monotonic() двигается вручную"""
+    now = 0.0
+    
+    def __getattr__(self, name):
+        return getattr(time, name)
+    
+    def monotonic(self):
+        return Clock.now
+
+
+async def soak(application, users, minutes):
+    await application.initialize()
+    event_id = await bot.insert_event('Субботник', '', '2099-01-01', '10:00', 'Парк', 0)
+    per_minute = users // minutes
+    peak = 0
+    sweeps = []
+    started = time.time()
+    
+    # После последнего пользователя еще полчаса без нагрузки: видно, что память освобождается
+    for minute in range(minutes + 30):
+        for i in range(per_minute if minute < minutes else 0):
+            user_id = 10_000 + minute * per_minute + i
+            action = ('register', event_id) if user_id % 10 == 0 else ('main_menu',)
+            update = callback_update(application, user_id, bot.callback_data(*action))
+            await bot.update_processor.do_process_update(update, application.process_update(update))
+        
+        Clock.now += 60
+        await application.update_persistence()
+        await bot.state_persistence.flush()
+        sweep_started = time.perf_counter()
+        await bot.user_states.sweep(application)
+        sweeps.append((time.perf_counter() - sweep_started) * 1000)
+        peak = max(peak, len(application.user_data))
+    
+    resident, resident_bytes = bot.user_state_size(application.user_data)
+    conversations = sum(len(handler._conversations) for handler in bot.user_states.conversations)
+    stored, = bot.db_pool.writer.execute('SELECT COUNT(*) FROM user_state').fetchone()
+    print(f"пользователей {users} за {time.time() - started:.0f} с: в памяти макс. {peak}, в конце {resident} "
+          f"(~{resident_bytes // 1024} КБ), открытых диалогов {conversations}, "
+          f"истекло {bot.user_states.expired}, вытеснено {bot.user_states.evicted}, "
+          f"строк user_state {stored}, самый долгий проход {max(sweeps):.1f} мс, "
+          f"макс. RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} МБ")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--minutes', type=int, default=120)
+    parser.add_argument('--no-janitor', action='store_true')
+    args = parser.parse_args()
+    
+    bot.time_module = Clock()
+    if args.no_janitor:
+        bot.USER_STATE_IDLE = float('inf')
+        bot.USER_STATE_MAX = 10 ** 9
+        bot.CONVERSATION_TIMEOUT = float('inf')
+    
+    application = build_application()
+    asyncio.run(soak(application, args.users, args.minutes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import itertools
+
+import pytest
+from telegram.ext import CallbackQueryHandler, ConversationHandler
+
+import bot
+
+# Примеры значений для каждого типа аргумента, включая самые длинные
+SAMPLES = {
+    bot.callback_int: ['0', '7', '9999999999'],
+    bot.callback_text: ['2099-12-31', '23:59'],
+    bot.PAGE_DIRECTION: ['n', 'p'],
+    bot.EVENT_FIELD: ['title', 'desc', 'date', 'time', 'location', 'max'],
+    bot.ADMIN_FILTER: list(bot.ADMIN_EVENT_FILTERS),
+}
+
+
+def examples(action):
+    """Все сочетания примеров аргументов действия"""
+    code, types = bot.CALLBACK_ACTIONS[action]
+    return list(itertools.product(*(SAMPLES[parse] for parse in types)))
+
+
+def all_callback_data():
+    return [(action, bot.callback_data(action, *args))
+            for action in bot.CALLBACK_ACTIONS for args in examples(action)]
+
+
+def test_every_argument_type_has_samples():
+    types = {parse for code, types in bot.CALLBACK_ACTIONS.values() for parse in types}
+    assert types <= set(SAMPLES)
+
+
+@pytest.mark.parametrize('action', sorted(bot.CALLBACK_ACTIONS))
+def test_round_trip(action):
+    for args in examples(action):
+        data = bot.callback_data(action, *args)
+        parsed_action, parsed = bot.parse_callback_data(data)
+        assert parsed_action == action
+        assert [str(value) for value in parsed] == list(args)
+        assert bot.callback_action(data) == action
+
+
+@pytest.mark.parametrize('action', sorted(bot.CALLBACK_ACTIONS))
+def test_fits_telegram_limit(action):
+    for args in examples(action):
+        assert len(bot.callback_data(action, *args).encode()) <= bot.CALLBACK_DATA_LIMIT
+
+
+def test_codes_are_unique():
+    codes = [code for code, types in bot.CALLBACK_ACTIONS.values()]
+    assert len(codes) == len(set(codes))
+    with pytest.raises(ValueError):
+        bot.build_callback_codes({'a': ('x', ()), 'b': ('x', ())})
+
+
+@pytest.mark.parametrize('data', ['', 'e|1', '0e|1', '1e', '1e|1|2', '1e|abc', '1zz|1', '1lp|n|a|b|c',
+                                  '1af|unknown', '1e|-1', '1ef|name|1', None])
+def test_malformed_data_is_rejected(data):
+    with pytest.raises(bot.CallbackDataError):
+        bot.parse_callback_data(data)
+
+
+def callback_handlers(application):
+    """Все CallbackQueryHandler приложения с пометкой, точка входа ли это диалога"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                for entry in handler.entry_points:
+                    if isinstance(entry, CallbackQueryHandler):
+                        yield handler.name, entry
+            elif isinstance(handler, CallbackQueryHandler):
+                yield None, handler
+
+
+def test_entry_point_patterns_do_not_collide(application):
+    entries = bot.callback_router.entries
+    assert entries == {'edit_info', 'edit_field', 'register'}
+    
+    patterns = [handler.pattern for name, handler in callback_handlers(application) if name]
+    assert len(patterns) == len(entries)
+    
+    for action, data in all_callback_data():
+        matched = [pattern for pattern in patterns if pattern(data)]
+        assert len(matched) == (1 if action in entries else 0), data
+
+
+def test_every_action_has_exactly_one_handler(application):
+    router = bot.callback_router
+    assert set(router.routes) | router.entries == set(bot.CALLBACK_ACTIONS)
+    assert not set(router.routes) & router.entries
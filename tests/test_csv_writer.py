@@ -0,0 +1,91 @@
+import asyncio
+import csv
+
+
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.reader(f))
+
+
+def failing_writes(bot, monkeypatch, failures):
+    """Первые failures вызовов write_csv_rows ничего не пишут"""
+    real = bot.write_csv_rows
+    calls = []
+    
+    def write(batch):
+        calls.append(len(batch))
+        if len(calls) <= failures:
+            return list(batch)
+        return real(batch)
+    
+    monkeypatch.setattr(bot, 'write_csv_rows', write)
+    return calls
+
+
+def test_failed_batch_is_retried_in_order(bot_module, tmp_path, monkeypatch):
+    bot = bot_module
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bot, 'CSV_RETRY_DELAY', 0.01)
+    monkeypatch.setattr(bot, 'CSV_FLUSH_INTERVAL', 0.01)
+    calls = failing_writes(bot, monkeypatch, 2)
+    writer = bot.CsvWriter()
+    
+    async def run():
+        writer.start()
+        await writer.write(bot.CSV_FILE, ['1'])
+        await writer.write(bot.CSV_FILE, ['2'])
+        await asyncio.sleep(0.2)
+        await writer.write(bot.CSV_FILE, ['3'])
+        await writer.stop()
+    
+    asyncio.run(run())
+    assert read_rows(bot.CSV_FILE) == [['1'], ['2'], ['3']]
+    assert writer.rows_written == 3 and writer.retries == 2 and writer.rows_lost == 0
+    assert len(calls) >= 3
+
+
+def test_stop_retries_pending_batch(bot_module, tmp_path, monkeypatch):
+    bot = bot_module
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bot, 'CSV_RETRY_DELAY', 0.01)
+    monkeypatch.setattr(bot, 'CSV_FLUSH_INTERVAL', 10)
+    failing_writes(bot, monkeypatch, 2)
+    writer = bot.CsvWriter()
+    
+    async def run():
+        writer.start()
+        await writer.write(bot.CSV_FILE, ['1'])
+        await writer.stop()
+    
+    asyncio.run(run())
+    assert read_rows(bot.CSV_FILE) == [['1']]
+    assert writer.rows_lost == 0
+
+
+def test_stop_gives_up_after_limited_retries(bot_module, tmp_path, monkeypatch):
+    bot = bot_module
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bot, 'CSV_RETRY_DELAY', 0.01)
+    monkeypatch.setattr(bot, 'CSV_STOP_RETRIES', 2)
+    calls = failing_writes(bot, monkeypatch, 100)
+    writer = bot.CsvWriter()
+    
+    async def run():
+        writer.start()
+        await writer.write(bot.CSV_FILE, ['1'])
+        await writer.stop()
+    
+    asyncio.run(run())
+    assert writer.rows_lost == 1
+    assert len(calls) == 3
+
+
+def test_journal_waits_for_failed_table_rows(bot_module, tmp_path, monkeypatch):
+    """Отмена не попадает в журнал, пока не записана сама запись"""
+    bot = bot_module
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / bot.CSV_FILE).mkdir()
+    
+    failed = bot.write_csv_rows([(bot.CSV_FILE, ['1']), (bot.CSV_JOURNAL_FILE, ['cancel', '1'])])
+    assert failed == [(bot.CSV_FILE, ['1']), (bot.CSV_JOURNAL_FILE, ['cancel', '1'])]
+    assert not (tmp_path / bot.CSV_JOURNAL_FILE).exists()
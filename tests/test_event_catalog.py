@@ -0,0 +1,81 @@
+import asyncio
+
+
+def assert_fresh(db):
+    """Кэш мероприятий совпадает с базой, и проверка не находит устаревших строк"""
+    async def compare():
+        cached = dict(await db.event_catalog.snapshot())
+        actual = {event[0]: event for event in await db.load_events()}
+        return cached, actual, await db.event_catalog.verify()
+    
+    cached, actual, stale = asyncio.run(compare())
+    assert cached == actual
+    assert stale == 0
+
+
+def test_catalog_follows_every_mutation(db):
+    db.insert_user.sync(1, 'Иван', 'ivan')
+    db.insert_user.sync(2, 'Петр', None)
+    assert_fresh(db)
+    
+    event_id = db.insert_event.sync('Субботник', 'Уборка', '2099-01-01', '10:00', 'Парк', 5)
+    other_id = db.insert_event.sync('Концерт', '', '2099-02-01', '18:00', 'Зал', None)
+    assert_fresh(db)
+    
+    for field, value in [('title', 'Большой субботник'), ('description', 'Уборка парка'),
+                         ('date', '2099-01-02'), ('time', '11:00'), ('location', 'Сквер'),
+                         ('max_volunteers', '3')]:
+        db.update_event.sync(event_id, field, value)
+        assert_fresh(db)
+    
+    db.toggle_event_registration.sync(event_id)
+    assert_fresh(db)
+    db.toggle_event_registration.sync(event_id)
+    assert_fresh(db)
+    
+    db.toggle_event_active_status.sync(event_id)
+    assert_fresh(db)
+    db.toggle_event_active_status.sync(event_id)
+    assert_fresh(db)
+    
+    status, data = db.register_volunteer.sync(1, event_id, '')
+    assert status == db.REG_OK
+    assert_fresh(db)
+    db.register_volunteer.sync(2, event_id, '')
+    db.register_volunteer.sync(2, other_id, '')
+    assert_fresh(db)
+    
+    assert db.cancel_registration_db.sync(data[0]) == (1, event_id)
+    assert_fresh(db)
+    
+    # Счетчики испорчены в обход бота и уже попали в кэш: ремонт должен его сбросить
+    db.db_pool.writer.execute('UPDATE events SET registered_count = 42 WHERE id = ?', (event_id,))
+    db.db_pool.writer.execute('UPDATE events SET registered_count = 0 WHERE id = ?', (other_id,))
+    db.event_catalog.invalidate_all()
+    assert_fresh(db)
+    assert [row[0] for row in db.check_registration_counters.sync(repair=True)] == [event_id, other_id]
+    assert_fresh(db)
+    
+    assert db.delete_event.sync(event_id)
+    assert_fresh(db)
+    assert asyncio.run(db.event_catalog.get(event_id)) is None
+
+
+def test_active_list_follows_mutations(db):
+    """Список для записи (отдельный кэш внутри каталога) тоже не устаревает"""
+    db.insert_user.sync(1, 'Иван', 'ivan')
+    event_id = db.insert_event.sync('Субботник', '', '2099-01-01', '10:00', 'Парк', 1)
+    
+    def active_ids():
+        return [event[0] for event in asyncio.run(db.event_catalog.active_events())]
+    
+    assert active_ids() == [event_id]
+    db.register_volunteer.sync(1, event_id, '')
+    assert active_ids() == []
+    db.update_event.sync(event_id, 'max_volunteers', '2')
+    assert active_ids() == [event_id]
+    db.toggle_event_registration.sync(event_id)
+    assert active_ids() == []
+    db.toggle_event_registration.sync(event_id)
+    db.toggle_event_active_status.sync(event_id)
+    assert active_ids() == []
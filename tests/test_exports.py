@@ -0,0 +1,66 @@
+import asyncio
+import csv
+import io
+import os
+import time
+
+from telegram._utils.files import parse_file_input
+
+
+def test_small_event_export_keeps_filename(db):
+    """Выгрузка меньше EXPORT_SPOOL_BYTES остается в памяти без имени файла"""
+    event_id = db.insert_event.sync('Субботник', '', '2099-01-01', '10:00', 'Парк', 5)
+    db.insert_user.sync(1, 'Иван Иванов', 'ivan')
+    assert db.register_volunteer.sync(1, event_id, 'приду')[0] == db.REG_OK
+    
+    f, rows = asyncio.run(db.get_event_csv(event_id))
+    try:
+        assert rows == 1
+        assert f.name is None
+        
+        document = parse_file_input(db.export_document.sync(f, 'мероприятие.csv'))
+        assert document.filename == 'мероприятие.csv'
+        assert 'Иван Иванов' in document.input_file_content.decode('utf-8')
+    finally:
+        f.close()
+
+
+def test_volunteers_table_from_db_keeps_filename(db, monkeypatch):
+    monkeypatch.setattr(db, 'TABLE_FROM_DB', True)
+    event_id = db.insert_event.sync('Субботник', '', '2099-01-01', '10:00', 'Парк', 5)
+    db.insert_user.sync(1, 'Иван Иванов', 'ivan')
+    db.register_volunteer.sync(1, event_id, '')
+    
+    f, rows = asyncio.run(db.open_volunteers_table())
+    try:
+        assert rows == 1
+        document = parse_file_input(db.export_document.sync(f, 'волонтеры.csv'))
+        assert document.filename == 'волонтеры.csv'
+        assert 'Субботник' in document.input_file_content.decode('utf-8')
+    finally:
+        f.close()
+
+
+def test_volunteers_table_shows_local_registration_time(db, monkeypatch):
+    """Время записи из базы (UTC) в таблице местное, как у строк старого CSV"""
+    monkeypatch.setattr(db, 'TABLE_FROM_DB', True)
+    saved_tz = os.environ.get('TZ')
+    os.environ['TZ'] = 'Asia/Yekaterinburg'
+    time.tzset()
+    try:
+        event_id = db.insert_event.sync('Субботник', '', '2099-01-01', '10:00', 'Парк', 5)
+        db.insert_user.sync(1, 'Иван Иванов', 'ivan')
+        db.register_volunteer.sync(1, event_id, '')
+        db.db_pool.writer.execute("UPDATE registrations SET registration_date = '2024-03-01 22:30:00'")
+        
+        f, rows = asyncio.run(db.open_volunteers_table())
+        with f:
+            table = list(csv.reader(io.TextIOWrapper(f, encoding='utf-8', newline='')))
+    finally:
+        if saved_tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = saved_tz
+        time.tzset()
+    
+    assert table[1][1:3] == ['2024-03-02', '03:30:00']
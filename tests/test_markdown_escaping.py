@@ -0,0 +1,158 @@
+import asyncio
+import datetime
+import re
+
+import pytest
+from telegram import CallbackQuery, Chat, Message, Update, User
+from telegram.ext import ExtBot
+
+import bot
+
+USER_ID = 555
+# Нечетное число "*" и "_" внутри жирного заголовка
+TITLES = ['2*2', 'Акция 2*2_[x]', 'snake_case', '*', '_', '`код`', ' пробелы  по краям ']
+TITLE = 'Уборка *парка_ 2*2'
+COMMENT = 'приду с другом_ну и `собакой`'
+ESCAPE = re.compile(r'\\[_*`\[]')
+
+
+def assert_valid_markdown(text):
+    """Разбирает текст как старый Markdown Telegram (parse_mode='Markdown').
+    
+    Сущность открывается "*", "_" или "`" и закрывается тем же символом;
+    экранирование работает только вне сущностей, внутри оно показалось бы
+    как есть (или закрыло бы сущность раньше времени).
+    """
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '\\' and text[i + 1:i + 2] in ('_', '*', '`', '['):
+            i += 2
+        elif char in '_*`':
+            end = text.find(char, i + 1)
+            assert end != -1, f"незакрытая сущность {char!r} на позиции {i}: {text!r}"
+            inner = text[i + 1:end]
+            assert inner.strip(), f"пустая сущность на позиции {i}: {text!r}"
+            assert not ESCAPE.search(inner) and not inner.endswith('\\'), \
+                f"экранирование внутри сущности: {inner!r} в {text!r}"
+            i = end + 1
+        else:
+            assert char != '[', f"неэкранированная ссылка на позиции {i}: {text!r}"
+            i += 1
+
+
+def visible_text(text):
+    """То, что увидит пользователь: без разметки и экранирования"""
+    return re.sub(r'\\([_*`\[])|[_*`]', lambda m: m.group(1) or '', text)
+
+
+@pytest.mark.parametrize('bad', ['*2\\*2*', '*a', '2*2', '**', 'a [link'])
+def test_checker_rejects_broken_markup(bad):
+    with pytest.raises(AssertionError):
+        assert_valid_markdown(bad)
+
+
+@pytest.mark.parametrize('title', TITLES)
+def test_md_entity_keeps_text_and_markup_valid(title):
+    for marker in '*`':
+        text = f"🎯 {bot.md_entity(title, marker)}"
+        assert_valid_markdown(text)
+        assert visible_text(text) == f"🎯 {title}"
+
+
+@pytest.mark.parametrize('title', TITLES)
+def test_cached_screens_are_valid(title):
+    catalog_row = (1, title, title, '2099-01-01', '10:00', title, 5, 1, 1, 0)
+    text, _ = bot.render_event_card(catalog_row)
+    assert_valid_markdown(text)
+    
+    list_row = (1, title, '2099-01-01', '10:00', title, 5, title, 5)
+    text, _ = bot.render_event_list((list_row,), False, False)
+    assert_valid_markdown(text)
+    
+    assert_valid_markdown(bot.render_admin_event(1, (1, title, '2099-01-01', '10:00', title, 5, 1, 1, 0)))
+    assert_valid_markdown(bot.render_participant(1, (1, '2099-01-01', title, title, title, title, title)))
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    texts = []
+    
+    async def noop(self, *args, **kwargs):
+        return True
+    
+    async def record(self, text, *args, **kwargs):
+        if kwargs.get('parse_mode') == 'Markdown':
+            texts.append(text)
+        return True
+    
+    monkeypatch.setattr(ExtBot, 'initialize', noop)
+    monkeypatch.setattr(ExtBot, 'shutdown', noop)
+    monkeypatch.setattr(CallbackQuery, 'answer', noop)
+    monkeypatch.setattr(CallbackQuery, 'edit_message_text', record)
+    monkeypatch.setattr(Message, 'reply_text', record)
+    return texts
+
+
+def updates(application, user_id):
+    user = User(user_id, 'Волонтер', False)
+    chat = Chat(user_id, 'private')
+    counter = iter(range(1, 1000))
+    
+    def make(data=None, text=None):
+        update_id = next(counter)
+        message = Message(update_id, datetime.datetime.now(), chat, from_user=user, text=text)
+        message.set_bot(application.bot)
+        if data is None:
+            return Update(update_id, message=message)
+        query = CallbackQuery(str(update_id), user, 'chat', message=message, data=data)
+        query.set_bot(application.bot)
+        return Update(update_id, callback_query=query)
+    return make
+
+
+def test_registration_and_cancel_escape_user_text(application, sent):
+    bot.save_user_profile.sync(USER_ID, 'Иван_Иванов', 'Группа *1', '01.01.2000', '+70000000000', '@ivan_ov')
+    event_id = bot.insert_event.sync(TITLE, '', '2099-01-01', '10:00', 'Сквер *у* реки', 5)
+    make = updates(application, USER_ID)
+    
+    async def run():
+        await application.initialize()
+        await application.process_update(make(data=bot.callback_data('my_info')))
+        await application.process_update(make(data=bot.callback_data('event', event_id)))
+        await application.process_update(make(data=bot.callback_data('register', event_id)))
+        await application.process_update(make(text=COMMENT))
+        registered = list(sent)
+        sent.clear()
+        await application.process_update(make(data=bot.callback_data('my_registrations')))
+        registration_id = bot.membership.registration_id(event_id, USER_ID)
+        await application.process_update(make(data=bot.callback_data('cancel_reg', registration_id)))
+        return registered, list(sent)
+    
+    registered, cancelled = asyncio.run(run())
+    
+    assert len(registered) >= 3 and len(cancelled) == 2
+    for text in registered + cancelled:
+        assert_valid_markdown(text)
+    assert 'Иван_Иванов' in visible_text(registered[0])
+    assert COMMENT in visible_text(registered[-1])
+    assert COMMENT in visible_text(cancelled[-1])
+    assert TITLE in visible_text(cancelled[-1])
+
+
+def test_admin_screens_escape_event_text(application, sent):
+    event_id = bot.insert_event.sync(TITLE, 'Описание_с *звездой', '2099-01-01', '10:00', 'Сквер', 5)
+    make = updates(application, bot.ADMIN_ID)
+    
+    async def run():
+        await application.initialize()
+        for action, *args in [('manage', event_id), ('edit_event', event_id), ('delete', event_id),
+                              ('view', event_id), ('admin_list',), ('edit_field', 'desc', event_id)]:
+            await application.process_update(make(data=bot.callback_data(action, *args)))
+        await application.process_update(make(text='Новое *описание_'))
+    
+    asyncio.run(run())
+    assert len(sent) >= 7
+    for text in sent:
+        assert_valid_markdown(text)
+    assert 'Новое *описание_' in visible_text(sent[-1])
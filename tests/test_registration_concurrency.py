@@ -0,0 +1,53 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+CAP = 7
+# Несколько сотен одновременных подтверждений - как после рассылки о новом мероприятии
+CROWD = 500
+
+
+def create_users(db, count):
+    for user_id in range(1, count + 1):
+        db.insert_user.sync(user_id, f'Волонтер {user_id}', None)
+
+
+@pytest.mark.parametrize('volunteers, cap', [(40, 1), (40, CAP), (CROWD, 1), (CROWD, 100)])
+def test_concurrent_registrations_respect_cap(db, volunteers, cap):
+    """Одновременные подтверждения через обработчики бота не занимают лишних мест"""
+    create_users(db, volunteers)
+    event_id = db.insert_event.sync('Субботник', '', '2099-01-01', '10:00', 'Парк', cap)
+    
+    async def register_all():
+        return await asyncio.gather(*(
+            db.register_volunteer(user_id, event_id, '') for user_id in range(1, volunteers + 1)
+        ))
+    
+    results = [status for status, _ in asyncio.run(register_all())]
+    
+    assert results.count(db.REG_OK) == cap
+    assert results.count(db.REG_FULL) == volunteers - cap
+    seats, = db.db_pool.writer.execute('SELECT COUNT(*) FROM registrations WHERE event_id = ?', (event_id,)).fetchone()
+    assert seats == cap
+    assert db.check_registration_counters.sync() == []
+
+
+@pytest.mark.parametrize('volunteers', [40, CROWD])
+def test_concurrent_registrations_from_threads(db, volunteers):
+    """То же из отдельных потоков, минуя пул бота, и с повторными нажатиями"""
+    create_users(db, volunteers)
+    event_id = db.insert_event.sync('Концерт', '', '2099-01-01', '18:00', 'Зал', CAP)
+    
+    attempts = [user_id for user_id in range(1, volunteers + 1) for _ in range(2)]
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        results = list(pool.map(lambda user_id: db.register_volunteer.sync(user_id, event_id, '')[0], attempts))
+    
+    assert results.count(db.REG_OK) == CAP
+    assert set(results) <= {db.REG_OK, db.REG_FULL, db.REG_DUPLICATE}
+    registered = db.db_pool.writer.execute(
+        'SELECT user_id FROM registrations WHERE event_id = ?', (event_id,)
+    ).fetchall()
+    assert len(registered) == len(set(registered)) == CAP
+    assert db.check_registration_counters.sync() == []
+    assert db.load_events.sync([event_id])[0][9] == CAP
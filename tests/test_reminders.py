@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+
+def event_slot(db, hours_ahead):
+    """Дата и время мероприятия через hours_ahead часов (в часовом поясе мероприятий)"""
+    start = datetime.utcnow() + timedelta(hours=db.EVENT_TZ_OFFSET_HOURS + hours_ahead)
+    return start.strftime('%Y-%m-%d'), start.strftime('%H:%M')
+
+
+def reminded_for(db, event_id):
+    return db.db_pool.writer.execute('SELECT reminded_for FROM events WHERE id = ?', (event_id,)).fetchone()[0]
+
+
+def test_short_notice_event_is_not_marked_reminded(db, monkeypatch):
+    monkeypatch.setattr(db, 'REMINDER_HOURS', 24)
+    date, time = event_slot(db, 5)
+    event_id = db.insert_event.sync('Срочный сбор', '', date, time, 'Склад', 0)
+    
+    # Время напоминания уже прошло, записанных нет: ничего не отправлено и не отмечено
+    assert db.enqueue_event_reminder.sync(event_id, f"{date} {time}") == 0
+    assert reminded_for(db, event_id) is None
+    # Записавшимся теперь напоминание не обещается
+    assert not db.reminder_pending(date, time)
+
+
+def test_reminder_goes_to_those_who_were_promised_it(db, monkeypatch):
+    monkeypatch.setattr(db, 'REMINDER_HOURS', 1)
+    date, time = event_slot(db, 3)
+    assert db.reminder_pending(date, time)
+    event_id = db.insert_event.sync('Субботник', '', date, time, 'Парк', 0)
+    for user_id in (1, 2):
+        db.insert_user.sync(user_id, f'Волонтер {user_id}', None)
+        db.register_volunteer.sync(user_id, event_id, '')
+    
+    # Второй записался уже после времени напоминания
+    late = datetime.utcfromtimestamp(db.reminder_timestamp(date, time) + 60).strftime('%Y-%m-%d %H:%M:%S')
+    db.db_pool.writer.execute('UPDATE registrations SET registration_date = ? WHERE user_id = 2', (late,))
+    
+    slot = f"{date} {time}"
+    assert db.enqueue_event_reminder.sync(event_id, slot) == 1
+    assert reminded_for(db, event_id) == slot
+    chats = db.db_pool.writer.execute('SELECT chat_id FROM outbox').fetchall()
+    assert chats == [(1,)]
+    # Повторно напоминание не ставится
+    assert db.enqueue_event_reminder.sync(event_id, slot) is None
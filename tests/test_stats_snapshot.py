@@ -0,0 +1,35 @@
+import asyncio
+
+
+def snapshot(db):
+    return asyncio.run(db.get_admin_stats())
+
+
+def test_profile_saves_do_not_drift_snapshot(db):
+    """Триггеры держат снимок равным полному пересчету при работе через обычные функции"""
+    asyncio.run(db.ensure_user(1, 'Иван', 'ivan'))
+    db.save_user_profile.sync(1, 'Иван Иванов', 'Группа 1', '01.01.2000', '+70000000000', 'ivan')
+    db.save_user_profile.sync(1, 'Иван Иванов', 'Группа 2', '01.01.2000', '+70000000000', 'ivan')
+    db.save_user_profile.sync(2, 'Петр Петров', 'Группа 1', '02.02.2000', '+70000000001', None)
+    
+    event_id = db.insert_event.sync('Субботник', '', '2099-01-01', '10:00', 'Парк', 5)
+    db.insert_event.sync('Концерт', '', '2099-02-01', '18:00', 'Зал', None)
+    db.register_volunteer.sync(1, event_id, '')
+    db.register_volunteer.sync(2, event_id, '')
+    db.toggle_event_registration.sync(event_id)
+    
+    maintained = snapshot(db)
+    assert maintained['users'] == 2
+    
+    db.refresh_stats_snapshot.sync()
+    recomputed = snapshot(db)
+    keys = ('users', 'registrations', 'active_events', 'inactive_events', 'open_events')
+    assert {k: maintained[k] for k in keys} == {k: recomputed[k] for k in keys}
+
+
+def test_profile_save_keeps_created_at(db):
+    db.insert_user.sync(1, 'Иван', 'ivan')
+    db.db_pool.writer.execute("UPDATE users SET created_at = '2020-01-01 00:00:00' WHERE telegram_id = 1")
+    db.save_user_profile.sync(1, 'Иван Иванов', 'Группа 1', '01.01.2000', '+70000000000', 'ivan')
+    created_at, = db.db_pool.writer.execute('SELECT created_at FROM users WHERE telegram_id = 1').fetchone()
+    assert created_at == '2020-01-01 00:00:00'
@@ -0,0 +1,48 @@
+import asyncio
+import datetime
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+
+import bot
+
+USER_ID = 77
+
+
+def callback_update(update_id):
+    user = User(USER_ID, 'Волонтер', False)
+    message = Message(update_id, datetime.datetime.now(), Chat(USER_ID, 'private'), from_user=user)
+    return Update(update_id, callback_query=CallbackQuery(str(update_id), user, 'chat', message=message, data='mm'))
+
+
+def test_dropped_callback_is_answered_and_counted(monkeypatch):
+    answers = []
+    
+    async def answer(self, text=None, *args, **kwargs):
+        answers.append((self.id, text))
+        return True
+    
+    monkeypatch.setattr(CallbackQuery, 'answer', answer)
+    monkeypatch.setattr(bot, 'user_states', bot.UserStateJanitor())
+    processor = bot.PerUserUpdateProcessor(4, user_queue_limit=2)
+    
+    async def run():
+        release = asyncio.Event()
+        handled = []
+        
+        async def handle(update):
+            await release.wait()
+            handled.append(update.update_id)
+        
+        updates = [callback_update(update_id) for update_id in range(1, 5)]
+        tasks = [asyncio.create_task(processor.process_update(update, handle(update))) for update in updates]
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(*tasks)
+        return handled
+    
+    # В очереди пользователя помещаются два обновления, третье и четвертое отброшены
+    assert asyncio.run(run()) == [1, 2]
+    assert processor.dropped == 2
+    assert [query_id for query_id, _ in answers] == ['3', '4']
+    assert all(text.startswith('⏳') for _, text in answers)
+    assert not processor.user_waiting and not processor.user_locks
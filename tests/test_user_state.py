@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+
+import pytest
+from telegram import CallbackQuery, Chat, Message, Update, User
+from telegram.ext import ExtBot
+
+import bot
+
+USER_ID = 4242
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Сообщения, отправленные через bot.send_message"""
+    messages = []
+    
+    async def noop(self, *args, **kwargs):
+        return True
+    
+    async def send_message(self, chat_id, text, *args, **kwargs):
+        messages.append((chat_id, text))
+        return True
+    
+    monkeypatch.setattr(ExtBot, 'initialize', noop)
+    monkeypatch.setattr(ExtBot, 'shutdown', noop)
+    monkeypatch.setattr(ExtBot, 'send_message', send_message)
+    monkeypatch.setattr(CallbackQuery, 'answer', noop)
+    monkeypatch.setattr(CallbackQuery, 'edit_message_text', noop)
+    return messages
+
+
+def menu_update(application, update_id):
+    user = User(USER_ID, 'Волонтер', False)
+    message = Message(update_id, datetime.datetime.now(), Chat(USER_ID, 'private'), from_user=user)
+    query = CallbackQuery(str(update_id), user, 'chat', message=message, data=bot.callback_data('main_menu'))
+    for obj in (message, query):
+        obj.set_bot(application.bot)
+    return Update(update_id, callback_query=query)
+
+
+async def process(application, update_id):
+    """Обновление через обработчик бота - он же отмечает активность пользователя"""
+    update = menu_update(application, update_id)
+    await application.update_processor.do_process_update(update, application.process_update(update))
+
+
+def stored_keys(user_id):
+    cursor = bot.db_pool.writer.execute('SELECT key FROM user_state WHERE user_id = ? ORDER BY key', (user_id,))
+    return [key for key, in cursor]
+
+
+def test_eviction_unloads_user_data_but_keeps_it_saved(application, sent):
+    async def run():
+        await application.initialize()
+        await process(application, 1)
+        application.user_data[USER_ID]['note'] = 'сохранить'
+        application.mark_data_for_update_persistence(user_ids=USER_ID)
+        await application.update_persistence()
+        await application.persistence.flush()
+        
+        # Пользователь молчит дольше USER_STATE_IDLE
+        bot.user_states.activity[USER_ID] -= bot.USER_STATE_IDLE + 1
+        await bot.user_states.sweep(application)
+        await application.persistence.flush()
+        evicted = USER_ID not in application.user_data
+        keys = stored_keys(USER_ID)
+        
+        # Вернувшийся пользователь получает user_data обратно
+        await process(application, 2)
+        return evicted, keys, dict(application.user_data[USER_ID])
+    
+    evicted, keys, restored = asyncio.run(run())
+    assert evicted and bot.user_states.evicted == 1
+    assert keys == ['note']
+    assert restored == {'note': 'сохранить'}
+
+
+def test_expire_clears_flow_keys_of_user_not_loaded_after_restart(application, sent):
+    async def run():
+        await application.initialize()
+        persistence = application.persistence
+        # Строки в базе остались с прошлого запуска, в память пользователь не загружался
+        await persistence.update_user_data(USER_ID, {'registering_event_id': 7, 'note': 'оставить'})
+        await persistence.flush()
+        persistence.unload_user(USER_ID)
+        
+        await bot.user_states.expire(application, USER_ID, USER_ID, 'register')
+        await persistence.flush()
+    
+    asyncio.run(run())
+    assert stored_keys(USER_ID) == ['note']
+    assert USER_ID not in bot.state_persistence.saved
+    assert sent == [(USER_ID, bot.FLOW_EXPIRED['register'][0])]
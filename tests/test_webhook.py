@@ -0,0 +1,167 @@
+import asyncio
+import functools
+import os
+import signal
+import subprocess
+import sys
+
+import pytest
+
+
+class FakeApplication:
+    running = True
+    bot = None
+    
+    def __init__(self):
+        self.update_queue = asyncio.Queue()
+
+
+def request(bot, headers, body=b'{"update_id": 1}'):
+    async def run():
+        application = FakeApplication()
+        result = await bot.handle_webhook_request(application, 'POST', bot.WEBHOOK_PATH, headers, body)
+        return result, application.update_queue.qsize()
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    import bot
+    monkeypatch.setattr(bot, 'WEBHOOK_SECRET', 's3cret_Token-1')
+    return bot
+
+
+def test_valid_secret_is_accepted(bot):
+    (status, _), queued = request(bot, {'x-telegram-bot-api-secret-token': 's3cret_Token-1'})
+    assert status == 200 and queued == 1
+
+
+@pytest.mark.parametrize('token', ['', 'wrong', 'ключ', 's3cret_Token-1\xe9'])
+def test_wrong_or_non_ascii_secret_is_rejected(bot, token):
+    (status, _), queued = request(bot, {'x-telegram-bot-api-secret-token': token})
+    assert status == 403 and queued == 0
+
+
+def test_missing_secret_rejects_everything(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'WEBHOOK_SECRET', '')
+    (status, _), queued = request(bot, {})
+    assert status == 403 and queued == 0
+
+
+@pytest.mark.parametrize('length', ['abc', '-5', '1e3'])
+def test_malformed_content_length_gets_400(bot, length):
+    async def run():
+        server = await asyncio.start_server(
+            functools.partial(bot.serve_webhook_connection, FakeApplication()), '127.0.0.1', 0
+        )
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(
+            f"POST {bot.WEBHOOK_PATH} HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode()
+        )
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), 5)
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return status_line
+    
+    assert asyncio.run(run()).startswith(b'HTTP/1.1 400')
+
+
+def test_webhook_mode_requires_secret():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, BOT_TOKEN='1:test', BOT_MODE='webhook', WEBHOOK_SECRET='')
+    result = subprocess.run(
+        [sys.executable, '-c', 'import bot'], cwd=root, env=env, capture_output=True, text=True
+    )
+    assert result.returncode != 0
+    assert 'WEBHOOK_SECRET' in result.stderr
+
+
+def test_run_webhook_shuts_application_down_before_database(bot, monkeypatch):
+    calls = []
+    
+    class Application(FakeApplication):
+        async def initialize(self):
+            calls.append('initialize')
+        
+        async def start(self):
+            calls.append('start')
+        
+        async def stop(self):
+            calls.append('stop')
+        
+        async def shutdown(self):
+            calls.append('shutdown')
+    
+    async def on_startup(application):
+        calls.append('on_startup')
+    
+    async def on_shutdown(application):
+        calls.append('on_shutdown')
+    
+    monkeypatch.setattr(bot, 'on_startup', on_startup)
+    monkeypatch.setattr(bot, 'on_shutdown', on_shutdown)
+    monkeypatch.setattr(bot, 'WEBHOOK_URL', '')
+    monkeypatch.setattr(bot, 'WEBHOOK_LISTEN', '127.0.0.1')
+    monkeypatch.setattr(bot, 'WEBHOOK_PORT', 0)
+    
+    async def run():
+        asyncio.get_running_loop().call_later(0.1, os.kill, os.getpid(), signal.SIGTERM)
+        await bot.run_webhook(Application())
+    
+    asyncio.run(run())
+    assert calls[-3:] == ['stop', 'shutdown', 'on_shutdown']
+
+
+def exchange(bot, payload, pause=None):
+    """Отправляет payload серверу и возвращает все, что он ответил до закрытия соединения"""
+    async def run():
+        server = await asyncio.start_server(
+            functools.partial(bot.serve_webhook_connection, FakeApplication()), '127.0.0.1', 0,
+            limit=bot.WEBHOOK_MAX_HEADER_BYTES
+        )
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(payload)
+        await writer.drain()
+        if pause:
+            await asyncio.sleep(pause)
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response
+    return asyncio.run(run())
+
+
+def test_idle_keep_alive_connection_is_closed(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'WEBHOOK_IDLE_TIMEOUT', 0.1)
+    response = exchange(bot, b'GET /healthz HTTP/1.1\r\n\r\n')
+    # Ответ на первый запрос пришел, потом сервер сам закрыл простаивающее соединение
+    assert response.startswith(b'HTTP/1.1 200') and response.endswith(b'ok')
+
+
+def test_slow_request_times_out(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'WEBHOOK_READ_TIMEOUT', 0.1)
+    response = exchange(bot, f"POST {bot.WEBHOOK_PATH} HTTP/1.1\r\nContent-Length: 10\r\n\r\n{{".encode())
+    assert response.startswith(b'HTTP/1.1 408')
+
+
+def test_too_many_headers_are_rejected(bot):
+    headers = ''.join(f"X-Header-{i}: {i}\r\n" for i in range(bot.WEBHOOK_MAX_HEADERS + 1))
+    response = exchange(bot, f"GET /healthz HTTP/1.1\r\n{headers}\r\n".encode())
+    assert response.startswith(b'HTTP/1.1 431')
+
+
+def test_oversized_headers_are_rejected(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'WEBHOOK_MAX_HEADER_BYTES', 4096)
+    headers = ''.join(f"X-Big-{i}: {'a' * 1000}\r\n" for i in range(5))
+    response = exchange(bot, f"GET /healthz HTTP/1.1\r\n{headers}\r\n".encode())
+    assert response.startswith(b'HTTP/1.1 431')
+
+
+def test_header_line_longer_than_buffer_is_rejected(bot):
+    response = exchange(bot, f"GET /healthz HTTP/1.1\r\nX-Huge: {'a' * 64 * 1024}\r\n\r\n".encode())
+    assert response.startswith(b'HTTP/1.1 431')